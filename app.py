@@ -1,45 +1,70 @@
 from flask import Flask, redirect, url_for
 from utils.common import ensure_directories, logger
 from routes.main_routes import main_routes
-from models.data_manager import ensure_master_data, ensure_inventory_data, ensure_transactions_data
 from database import db_manager
 from auth import auth, login_manager, authorized_required
 from config import Config
 import os
 
-# 創建並配置應用
-def create_app():
-    app = Flask(__name__)
-    
-    # 從配置類載入設定
-    app.config.from_object(Config)
-    
+# 初始化資料（目錄、資料庫結構和預設資料）
+def initialize_data():
+    """
+    確保目錄與資料庫就緒
+
+    多 worker 部署時由主程序在啟動 worker 前執行一次（見 serve.py），
+    各 worker 以 create_app(initialize=False) 建立應用。
+    """
     # 確保所有必要目錄存在
     ensure_directories()
     
-    # 初始化SQLite資料庫
-    logger.info("初始化SQLite資料庫...")
+    # 初始化SQLite資料庫（結構、索引與預設資料在同一個交易中完成，結構版本相同時直接略過）
     db_manager.init_db()
     
-    # 確保主數據存在
-    ensure_master_data()
+    # 從舊Excel檔案匯入資料(如果需要)
+    import_data_if_needed()
+
+# 創建並配置應用
+def create_app(initialize=True):
+    app = Flask(__name__)
     
-    # 確保庫存資料存在
-    ensure_inventory_data()
+    # 從配置類載入設定
+    app.config.from_object(Config)
     
-    # 確保交易記錄資料表存在
-    ensure_transactions_data()
+    # 初始化資料（已由主程序初始化時跳過）
+    if initialize:
+        initialize_data()
     
-    # 從舊Excel檔案匯入資料(如果需要)
-    import_data_if_needed()
+    # 在背景建立分析立方體
+    from models.analytics_cube import start_background_build
+    start_background_build()
     
     # 初始化登入管理器
     login_manager.init_app(app)
     
+    # 記錄請求延遲與SQL時間（須在登入檢查之前註冊，被重新導向的請求也會計入）
+    from utils.metrics import init_metrics
+    init_metrics(app)
+    
     # 註冊路由藍圖
     app.register_blueprint(auth)
     app.register_blueprint(main_routes)
     
+    # 依瀏覽器支援壓縮回應
+    from utils.compression import init_compression
+    init_compression(app)
+    
+    # 靜態檔案網址加上內容雜湊並長期快取
+    from utils.static_assets import init_static_assets
+    init_static_assets(app)
+
+    # pandas、numpy 延遲到第一次使用才載入，這裡在背景預先載入，第一個報表或查詢不必等待
+    from utils.lazy import preload_in_background
+    preload_in_background('pandas', 'numpy')
+
+    # 雲端模式下在背景認證 Google Drive，不阻塞啟動
+    from utils.cloud.factory import start_background_authentication
+    start_background_authentication()
+
     # 保護所有主要路由需要登入
     @app.before_request
     def require_login():
@@ -50,7 +75,8 @@ def create_app():
         allowed_paths = [
             '/login', 
             '/static/', 
-            '/auth/'
+            '/auth/',
+            '/metrics'
         ]
         
         # 如果路徑是允許匿名訪問的，或用戶已經登入，則允許訪問
@@ -0,0 +1,249 @@
+"""
+合成資料產生工具
+依照 database/core/init.py 的資料表結構，建立一個填滿模擬資料的暫存SQLite資料庫，
+供報表與查詢效能測試使用
+
+使用方式:
+    python -m benchmarks.generate_data --db data/bench/bench.db --staff 8 --farmers 60 --products 400 --years 2
+"""
+import os
+import sys
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+# 讓腳本可以從專案根目錄以外的位置執行
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_PATH not in sys.path:
+    sys.path.insert(0, BASE_PATH)
+
+# 產品單位與各單位的價格倍數
+UNITS = [('把', 1.0), ('顆', 0.5), ('條', 0.6), ('包', 1.5), ('公斤', 2.5), ('箱', 12.0)]
+
+# 各小時的來客權重（0點到23點），早上通勤、中午和傍晚為尖峰
+HOURLY_WEIGHTS = [
+    1, 1, 1, 1, 1, 2,      # 00-05
+    5, 9, 10, 7, 6, 8,     # 06-11
+    9, 7, 6, 6, 7, 10,     # 12-17
+    11, 9, 6, 4, 2, 1      # 18-23
+]
+
+# 星期一到星期日的來客倍數
+WEEKDAY_FACTORS = [0.9, 0.9, 0.95, 1.0, 1.1, 1.35, 1.3]
+
+# 預設班別時間（與 load_default_data 相同）
+SHIFT_BOUNDARIES = [(6, 14, '早班'), (14, 22, '午班')]
+
+# 批次寫入的筆數
+INSERT_BATCH_SIZE = 5000
+
+# 依時間判斷班別
+def shift_for_hour(hour):
+    for start, end, shift in SHIFT_BOUNDARIES:
+        if start <= hour < end:
+            return shift
+    return '晚班'
+
+# 產生員工、廠商和產品主資料
+def build_master_data(rng, staff_count, farmer_count, product_count):
+    """
+    產生員工、廠商和產品
+
+    返回:
+        tuple: (員工列表, 廠商列表, 產品列表)
+    """
+    staff = [(f"員工{i:03d}", round(rng.uniform(0.03, 0.08), 2)) for i in range(1, staff_count + 1)]
+    farmers = [(f"廠商{i:03d}", round(rng.uniform(0.08, 0.20), 2)) for i in range(1, farmer_count + 1)]
+
+    # 每個產品屬於一個廠商，並有一到三種銷售單位
+    products = []
+    product_id = 1
+    for i in range(1, product_count + 1):
+        supplier = farmers[rng.randrange(farmer_count)][0]
+        base_price = rng.choice([10, 15, 20, 25, 30, 35, 40, 50, 60, 80])
+        unit_count = rng.choice([1, 1, 1, 2, 2, 3])
+        for unit, factor in rng.sample(UNITS, unit_count):
+            products.append({
+                'product_id': product_id,
+                'product_name': f"產品{i:04d}",
+                'unit': unit,
+                'unit_price': round(base_price * factor, 1),
+                'supplier': supplier,
+                # 熱銷程度，讓銷售量呈長尾分佈
+                'popularity': rng.paretovariate(1.5)
+            })
+            product_id += 1
+
+    return staff, farmers, products
+
+# 產生交易記錄
+def iter_transactions(rng, staff, farmers, products, start_day, days, sales_per_day):
+    """
+    逐日產生銷售、進貨和退貨交易
+
+    返回:
+        generator: 每次產生一筆交易的參數元組
+    """
+    hours = list(range(24))
+    product_weights = [p['popularity'] for p in products]
+    products_by_supplier = {}
+    for product in products:
+        products_by_supplier.setdefault(product['supplier'], []).append(product)
+
+    # 每個廠商的送貨週期（天）
+    delivery_cycles = {name: rng.randint(3, 7) for name, _ in farmers}
+
+    for day_offset in range(days):
+        current_day = start_day + timedelta(days=day_offset)
+        day_str = current_day.isoformat()
+
+        # 每班排一到兩位員工
+        roster = {}
+        for _, _, shift in SHIFT_BOUNDARIES + [(0, 0, '晚班')]:
+            roster[shift] = [s[0] for s in rng.sample(staff, min(len(staff), rng.choice([1, 2])))]
+
+        # 銷售
+        sale_count = max(0, int(rng.gauss(sales_per_day * WEEKDAY_FACTORS[current_day.weekday()], sales_per_day * 0.15)))
+        sale_hours = sorted(rng.choices(hours, weights=HOURLY_WEIGHTS, k=sale_count))
+        sale_products = rng.choices(products, weights=product_weights, k=sale_count)
+        for hour, product in zip(sale_hours, sale_products):
+            shift = shift_for_hour(hour)
+            quantity = float(rng.choice([1, 1, 1, 1, 2, 2, 3, 5]))
+            time_str = f"{hour:02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+            yield ('銷售', day_str, time_str, rng.choice(roster[shift]), shift,
+                   product['product_id'], product['product_name'], product['unit'],
+                   quantity, product['unit_price'], quantity * product['unit_price'],
+                   product['supplier'], '')
+
+        # 進貨：廠商依各自週期於早上送貨
+        for index, (farmer_name, _) in enumerate(farmers):
+            if (day_offset + index) % delivery_cycles[farmer_name] != 0:
+                continue
+            supplier_products = products_by_supplier.get(farmer_name, [])
+            if not supplier_products:
+                continue
+            for product in rng.sample(supplier_products, min(len(supplier_products), rng.randint(1, 4))):
+                quantity = float(rng.randint(10, 60))
+                time_str = f"{rng.randint(6, 9):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+                yield ('進貨', day_str, time_str, rng.choice(roster['早班']), '',
+                       product['product_id'], product['product_name'], product['unit'],
+                       quantity, product['unit_price'], quantity * product['unit_price'],
+                       product['supplier'], '')
+
+        # 退貨：偶發
+        if rng.random() < 0.15:
+            product = rng.choice(products)
+            quantity = float(rng.randint(1, 5))
+            time_str = f"{rng.randint(8, 20):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+            yield ('退貨', day_str, time_str, rng.choice(staff)[0], '',
+                   product['product_id'], product['product_name'], product['unit'],
+                   quantity, product['unit_price'], quantity * product['unit_price'],
+                   product['supplier'], rng.choice(['品質不良', '過期', '包裝破損', '廠商回收']))
+
+# 建立並填入合成資料庫
+def generate_database(db_path, staff_count, farmer_count, product_count, years, sales_per_day, seed):
+    """
+    建立合成資料庫
+
+    返回:
+        dict: 各資料表的筆數
+    """
+    from database.core import init as db_init
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    # 使用正式的資料表結構建立資料庫
+    db_init.DB_PATH = db_path
+    db_init.init_db()
+
+    rng = random.Random(seed)
+    staff, farmers, products = build_master_data(rng, staff_count, farmer_count, product_count)
+    days = int(round(365 * years))
+    end_day = date.today()
+    start_day = end_day - timedelta(days=days - 1)
+
+    conn = db_init.get_connection()
+    try:
+        # 暫存資料庫不需要交易日誌，加快寫入速度
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        cursor = conn.cursor()
+
+        # 以合成資料取代預設的員工、廠商與庫存
+        cursor.execute("DELETE FROM staff_farmers")
+        cursor.execute("DELETE FROM inventory")
+        cursor.executemany(
+            "INSERT INTO staff_farmers (type, name, commission_rate) VALUES (?, ?, ?)",
+            [('staff', name, rate) for name, rate in staff] + [('farmer', name, rate) for name, rate in farmers]
+        )
+        cursor.executemany(
+            """INSERT INTO inventory (product_id, product_name, unit, quantity, unit_price, supplier)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(p['product_id'], p['product_name'], p['unit'], float(rng.randint(0, 200)), p['unit_price'], p['supplier'])
+             for p in products]
+        )
+
+        # 分批寫入交易記錄
+        insert_sql = """INSERT INTO transactions (transaction_type, date, time, staff, shift,
+                        product_id, product_name, unit, quantity, unit_price, total_price, supplier, return_reason)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+        batch = []
+        transaction_count = 0
+        for row in iter_transactions(rng, staff, farmers, products, start_day, days, sales_per_day):
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                cursor.executemany(insert_sql, batch)
+                transaction_count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert_sql, batch)
+            transaction_count += len(batch)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        'staff': len(staff),
+        'farmers': len(farmers),
+        'inventory': len(products),
+        'transactions': transaction_count,
+        'start_date': start_day.isoformat(),
+        'end_date': end_day.isoformat()
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='產生效能測試用的合成SQLite資料庫')
+    parser.add_argument('--db', required=True, help='輸出的資料庫路徑（會覆蓋既有檔案）')
+    parser.add_argument('--staff', type=int, default=8, help='員工人數')
+    parser.add_argument('--farmers', type=int, default=60, help='廠商數量')
+    parser.add_argument('--products', type=int, default=400, help='產品數量（每個產品有一到三種單位）')
+    parser.add_argument('--years', type=float, default=2, help='交易資料涵蓋的年數')
+    parser.add_argument('--sales-per-day', type=int, default=150, help='平均每日銷售筆數')
+    parser.add_argument('--seed', type=int, default=42, help='亂數種子，相同種子產生相同資料')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 避免誤覆蓋正式資料庫
+    live_db = os.path.join(BASE_PATH, 'data', 'gas_station.db')
+    if os.path.abspath(args.db) == os.path.abspath(live_db):
+        print("錯誤: 不可以覆蓋正式資料庫，請指定其他路徑")
+        return 1
+
+    started = time.perf_counter()
+    counts = generate_database(args.db, args.staff, args.farmers, args.products,
+                               args.years, args.sales_per_day, args.seed)
+    elapsed = time.perf_counter() - started
+
+    print(f"已建立合成資料庫: {args.db}")
+    print(f"員工 {counts['staff']} 位，廠商 {counts['farmers']} 家，庫存 {counts['inventory']} 筆")
+    print(f"交易 {counts['transactions']} 筆（{counts['start_date']} 至 {counts['end_date']}），耗時 {elapsed:.1f} 秒")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
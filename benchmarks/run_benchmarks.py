@@ -0,0 +1,203 @@
+"""
+報表效能測試工具
+針對指定的資料庫量測各報表階段的執行時間與記憶體峰值，結果寫成JSON以便跨版本比較
+
+使用方式:
+    python -m benchmarks.run_benchmarks --db data/bench/bench.db --output bench_results.json
+    python -m benchmarks.run_benchmarks --db data/bench/bench.db --compare bench_results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+# 讓腳本可以從專案根目錄以外的位置執行
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_PATH not in sys.path:
+    sys.path.insert(0, BASE_PATH)
+
+# 結果檔案格式版本
+RESULT_FORMAT_VERSION = 1
+
+# 量測單一階段
+def measure(func, repeat):
+    """
+    重複執行並量測耗時，另外執行一次量測記憶體峰值
+
+    tracemalloc 會明顯拖慢執行速度，所以計時與記憶體量測分開進行。
+
+    參數:
+        func (callable): 要量測的函數
+        repeat (int): 計時的重複次數
+
+    返回:
+        dict: 各次耗時（秒）、統計值與記憶體峰值（位元組）
+    """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': [round(d, 6) for d in durations],
+        'min': round(min(durations), 6),
+        'median': round(statistics.median(durations), 6),
+        'mean': round(statistics.mean(durations), 6),
+        'peak_memory_bytes': peak_memory
+    }
+
+# 取得目前的git版本
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_PATH, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+# 執行所有效能測試階段
+def run_benchmarks(start_date, end_date, repeat):
+    """
+    依序量測資料讀取與報表生成各階段
+
+    返回:
+        dict: 階段名稱對應量測結果
+    """
+    from models.data_manager import read_transactions, read_inventory, read_master_data, iter_transactions
+    from models.report_generator import generate_basic_reports, generate_farmer_detailed_reports
+    from models import report_engine
+
+    period = report_engine.resolve_report_period(start_date=start_date, end_date=end_date)
+    report_data = report_engine.load_report_data(period)
+
+    stages = [
+        ('read_transactions.sales', lambda: read_transactions('銷售', start_date, end_date)),
+        ('read_transactions.purchases', lambda: read_transactions('進貨', start_date, end_date)),
+        ('read_transactions.returns', lambda: read_transactions('退貨', start_date, end_date)),
+        ('read_transactions.all', lambda: read_transactions(None, start_date, end_date)),
+        ('iter_transactions.all', lambda: sum(len(rows) for rows in iter_transactions(None, start_date, end_date))),
+        ('read_inventory', read_inventory),
+        ('read_master_data', lambda: read_master_data('員工廠商')),
+        ('report_engine.load', lambda: report_engine.load_report_data(period)),
+        ('report_engine.basic_memory', lambda: report_engine.write_basic_reports(report_data, report_engine.MemoryReportSink())),
+        ('report_engine.farmer_details_memory',
+         lambda: report_engine.write_farmer_detailed_reports(report_data, report_engine.MemoryReportSink())),
+        ('generate_basic_reports', lambda: generate_basic_reports(start_date=start_date, end_date=end_date)),
+        ('generate_farmer_detailed_reports', lambda: generate_farmer_detailed_reports(start_date=start_date, end_date=end_date)),
+    ]
+
+    results = {}
+    for name, func in stages:
+        print(f"量測 {name} ...", flush=True)
+        results[name] = measure(func, repeat)
+        print(f"  中位數 {results[name]['median']:.3f} 秒，記憶體峰值 {results[name]['peak_memory_bytes'] / 1048576:.1f} MB")
+    return results
+
+# 讀取資料庫的資料量
+def describe_database(db_path):
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    try:
+        info = {}
+        for table in ['staff_farmers', 'inventory', 'transactions']:
+            info[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        info['min_date'], info['max_date'] = conn.execute("SELECT MIN(date), MAX(date) FROM transactions").fetchone()
+        info['size_bytes'] = os.path.getsize(db_path)
+        return info
+    finally:
+        conn.close()
+
+# 比較兩份結果
+def compare_results(baseline, current):
+    """
+    以中位數比較兩份結果，返回可列印的文字行
+    """
+    lines = [f"{'階段':<36}{'基準(秒)':>12}{'本次(秒)':>12}{'變化':>10}{'記憶體變化':>12}"]
+    for name, result in current['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            lines.append(f"{name:<36}{'-':>12}{result['median']:>12.3f}{'新增':>10}")
+            continue
+        change = (result['median'] - base['median']) / base['median'] * 100 if base['median'] else 0
+        mem_change = ((result['peak_memory_bytes'] - base['peak_memory_bytes']) / base['peak_memory_bytes'] * 100
+                      if base['peak_memory_bytes'] else 0)
+        lines.append(f"{name:<36}{base['median']:>12.3f}{result['median']:>12.3f}{change:>+9.1f}%{mem_change:>+11.1f}%")
+    return lines
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='量測報表與查詢的效能')
+    parser.add_argument('--db', required=True, help='要測試的資料庫（建議使用 benchmarks.generate_data 產生）')
+    parser.add_argument('--output', help='結果JSON輸出路徑')
+    parser.add_argument('--compare', help='與先前的結果JSON比較')
+    parser.add_argument('--start-date', help='報表開始日期（預設為資料庫中最早日期）')
+    parser.add_argument('--end-date', help='報表結束日期（預設為資料庫中最晚日期）')
+    parser.add_argument('--repeat', type=int, default=3, help='每個階段重複次數')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"錯誤: 找不到資料庫 {args.db}")
+        return 1
+
+    db_info = describe_database(args.db)
+    start_date = args.start_date or db_info['min_date']
+    end_date = args.end_date or db_info['max_date']
+
+    # 報表寫到暫存目錄，且必須在匯入應用模組之前設定路徑
+    reports_dir = tempfile.mkdtemp(prefix='gas_station_bench_reports_')
+    os.environ['GAS_STATION_DB_PATH'] = os.path.abspath(args.db)
+    os.environ['GAS_STATION_REPORTS_PATH'] = reports_dir
+
+    try:
+        print(f"資料庫: {args.db}，交易 {db_info['transactions']} 筆，期間 {start_date} 至 {end_date}")
+        stages = run_benchmarks(start_date, end_date, args.repeat)
+    finally:
+        shutil.rmtree(reports_dir, ignore_errors=True)
+
+    result = {
+        'format_version': RESULT_FORMAT_VERSION,
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'start_date': start_date,
+            'end_date': end_date,
+            'database': db_info
+        },
+        'stages': stages
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        print('\n'.join(compare_results(baseline, result)))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+啟動時間報告工具
+在新的 Python 程序中量測匯入應用、建立應用與第一個請求的時間，並以 -X importtime 列出最耗時的模組，
+用來確認大型套件（pandas、numpy、Google API）沒有在啟動時被載入
+
+使用方式:
+    python -m benchmarks.startup_report
+    python -m benchmarks.startup_report --db data/bench/bench.db --top 30 --output startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+
+# 讓腳本可以從專案根目錄以外的位置執行
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_PATH not in sys.path:
+    sys.path.insert(0, BASE_PATH)
+
+# 啟動後檢查是否已載入的大型套件
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'googleapiclient', 'google_auth_oauthlib']
+
+# 在子程序中執行的量測程式（每次都是全新的直譯器，不受本程序已匯入的模組影響）
+_MEASURE_SCRIPT = '''
+import sys, json, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+loaded = {{name: name in sys.modules for name in {heavy!r}}}
+app = create_app(initialize={initialize})
+created = time.perf_counter()
+response = app.test_client().get('/login')
+responded = time.perf_counter()
+print(json.dumps({{
+    'import_seconds': round(imported - started, 4),
+    'create_app_seconds': round(created - imported, 4),
+    'first_request_seconds': round(responded - created, 4),
+    'first_request_status': response.status_code,
+    'loaded_after_import': loaded
+}}))
+'''
+
+# 解析 -X importtime 的輸出
+def parse_importtime(stderr):
+    """
+    參數:
+        stderr (str): 子程序的標準錯誤輸出
+
+    返回:
+        list: [{'module', 'self_us', 'cumulative_us'}]，依匯入順序
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            modules.append({
+                'module': name.strip(),
+                'self_us': int(self_us),
+                'cumulative_us': int(cumulative_us)
+            })
+        except ValueError:
+            continue
+    return modules
+
+# 在子程序中量測啟動時間
+def measure_startup(initialize=False, env=None):
+    """
+    參數:
+        initialize (bool): 是否包含資料庫初始化（create_app(initialize=True)）
+        env (dict, optional): 子程序的環境變數
+
+    返回:
+        dict: 各階段時間、啟動時已載入的大型套件與各模組匯入時間
+    """
+    script = _MEASURE_SCRIPT.format(initialize=bool(initialize), heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=BASE_PATH, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else '子程序執行失敗')
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['imports'] = parse_importtime(result.stderr)
+    return timings
+
+# 格式化報告
+def format_report(timings, top):
+    """
+    返回:
+        list: 報告的每一行
+    """
+    imports = timings['imports']
+    lines = [
+        f"匯入應用:   {timings['import_seconds'] * 1000:8.1f} ms",
+        f"建立應用:   {timings['create_app_seconds'] * 1000:8.1f} ms",
+        f"第一個請求: {timings['first_request_seconds'] * 1000:8.1f} ms（/login，狀態碼 {timings['first_request_status']}）",
+        f"匯入的模組: {len(imports)} 個（包含 create_app 之後背景預先載入的模組）",
+        '',
+        '匯入應用後已載入的大型套件:'
+    ]
+    for name, loaded in timings['loaded_after_import'].items():
+        lines.append(f"  {name:<24} {'是' if loaded else '否'}")
+
+    lines.extend(['', f"累計匯入時間最長的 {top} 個模組:"])
+    for item in sorted(imports, key=lambda item: item['cumulative_us'], reverse=True)[:top]:
+        lines.append(f"  {item['cumulative_us'] / 1000:8.1f} ms  {item['module'].strip()}")
+    return lines
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='量測應用啟動時間與模組匯入時間')
+    parser.add_argument('--db', help='使用的資料庫（預設為 GAS_STATION_DB_PATH 或 data/gas_station.db）')
+    parser.add_argument('--top', type=int, default=20, help='列出累計匯入時間最長的模組數')
+    parser.add_argument('--initialize', action='store_true', help='包含資料庫初始化時間')
+    parser.add_argument('--output', help='結果JSON輸出路徑')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    env = dict(os.environ)
+    if args.db:
+        env['GAS_STATION_DB_PATH'] = os.path.abspath(args.db)
+
+    try:
+        timings = measure_startup(args.initialize, env)
+    except RuntimeError as e:
+        print(f"量測失敗: {str(e)}")
+        return 1
+
+    print('\n'.join(format_report(timings, args.top)))
+
+    if args.output:
+        timings['meta'] = {'python': platform.python_version(), 'platform': platform.platform(),
+                           'initialize': args.initialize}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(timings, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.output}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,10 +18,32 @@ def load_config():
 # 載入配置
 config_data = load_config()
 
+# 檢查必要的配置項
+def check_required_config():
+    """
+    檢查 config.json 是否包含啟動所需的設定
+
+    返回:
+        list: 錯誤訊息列表，沒有問題時為空列表
+    """
+    if not config_data:
+        return ["未找到config.json檔案或檔案為空", "請確保config.json檔案存在且包含必要的配置項"]
+    
+    google_config = config_data.get('google_oauth', {})
+    required_vars = ['GOOGLE_CLIENT_ID', 'GOOGLE_CLIENT_SECRET']
+    missing_vars = [var for var in required_vars if not google_config.get(var)]
+    if missing_vars:
+        return [f"缺少以下配置項: {', '.join(missing_vars)}", "請檢查您的config.json檔案是否包含這些項目"]
+    
+    return []
+
 # 應用程式配置
 class Config:
     # 安全設定
-    SECRET_KEY = config_data.get('app', {}).get('SECRET_KEY') or secrets.token_hex(16)
+    # 多 worker 部署時由 serve.py 以環境變數提供同一把密鑰，讓各 worker 的會話互通
+    SECRET_KEY = (config_data.get('app', {}).get('SECRET_KEY')
+                  or os.environ.get('GAS_STATION_SECRET_KEY')
+                  or secrets.token_hex(16))
     
     # Google OAuth 設定
     GOOGLE_CLIENT_ID = config_data.get('google_oauth', {}).get('GOOGLE_CLIENT_ID', '')
@@ -3,161 +3,297 @@ SQLite資料庫初始化模組
 處理資料庫結構和預設資料的建立
 """
 import os
+import time
 import sqlite3
-import pandas as pd
 from utils.common import logger, DATA_PATH
+from utils.metrics import MetricsConnection
+from utils.lazy import lazy_import
 
-# 資料庫檔案路徑
-DB_PATH = os.path.join(DATA_PATH, 'gas_station.db')
+pd = lazy_import('pandas')
+
+# 資料庫檔案路徑（可用環境變數 GAS_STATION_DB_PATH 指定其他資料庫，例如效能測試用的暫存資料庫）
+DB_PATH = os.environ.get('GAS_STATION_DB_PATH') or os.path.join(DATA_PATH, 'gas_station.db')
 
 def get_connection():
-    """建立並返回一個SQLite資料庫連線"""
-    conn = sqlite3.connect(DB_PATH)
+    """建立並返回一個SQLite資料庫連線（查詢次數與時間會記錄到效能指標）"""
+    conn = sqlite3.connect(DB_PATH, factory=MetricsConnection)
     conn.row_factory = sqlite3.Row  # 讓查詢結果以字典形式返回
     return conn
 
-def init_db():
-    """初始化資料庫結構，建立必要的資料表"""
-    logger.info("初始化資料庫...")
-    
-    # 建立連線
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+# 資料庫結構版本（修改資料表、索引或預設資料時加一，下次啟動才會重新執行初始化）
+SCHEMA_VERSION = 3
+
+# 雲端增量同步追蹤的資料表（events 只供即時推送，不同步）
+SYNC_TABLES = ['system_config', 'staff_farmers', 'inventory', 'transactions']
+
+# 本程序已確認為最新結構的資料庫路徑
+_initialized_paths = set()
+
+def init_db(force=False):
+    """
+    一次完成資料庫初始化：檢查結構版本，需要時在同一個交易中建立資料表與索引、補上欄位並載入預設資料
+
+    資料庫的 user_version 已是 SCHEMA_VERSION 時只執行一次 PRAGMA 查詢；同一程序再次呼叫時不查詢資料庫。
+    多個程序同時初始化時以 BEGIN IMMEDIATE 排隊，後執行的程序會看到已更新的版本而略過。
+
+    參數:
+        force (bool): 忽略本程序的記錄重新檢查（例如資料庫內容被備份取代之後）
+
+    返回:
+        bool: 初始化是否成功
+    """
+    db_path = DB_PATH
+    if force:
+        _initialized_paths.discard(db_path)
+    if db_path in _initialized_paths:
+        return True
+
+    started = time.perf_counter()
+    if not upgrade_database(db_path):
+        return False
+    _initialized_paths.add(db_path)
+    logger.info(f"資料庫初始化檢查完成，耗時 {(time.perf_counter() - started) * 1000:.0f} 毫秒")
+    return True
+
+# 將指定的資料庫更新為目前的結構版本
+def upgrade_database(db_path):
+    """
+    也用於還原備份前先更新備份複本的結構（舊版備份的 user_version 為 0，缺少新欄位與同步觸發器）
+
+    參數:
+        db_path (str): 資料庫檔案路徑
+
+    返回:
+        bool: 是否成功（已是目前版本時不寫入）
+    """
+    conn = sqlite3.connect(db_path, factory=MetricsConnection)
+    conn.row_factory = sqlite3.Row
+    # 自行控制交易，資料表、索引與預設資料在同一個交易中完成
+    conn.isolation_level = None
     try:
-        # 建立系統配置資料表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS system_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key TEXT UNIQUE NOT NULL,
-            value TEXT NOT NULL
-        )
-        ''')
-        
-        # 建立員工與廠商資料表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS staff_farmers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            name TEXT NOT NULL,
-            commission_rate REAL NOT NULL,
-            UNIQUE (type, name)
-        )
-        ''')
-        
-        # 建立庫存資料表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inventory (
-            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_name TEXT NOT NULL,
-            unit TEXT NOT NULL,
-            quantity REAL NOT NULL,
-            unit_price REAL NOT NULL,
-            supplier TEXT NOT NULL,
-            UNIQUE (product_name, unit, supplier)
-        )
-        ''')
-        
-        # 建立交易記錄資料表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transaction_type TEXT NOT NULL,
-            date TEXT NOT NULL,
-            time TEXT NOT NULL,
-            staff TEXT NOT NULL,
-            shift TEXT,
-            product_id INTEGER,
-            product_name TEXT NOT NULL,
-            unit TEXT NOT NULL,
-            quantity REAL NOT NULL,
-            unit_price REAL NOT NULL,
-            total_price REAL NOT NULL,
-            supplier TEXT NOT NULL,
-            return_reason TEXT,
-            FOREIGN KEY (product_id) REFERENCES inventory (product_id)
-        )
-        ''')
-        
-        conn.commit()
-        logger.info("資料庫結構初始化完成")
-        
-        # 載入預設資料
-        load_default_data()
-        
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 等待期間其他程序可能已完成初始化
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    cursor = conn.cursor()
+                    _create_schema(cursor)
+                    _load_default_data(cursor)
+                    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    logger.info(f"資料庫結構已由第 {version} 版更新為第 {SCHEMA_VERSION} 版")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        elif version > SCHEMA_VERSION:
+            logger.warning(f"資料庫結構版本 {version} 比程式支援的第 {SCHEMA_VERSION} 版新")
+        return True
     except Exception as e:
-        conn.rollback()
         logger.error(f"初始化資料庫時發生錯誤: {str(e)}")
+        return False
     finally:
         conn.close()
 
+# 建立資料表、欄位與索引（可重複執行）
+def _create_schema(cursor):
+    # 建立系統配置資料表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS system_config (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT UNIQUE NOT NULL,
+        value TEXT NOT NULL
+    )
+    ''')
+    
+    # 建立員工與廠商資料表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS staff_farmers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        name TEXT NOT NULL,
+        commission_rate REAL NOT NULL,
+        UNIQUE (type, name)
+    )
+    ''')
+    
+    # 建立庫存資料表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS inventory (
+        product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_name TEXT NOT NULL,
+        unit TEXT NOT NULL,
+        quantity REAL NOT NULL,
+        unit_price REAL NOT NULL,
+        supplier TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (product_name, unit, supplier)
+    )
+    ''')
+    
+    # 舊資料庫補上庫存版本欄位（每次更新加一，用來偵測同時修改）
+    columns = [row['name'] for row in cursor.execute("PRAGMA table_info(inventory)").fetchall()]
+    if 'version' not in columns:
+        cursor.execute("ALTER TABLE inventory ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    
+    # 建立交易記錄資料表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transaction_type TEXT NOT NULL,
+        date TEXT NOT NULL,
+        time TEXT NOT NULL,
+        staff TEXT NOT NULL,
+        shift TEXT,
+        product_id INTEGER,
+        product_name TEXT NOT NULL,
+        unit TEXT NOT NULL,
+        quantity REAL NOT NULL,
+        unit_price REAL NOT NULL,
+        total_price REAL NOT NULL,
+        supplier TEXT NOT NULL,
+        return_reason TEXT,
+        idempotency_key TEXT,
+        FOREIGN KEY (product_id) REFERENCES inventory (product_id)
+    )
+    ''')
+    
+    # 舊資料庫補上冪等鍵欄位
+    columns = [row['name'] for row in cursor.execute("PRAGMA table_info(transactions)").fetchall()]
+    if 'idempotency_key' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN idempotency_key TEXT")
+    
+    # 冪等鍵唯一索引（收銀台重送同一筆交易時不會重複記錄）
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_idempotency_key
+    ON transactions (idempotency_key) WHERE idempotency_key IS NOT NULL
+    ''')
+    
+    # 建立交易記錄索引（班別銷售查詢依類型、日期和班別篩選）
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_transactions_type_date_shift
+    ON transactions (transaction_type, date, shift)
+    ''')
+    
+    # 建立事件資料表（庫存與銷售變動，供 /api/stream 跨 worker 推送）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''')
+    
+    # 建立雲端同步中繼資料與變更清單（增量同步上傳變更過的資料列，見 utils/cloud/sqlite/delta_sync.py）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_changelog (
+        change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL
+    )
+    ''')
+    
+    # 變更觸發器只在啟用增量同步後記錄（sync_meta.tracking = '1'），本地模式不會累積變更清單
+    for table in SYNC_TABLES:
+        tracking = "(SELECT value FROM sync_meta WHERE key = 'tracking') = '1'"
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS sync_{table}_insert AFTER INSERT ON {table} WHEN {tracking}
+        BEGIN
+            INSERT INTO sync_changelog (table_name, row_id) VALUES ('{table}', NEW.rowid);
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS sync_{table}_update AFTER UPDATE ON {table} WHEN {tracking}
+        BEGIN
+            INSERT INTO sync_changelog (table_name, row_id) SELECT '{table}', OLD.rowid WHERE OLD.rowid != NEW.rowid;
+            INSERT INTO sync_changelog (table_name, row_id) VALUES ('{table}', NEW.rowid);
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS sync_{table}_delete AFTER DELETE ON {table} WHEN {tracking}
+        BEGIN
+            INSERT INTO sync_changelog (table_name, row_id) VALUES ('{table}', OLD.rowid);
+        END
+        ''')
+
 def load_default_data():
     """如果資料表是空的，載入預設資料"""
     conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # 檢查系統配置是否為空
-        cursor.execute("SELECT COUNT(*) FROM system_config")
-        if cursor.fetchone()[0] == 0:
-            # 載入預設配置
-            config_data = [
-                ('morning_shift_start', '06:00'),
-                ('morning_shift_end', '14:00'),
-                ('afternoon_shift_start', '14:00'),
-                ('afternoon_shift_end', '22:00'),
-                ('night_shift_start', '22:00'),
-                ('night_shift_end', '06:00')
-            ]
-            cursor.executemany(
-                "INSERT INTO system_config (key, value) VALUES (?, ?)",
-                config_data
-            )
-            logger.info("已載入預設系統配置")
-        
-        # 檢查員工與廠商是否為空
-        cursor.execute("SELECT COUNT(*) FROM staff_farmers")
-        if cursor.fetchone()[0] == 0:
-            # 載入預設員工與廠商
-            staff_farmers_data = [
-                ('staff', '王小明', 0.05),
-                ('staff', '李小華', 0.05),
-                ('staff', '張大力', 0.05),
-                ('farmer', '有機農場', 0.15),
-                ('farmer', '綠色蔬果', 0.12),
-                ('farmer', '友善耕作', 0.10)
-            ]
-            cursor.executemany(
-                "INSERT INTO staff_farmers (type, name, commission_rate) VALUES (?, ?, ?)",
-                staff_farmers_data
-            )
-            logger.info("已載入預設員工與廠商資料")
-        
-        # 檢查庫存是否為空
-        cursor.execute("SELECT COUNT(*) FROM inventory")
-        if cursor.fetchone()[0] == 0:
-            # 載入預設庫存
-            inventory_data = [
-                ('有機小白菜', '把', 20, 35, '有機農場'),
-                ('有機青菜', '把', 15, 30, '有機農場'),
-                ('有機紅蘿蔔', '公斤', 30, 60, '綠色蔬果'),
-                ('有機紅蘿蔔', '條', 40, 20, '綠色蔬果'),
-                ('有機番茄', '公斤', 25, 70, '綠色蔬果'),
-                ('有機番茄', '顆', 50, 15, '綠色蔬果'),
-                ('有機馬鈴薯', '公斤', 40, 45, '友善耕作'),
-                ('新鮮蘋果', '顆', 50, 20, '有機農場'),
-                ('新鮮蘋果', '箱', 5, 400, '有機農場'),
-                ('新鮮蘋果', '公斤', 10, 80, '有機農場')
-            ]
-            cursor.executemany(
-                "INSERT INTO inventory (product_name, unit, quantity, unit_price, supplier) VALUES (?, ?, ?, ?, ?)",
-                inventory_data
-            )
-            logger.info("已載入預設庫存資料")
-        
+        _load_default_data(cursor)
         conn.commit()
     except Exception as e:
         conn.rollback()
         logger.error(f"載入預設資料時發生錯誤: {str(e)}")
     finally:
         conn.close()
+
+# 在指定的游標（交易）中載入預設資料
+def _load_default_data(cursor):
+    # 檢查系統配置是否為空
+    cursor.execute("SELECT COUNT(*) FROM system_config")
+    if cursor.fetchone()[0] == 0:
+        # 載入預設配置
+        config_data = [
+            ('morning_shift_start', '06:00'),
+            ('morning_shift_end', '14:00'),
+            ('afternoon_shift_start', '14:00'),
+            ('afternoon_shift_end', '22:00'),
+            ('night_shift_start', '22:00'),
+            ('night_shift_end', '06:00')
+        ]
+        cursor.executemany(
+            "INSERT INTO system_config (key, value) VALUES (?, ?)",
+            config_data
+        )
+        logger.info("已載入預設系統配置")
+    
+    # 檢查員工與廠商是否為空
+    cursor.execute("SELECT COUNT(*) FROM staff_farmers")
+    if cursor.fetchone()[0] == 0:
+        # 載入預設員工與廠商
+        staff_farmers_data = [
+            ('staff', '王小明', 0.05),
+            ('staff', '李小華', 0.05),
+            ('staff', '張大力', 0.05),
+            ('farmer', '有機農場', 0.15),
+            ('farmer', '綠色蔬果', 0.12),
+            ('farmer', '友善耕作', 0.10)
+        ]
+        cursor.executemany(
+            "INSERT INTO staff_farmers (type, name, commission_rate) VALUES (?, ?, ?)",
+            staff_farmers_data
+        )
+        logger.info("已載入預設員工與廠商資料")
+    
+    # 檢查庫存是否為空
+    cursor.execute("SELECT COUNT(*) FROM inventory")
+    if cursor.fetchone()[0] == 0:
+        # 載入預設庫存
+        inventory_data = [
+            ('有機小白菜', '把', 20, 35, '有機農場'),
+            ('有機青菜', '把', 15, 30, '有機農場'),
+            ('有機紅蘿蔔', '公斤', 30, 60, '綠色蔬果'),
+            ('有機紅蘿蔔', '條', 40, 20, '綠色蔬果'),
+            ('有機番茄', '公斤', 25, 70, '綠色蔬果'),
+            ('有機番茄', '顆', 50, 15, '綠色蔬果'),
+            ('有機馬鈴薯', '公斤', 40, 45, '友善耕作'),
+            ('新鮮蘋果', '顆', 50, 20, '有機農場'),
+            ('新鮮蘋果', '箱', 5, 400, '有機農場'),
+            ('新鮮蘋果', '公斤', 10, 80, '有機農場')
+        ]
+        cursor.executemany(
+            "INSERT INTO inventory (product_name, unit, quantity, unit_price, supplier) VALUES (?, ?, ?, ?, ?)",
+            inventory_data
+        )
+        logger.info("已載入預設庫存資料")
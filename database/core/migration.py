@@ -3,9 +3,11 @@ SQLite資料庫遷移模組
 處理從Excel到SQLite的資料遷移
 """
 import os
-import pandas as pd
 from utils.common import logger, DATA_PATH
 from database.core.init import get_connection
+from utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 def import_from_excel():
     """從現有的Excel檔案匯入資料到SQLite資料庫"""
@@ -2,9 +2,11 @@
 SQLite資料庫查詢模組
 處理資料庫查詢和DataFrame轉換
 """
-import pandas as pd
 from utils.common import logger
 from database.core.init import get_connection
+from utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 def query_to_dataframe(query, params=()):
     """執行SQL查詢並將結果轉換為DataFrame"""
@@ -0,0 +1,344 @@
+"""
+分析立方體模組
+將交易記錄彙總成記憶體中的多維度資料（類型 × 日期 × 班別 × 員工 × 廠商 × 產品），
+以 NumPy 陣列保存，提供毫秒等級的切片與分組查詢
+
+啟動時以 GROUP BY 從資料庫建立一次，之後每筆新交易直接加入，
+查詢前再以交易ID補上其他程序寫入的交易
+"""
+import time
+import threading
+from utils.common import logger
+from utils.lazy import lazy_import
+from database import db_manager
+
+np = lazy_import('numpy')
+
+# 以字典編碼的維度（日期另外以 YYYYMMDD 整數保存，方便範圍篩選）
+DIMENSIONS = ['type', 'shift', 'staff', 'supplier', 'product']
+
+# 可用來分組的維度
+GROUP_DIMENSIONS = ['type', 'date', 'month', 'shift', 'staff', 'supplier', 'product']
+
+# 初始陣列容量
+INITIAL_CAPACITY = 4096
+
+# 重複座標超過此比例時壓縮陣列
+COMPACT_RATIO = 0.5
+
+# 建立或補齊立方體使用的彙總查詢
+_AGGREGATE_SQL = """
+    SELECT transaction_type, date, shift, staff, supplier, product_name,
+           SUM(quantity), SUM(total_price), COUNT(*)
+    FROM transactions
+    WHERE transaction_id > ? AND transaction_id <= ?
+    GROUP BY transaction_type, date, shift, staff, supplier, product_name
+"""
+
+# 將日期字串轉換為整數
+def _date_key(date_str):
+    try:
+        return int(str(date_str)[:10].replace('-', ''))
+    except ValueError:
+        return 0
+
+# 將整數日期轉回字串
+def _date_label(date_key):
+    return f"{date_key // 10000:04d}-{date_key // 100 % 100:02d}-{date_key % 100:02d}"
+
+class AnalyticsCube:
+    """
+    稀疏的交易彙總立方體
+
+    每個不同的維度組合佔一列，維度以整數代碼保存，
+    數量、金額、筆數三個量值以 float64 陣列保存。
+    新交易直接附加在陣列後面（相同組合可重複出現），
+    查詢時以 bincount 重新分組，重複列過多時再壓縮。
+    """
+
+    def __init__(self):
+        # 陣列在第一次 build() 時才配置，匯入模組時不載入 NumPy；
+        # 建立前 record_transaction 不做任何事，query 會先建立
+        self._lock = threading.RLock()
+        self._built = False
+
+    # 配置空的陣列與代碼表
+    def _reset(self):
+        self._labels = {dim: [] for dim in DIMENSIONS}
+        self._codes = {dim: {} for dim in DIMENSIONS}
+        self._coords = {dim: np.zeros(INITIAL_CAPACITY, dtype=np.int32) for dim in DIMENSIONS}
+        self._dates = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._quantity = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self._amount = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self._count = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self._size = 0
+        self._compacted_size = 0
+        self._last_transaction_id = 0
+        # 直接加入但交易ID不連續的交易（等待補齊前面的交易）
+        self._applied_ahead = set()
+
+    # 取得維度值的代碼
+    def _encode(self, dim, label):
+        label = label or ''
+        code = self._codes[dim].get(label)
+        if code is None:
+            code = len(self._labels[dim])
+            self._codes[dim][label] = code
+            self._labels[dim].append(label)
+        return code
+
+    # 確保陣列容量足夠
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._amount)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for dim in DIMENSIONS:
+            self._coords[dim] = np.resize(self._coords[dim], capacity)
+        self._dates = np.resize(self._dates, capacity)
+        self._quantity = np.resize(self._quantity, capacity)
+        self._amount = np.resize(self._amount, capacity)
+        self._count = np.resize(self._count, capacity)
+
+    # 附加彙總列
+    def _append_rows(self, rows):
+        """rows: (類型, 日期, 班別, 員工, 廠商, 產品, 數量, 金額, 筆數) 的列表"""
+        if not rows:
+            return
+        self._reserve(len(rows))
+        start, end = self._size, self._size + len(rows)
+        for dim_index, dim in enumerate(DIMENSIONS):
+            source_index = dim_index if dim_index == 0 else dim_index + 1
+            self._coords[dim][start:end] = [self._encode(dim, row[source_index]) for row in rows]
+        self._dates[start:end] = [_date_key(row[1]) for row in rows]
+        self._quantity[start:end] = [row[6] or 0 for row in rows]
+        self._amount[start:end] = [row[7] or 0 for row in rows]
+        self._count[start:end] = [row[8] for row in rows]
+        self._size = end
+
+    # 從資料庫讀取指定交易ID範圍的彙總
+    def _load_range(self, after_id, upto_id):
+        conn = db_manager.get_connection()
+        try:
+            return [tuple(row) for row in conn.execute(_AGGREGATE_SQL, (after_id, upto_id)).fetchall()]
+        finally:
+            conn.close()
+
+    # 取得資料庫中最大的交易ID
+    def _max_transaction_id(self):
+        conn = db_manager.get_connection()
+        try:
+            result = conn.execute("SELECT MAX(transaction_id) FROM transactions").fetchone()
+            return result[0] or 0
+        finally:
+            conn.close()
+
+    # 建立立方體
+    def build(self):
+        """從交易資料表重新建立整個立方體"""
+        with self._lock:
+            started = time.perf_counter()
+            self._reset()
+            upto_id = self._max_transaction_id()
+            self._append_rows(self._load_range(0, upto_id))
+            self._compacted_size = self._size
+            self._last_transaction_id = upto_id
+            self._built = True
+            logger.info(f"分析立方體建立完成，共 {self._size} 個組合，"
+                        f"最後交易ID {upto_id}，耗時 {(time.perf_counter() - started) * 1000:.0f} 毫秒")
+
+    # 補上尚未加入的交易
+    def sync(self):
+        """
+        讀取交易ID大於目前進度的交易並加入立方體
+
+        同一程序寫入的交易已由 record_transaction 直接加入，
+        這裡主要補上其他程序（其他 worker）寫入的交易。
+
+        返回:
+            int: 新加入的交易筆數
+        """
+        with self._lock:
+            if not self._built:
+                self.build()
+                return 0
+
+            upto_id = self._max_transaction_id()
+            if upto_id <= self._last_transaction_id:
+                return 0
+
+            if self._applied_ahead:
+                # 有直接加入的交易夾在範圍中，逐段讀取以跳過它們
+                rows = []
+                after_id = self._last_transaction_id
+                for skip_id in sorted(i for i in self._applied_ahead if i <= upto_id):
+                    rows.extend(self._load_range(after_id, skip_id - 1))
+                    after_id = skip_id
+                rows.extend(self._load_range(after_id, upto_id))
+                self._applied_ahead = {i for i in self._applied_ahead if i > upto_id}
+            else:
+                rows = self._load_range(self._last_transaction_id, upto_id)
+
+            self._append_rows(rows)
+            self._last_transaction_id = upto_id
+            self._maybe_compact()
+            return sum(row[8] for row in rows)
+
+    # 直接加入一筆新交易
+    def record_transaction(self, transaction_data):
+        """
+        將剛寫入資料庫的交易直接加入立方體，不需要再查詢資料庫
+
+        參數:
+            transaction_data (dict): add_transaction 使用的交易資料（含交易ID）
+        """
+        with self._lock:
+            if not self._built:
+                return
+            transaction_id = transaction_data.get('交易ID')
+            if not transaction_id or transaction_id <= self._last_transaction_id:
+                return
+            self._append_rows([(
+                transaction_data.get('交易類型'), str(transaction_data.get('日期')),
+                transaction_data.get('班別', ''), transaction_data.get('員工'),
+                transaction_data.get('供應商'), transaction_data.get('產品名稱'),
+                float(transaction_data.get('數量') or 0), float(transaction_data.get('總價') or 0), 1
+            )])
+            if transaction_id == self._last_transaction_id + 1:
+                self._last_transaction_id = transaction_id
+                # 推進到連續的已加入交易之後
+                while self._last_transaction_id + 1 in self._applied_ahead:
+                    self._last_transaction_id += 1
+                    self._applied_ahead.discard(self._last_transaction_id)
+            else:
+                self._applied_ahead.add(transaction_id)
+            self._maybe_compact()
+
+    # 合併重複的維度組合
+    def _maybe_compact(self):
+        if self._size - self._compacted_size <= max(INITIAL_CAPACITY, self._compacted_size * COMPACT_RATIO):
+            return
+        size = self._size
+        keys = np.stack([self._coords[dim][:size] for dim in DIMENSIONS] + [self._dates[:size]], axis=1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        quantity = np.bincount(inverse, weights=self._quantity[:size])
+        amount = np.bincount(inverse, weights=self._amount[:size])
+        count = np.bincount(inverse, weights=self._count[:size])
+        new_size = len(unique_keys)
+        for dim_index, dim in enumerate(DIMENSIONS):
+            self._coords[dim][:new_size] = unique_keys[:, dim_index]
+        self._dates[:new_size] = unique_keys[:, len(DIMENSIONS)]
+        self._quantity[:new_size] = quantity
+        self._amount[:new_size] = amount
+        self._count[:new_size] = count
+        self._size = self._compacted_size = new_size
+
+    # 取得分組維度的值
+    def _group_values(self, dim, mask):
+        if dim == 'date':
+            return self._dates[:self._size][mask], _date_label
+        if dim == 'month':
+            return self._dates[:self._size][mask] // 100, lambda key: f"{key // 100:04d}-{key % 100:02d}"
+        labels = self._labels[dim]
+        return self._coords[dim][:self._size][mask], lambda code: labels[code]
+
+    # 查詢
+    def query(self, group_by=None, start_date=None, end_date=None, filters=None, limit=None):
+        """
+        依條件篩選並分組加總
+
+        參數:
+            group_by (list, optional): 分組維度，可用 GROUP_DIMENSIONS 中的值
+            start_date (str, optional): 開始日期（含）
+            end_date (str, optional): 結束日期（含）
+            filters (dict, optional): 維度篩選，例如 {'type': '銷售', 'shift': '早班'}
+            limit (int, optional): 依金額排序後最多返回的筆數
+
+        返回:
+            dict: {'rows': [...], 'totals': {...}, 'last_transaction_id': int}
+        """
+        group_by = [dim for dim in (group_by or []) if dim in GROUP_DIMENSIONS]
+        self.sync()
+
+        with self._lock:
+            size = self._size
+            mask = np.ones(size, dtype=bool)
+            if start_date:
+                mask &= self._dates[:size] >= _date_key(start_date)
+            if end_date:
+                mask &= self._dates[:size] <= _date_key(end_date)
+            for dim, value in (filters or {}).items():
+                if dim not in DIMENSIONS or value in (None, ''):
+                    continue
+                code = self._codes[dim].get(value)
+                if code is None:
+                    mask[:] = False
+                    break
+                mask &= self._coords[dim][:size] == code
+
+            quantity = self._quantity[:size][mask]
+            amount = self._amount[:size][mask]
+            count = self._count[:size][mask]
+            totals = {
+                'quantity': float(quantity.sum()),
+                'amount': float(amount.sum()),
+                'count': int(count.sum())
+            }
+
+            if not group_by:
+                return {'rows': [], 'totals': totals, 'last_transaction_id': self._last_transaction_id}
+
+            # 每個分組維度先轉成連續代碼，再合併成單一分組鍵
+            uniques, inverses, formatters = [], [], []
+            for dim in group_by:
+                values, formatter = self._group_values(dim, mask)
+                unique_values, inverse = np.unique(values, return_inverse=True)
+                uniques.append(unique_values)
+                inverses.append(inverse)
+                formatters.append(formatter)
+
+            if len(amount):
+                group_keys = np.ravel_multi_index(inverses, [len(u) for u in uniques])
+                unique_keys, group_index = np.unique(group_keys, return_inverse=True)
+            else:
+                unique_keys = group_index = np.zeros(0, dtype=np.int64)
+            group_amount = np.bincount(group_index, weights=amount, minlength=len(unique_keys))
+            group_quantity = np.bincount(group_index, weights=quantity, minlength=len(unique_keys))
+            group_count = np.bincount(group_index, weights=count, minlength=len(unique_keys))
+
+            order = np.argsort(-group_amount, kind='stable')
+            if limit:
+                order = order[:limit]
+
+            unravelled = np.unravel_index(unique_keys, [len(u) for u in uniques]) if len(unique_keys) else []
+            rows = []
+            for i in order:
+                row = {dim: formatters[d](uniques[d][unravelled[d][i]].item()) for d, dim in enumerate(group_by)}
+                row['quantity'] = float(group_quantity[i])
+                row['amount'] = float(group_amount[i])
+                row['count'] = int(group_count[i])
+                rows.append(row)
+
+            return {'rows': rows, 'totals': totals, 'last_transaction_id': self._last_transaction_id}
+
+# 全域立方體
+cube = AnalyticsCube()
+
+# 在背景建立立方體，不延遲應用啟動
+def start_background_build():
+    def build():
+        try:
+            cube.build()
+        except Exception as e:
+            logger.error(f"建立分析立方體時出錯: {str(e)}")
+    threading.Thread(target=build, name='analytics-cube-build', daemon=True).start()
+
+# 將新交易加入立方體（由 add_transaction 在寫入後呼叫）
+def record_transaction(transaction_data):
+    try:
+        cube.record_transaction(transaction_data)
+    except Exception as e:
+        logger.error(f"更新分析立方體時出錯: {str(e)}")
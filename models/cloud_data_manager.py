@@ -3,22 +3,12 @@
 整合 Google Drive 雲端儲存功能的數據管理模組
 """
 import os
-import pandas as pd
 from utils.common import DATA_PATH, logger
-from utils.cloud.excel_manager import CloudExcelManager
-from utils.cloud.google_drive_connector import GoogleDriveConnector
-from utils.cloud.cloud_config_manager import CloudConfigManager
-from utils.cloud.sync_manager import SyncManager
+from utils.cloud.factory import get_cloud_config, get_excel_manager, get_sync_manager
 from models.data_manager import ensure_excel_file
+from utils.lazy import lazy_import
 
-# 雲端配置管理器
-cloud_config = CloudConfigManager()
-drive_connector = GoogleDriveConnector(
-    credentials_path=cloud_config.get("credentials_path"),
-    token_path=cloud_config.get("token_path")
-)
-excel_manager = CloudExcelManager(drive_connector)
-sync_manager = SyncManager(drive_connector, excel_manager, cloud_config)
+pd = lazy_import('pandas')
 
 # 讀取主數據文件中的指定sheet
 def read_master_data(sheet_name):
@@ -36,9 +26,9 @@ def read_master_data(sheet_name):
     
     try:
         # 檢查是否啟用雲端模式
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 從雲端讀取
-            df = excel_manager.read_excel_with_fallback(remote_path, master_data_path, sheet_name)
+            df = get_excel_manager().read_excel_with_fallback(remote_path, master_data_path, sheet_name)
             if df is not None:
                 return df
             logger.warning(f"從雲端讀取主數據 {sheet_name} 失敗，嘗試使用本地文件")
@@ -64,9 +54,9 @@ def read_inventory():
     
     try:
         # 檢查是否啟用雲端模式
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 從雲端讀取
-            df = excel_manager.read_excel_with_fallback(remote_path, inventory_path)
+            df = get_excel_manager().read_excel_with_fallback(remote_path, inventory_path)
             if df is not None:
                 return df
             logger.warning("從雲端讀取庫存數據失敗，嘗試使用本地文件")
@@ -97,9 +87,9 @@ def read_transactions(transaction_type=None, start_date=None, end_date=None):
     
     try:
         # 檢查是否啟用雲端模式
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 從雲端讀取
-            df = excel_manager.read_excel_with_fallback(remote_path, transactions_path)
+            df = get_excel_manager().read_excel_with_fallback(remote_path, transactions_path)
             if df is not None:
                 # 根據交易類型過濾
                 if transaction_type:
@@ -155,12 +145,12 @@ def save_master_data(df, sheet_name):
     
     try:
         # 檢查是否啟用雲端模式
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 寫入雲端
-            success = excel_manager.update_excel_sheet(df, remote_path, sheet_name)
+            success = get_excel_manager().update_excel_sheet(df, remote_path, sheet_name)
             if success:
                 # 同步到本地
-                excel_manager._sync_cloud_to_local(remote_path, master_data_path)
+                get_excel_manager()._sync_cloud_to_local(remote_path, master_data_path)
                 logger.info(f"已更新主數據 {sheet_name} 到雲端和本地")
                 return True
             logger.warning(f"寫入主數據 {sheet_name} 到雲端失敗，嘗試使用本地文件")
@@ -204,12 +194,12 @@ def save_inventory(df):
     
     try:
         # 檢查是否啟用雲端模式
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 寫入雲端
-            success = excel_manager.write_excel(df, remote_path)
+            success = get_excel_manager().write_excel(df, remote_path)
             if success:
                 # 同步到本地
-                excel_manager._sync_cloud_to_local(remote_path, inventory_path)
+                get_excel_manager()._sync_cloud_to_local(remote_path, inventory_path)
                 logger.info("已更新庫存數據到雲端和本地")
                 return True
             logger.warning("寫入庫存數據到雲端失敗，嘗試使用本地文件")
@@ -238,9 +228,9 @@ def add_transaction(transaction_data):
     
     try:
         # 檢查是否啟用雲端模式
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 從雲端讀取現有數據
-            df = excel_manager.read_excel_with_fallback(remote_path, transactions_path)
+            df = get_excel_manager().read_excel_with_fallback(remote_path, transactions_path)
         else:
             # 從本地讀取現有數據
             from models.data_manager import ensure_transactions_data
@@ -261,12 +251,12 @@ def add_transaction(transaction_data):
         df = pd.concat([df, new_transaction], ignore_index=True)
         
         # 保存更新後的交易記錄
-        if cloud_config.is_cloud_mode():
+        if get_cloud_config().is_cloud_mode():
             # 寫入雲端
-            success = excel_manager.write_excel(df, remote_path)
+            success = get_excel_manager().write_excel(df, remote_path)
             if success:
                 # 同步到本地
-                excel_manager._sync_cloud_to_local(remote_path, transactions_path)
+                get_excel_manager()._sync_cloud_to_local(remote_path, transactions_path)
                 logger.info(f"已添加交易記錄到雲端和本地，ID: {transaction_id}")
                 return transaction_id
             logger.warning("寫入交易記錄到雲端失敗，嘗試使用本地文件")
@@ -305,7 +295,7 @@ def toggle_cloud_mode(enabled=None):
     返回:
         bool: 切換後的狀態
     """
-    return cloud_config.toggle_cloud_mode(enabled)
+    return get_cloud_config().toggle_cloud_mode(enabled)
 
 # 檢查是否處於雲端模式
 def is_cloud_mode():
@@ -315,7 +305,7 @@ def is_cloud_mode():
     返回:
         bool: 是否啟用雲端模式
     """
-    return cloud_config.is_cloud_mode()
+    return get_cloud_config().is_cloud_mode()
 
 # 檢查雲端連接狀態
 def check_cloud_connection():
@@ -325,4 +315,4 @@ def check_cloud_connection():
     返回:
         bool: 連接是否正常
     """
-    return sync_manager.update_connection_status()
+    return get_sync_manager().update_connection_status()
@@ -1,43 +1,32 @@
 import os
-import pandas as pd
 from utils.common import DATA_PATH, logger
+from utils.metrics import INVENTORY_CONFLICTS, INVENTORY_CONFLICT_FAILURES
 from database import db_manager
+from utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+class InventoryConflictError(Exception):
+    """保存庫存時部分產品已被其他交易或管理者修改"""
+
+    def __init__(self, product_ids):
+        super().__init__(f"產品已被修改: {', '.join(str(product_id) for product_id in product_ids)}")
+        self.product_ids = list(product_ids)
 
 # 確保主數據存在
 def ensure_master_data():
-    """確保主數據（系統配置、員工廠商）存在"""
-    # 檢查系統配置表中是否有資料
-    result = db_manager.execute_query("SELECT COUNT(*) FROM system_config")
-    if result and result[0][0] > 0:
-        return True
-    
-    # 如果沒有資料，載入預設資料
-    db_manager.load_default_data()
-    return True
+    """確保主數據（系統配置、員工廠商）存在（由 init_db 一次完成，同一程序只檢查一次）"""
+    return db_manager.init_db()
 
 # 確保庫存資料存在
 def ensure_inventory_data():
-    """確保庫存資料存在"""
-    # 檢查庫存表中是否有資料
-    result = db_manager.execute_query("SELECT COUNT(*) FROM inventory")
-    if result and result[0][0] > 0:
-        return True
-    
-    # 如果沒有資料，載入預設資料
-    db_manager.load_default_data()
-    return True
+    """確保庫存資料存在（由 init_db 一次完成，同一程序只檢查一次）"""
+    return db_manager.init_db()
 
 # 確保交易記錄資料表存在
 def ensure_transactions_data():
-    """確保交易記錄資料表存在"""
-    # 檢查交易記錄表是否存在
-    result = db_manager.execute_query("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
-    if result:
-        return True
-    
-    # 如果表不存在，重新初始化資料庫
-    db_manager.init_db()
-    return True
+    """確保交易記錄資料表存在（由 init_db 一次完成，同一程序只檢查一次）"""
+    return db_manager.init_db()
 
 # 讀取主數據中的指定資料
 def read_master_data(sheet_name):
@@ -61,14 +50,20 @@ def read_master_data(sheet_name):
         return pd.DataFrame()
 
 # 讀取庫存資料
-def read_inventory():
-    """讀取庫存資料"""
+def read_inventory(include_version=False):
+    """
+    讀取庫存資料
+
+    參數:
+        include_version (bool): 是否包含「版本」欄位（庫存管理頁面保存時用來偵測同時修改）
+    """
     ensure_inventory_data()  # 確保資料存在
     
     try:
-        df = db_manager.query_to_dataframe("""
+        version_column = ", version AS 版本" if include_version else ""
+        df = db_manager.query_to_dataframe(f"""
             SELECT product_id AS 產品編號, product_name AS 產品名稱, unit AS 單位, 
-                   quantity AS 數量, unit_price AS 單價, supplier AS 供應商
+                   quantity AS 數量, unit_price AS 單價, supplier AS 供應商{version_column}
             FROM inventory
         """)
         return df
@@ -76,37 +71,51 @@ def read_inventory():
         logger.error(f"讀取庫存資料時出錯: {str(e)}")
         return pd.DataFrame()
 
+# 交易記錄查詢欄位（資料庫欄位與中文欄位名稱對照）
+TRANSACTION_COLUMNS = """
+    transaction_id AS 交易ID, transaction_type AS 交易類型, date AS 日期, time AS 時間,
+    staff AS 員工, shift AS 班別, product_id AS 產品編號, product_name AS 產品名稱,
+    unit AS 單位, quantity AS 數量, unit_price AS 單價, total_price AS 總價,
+    supplier AS 供應商, return_reason AS 退貨原因
+"""
+
+# 組合交易記錄的篩選條件
+def _build_transaction_filters(transaction_type=None, start_date=None, end_date=None, supplier=None):
+    """根據交易類型、日期範圍和供應商組合 WHERE 條件，返回 (條件字串, 參數列表)"""
+    conditions = ""
+    params = []
+    
+    # 根據交易類型過濾
+    if transaction_type:
+        conditions += " AND transaction_type = ?"
+        params.append(transaction_type)
+    
+    # 根據日期範圍過濾
+    if start_date and end_date:
+        conditions += " AND date BETWEEN ? AND ?"
+        params.extend([start_date, end_date])
+    elif start_date:
+        conditions += " AND date >= ?"
+        params.append(start_date)
+    elif end_date:
+        conditions += " AND date <= ?"
+        params.append(end_date)
+    
+    # 根據供應商過濾
+    if supplier:
+        conditions += " AND supplier = ?"
+        params.append(supplier)
+    
+    return conditions, params
+
 # 讀取交易記錄
-def read_transactions(transaction_type=None, start_date=None, end_date=None):
-    """讀取交易記錄，可根據交易類型和日期範圍進行篩選"""
+def read_transactions(transaction_type=None, start_date=None, end_date=None, supplier=None):
+    """讀取交易記錄，可根據交易類型、日期範圍和供應商進行篩選"""
     ensure_transactions_data()  # 確保資料存在
     
     try:
-        query = """
-            SELECT transaction_id AS 交易ID, transaction_type AS 交易類型, date AS 日期, time AS 時間,
-                   staff AS 員工, shift AS 班別, product_id AS 產品編號, product_name AS 產品名稱,
-                   unit AS 單位, quantity AS 數量, unit_price AS 單價, total_price AS 總價,
-                   supplier AS 供應商, return_reason AS 退貨原因
-            FROM transactions
-            WHERE 1=1
-        """
-        params = []
-        
-        # 根據交易類型過濾
-        if transaction_type:
-            query += " AND transaction_type = ?"
-            params.append(transaction_type)
-        
-        # 根據日期範圍過濾
-        if start_date and end_date:
-            query += " AND date BETWEEN ? AND ?"
-            params.extend([start_date, end_date])
-        elif start_date:
-            query += " AND date >= ?"
-            params.append(start_date)
-        elif end_date:
-            query += " AND date <= ?"
-            params.append(end_date)
+        conditions, params = _build_transaction_filters(transaction_type, start_date, end_date, supplier)
+        query = f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE 1=1{conditions}"
         
         df = db_manager.query_to_dataframe(query, tuple(params))
         return df
@@ -114,6 +123,110 @@ def read_transactions(transaction_type=None, start_date=None, end_date=None):
         logger.error(f"讀取交易記錄時出錯: {str(e)}")
         return pd.DataFrame()
 
+# 逐批讀取交易記錄
+def iter_transactions(transaction_type=None, start_date=None, end_date=None, supplier=None, chunk_size=1000):
+    """
+    依交易ID順序逐批讀取交易記錄，不會一次載入全部資料
+    
+    每一批都是以交易ID為游標的獨立短查詢，讀取期間不會長時間佔用資料庫鎖，
+    匯出大量歷史資料時也不會阻塞收銀台的寫入。
+    
+    參數:
+        transaction_type (str, optional): 交易類型
+        start_date (str, optional): 開始日期
+        end_date (str, optional): 結束日期
+        supplier (str, optional): 供應商
+        chunk_size (int): 每批筆數
+        
+    返回:
+        generator: 每次產生一批 sqlite3.Row 列表
+    """
+    ensure_transactions_data()  # 確保資料存在
+    
+    conditions, params = _build_transaction_filters(transaction_type, start_date, end_date, supplier)
+    query = f"""
+        SELECT {TRANSACTION_COLUMNS} FROM transactions
+        WHERE transaction_id > ?{conditions}
+        ORDER BY transaction_id
+        LIMIT ?
+    """
+    
+    conn = db_manager.get_connection()
+    try:
+        last_id = 0
+        while True:
+            rows = conn.execute(query, (last_id, *params, chunk_size)).fetchall()
+            if not rows:
+                break
+            yield rows
+            if len(rows) < chunk_size:
+                break
+            last_id = rows[-1]['交易ID']
+    finally:
+        conn.close()
+
+# 讀取指定日期和班別的銷售
+def read_shift_sales(date, shift):
+    """
+    讀取單一日期和班別的銷售明細與總額
+    
+    只查詢該班的交易（使用 idx_transactions_type_date_shift 索引），
+    不需要載入全部銷售記錄再篩選。
+    
+    參數:
+        date (str): 日期
+        shift (str): 班別
+        
+    返回:
+        dict: {'records': 銷售明細列表, 'total': 總銷售額, 'count': 筆數}
+    """
+    ensure_transactions_data()  # 確保資料存在
+    
+    try:
+        conn = db_manager.get_connection()
+        try:
+            rows = conn.execute(
+                f"""SELECT {TRANSACTION_COLUMNS} FROM transactions
+                    WHERE transaction_type = '銷售' AND date = ? AND shift = ?
+                    ORDER BY time, transaction_id""",
+                (date, shift)
+            ).fetchall()
+        finally:
+            conn.close()
+        
+        records = [dict(row) for row in rows]
+        return {
+            'records': records,
+            'total': sum(record['總價'] for record in records),
+            'count': len(records)
+        }
+    except Exception as e:
+        logger.error(f"讀取班別銷售時出錯: {str(e)}")
+        return {'records': [], 'total': 0, 'count': 0}
+
+# 讀取單一班別的銷售總額
+def read_shift_sales_total(date, shift):
+    """
+    只計算班別的銷售筆數與總額（不讀取明細），供收銀台每筆銷售後更新顯示
+    
+    參數:
+        date (str): 日期
+        shift (str): 班別
+        
+    返回:
+        dict: {'total': 總銷售額, 'count': 筆數}
+    """
+    try:
+        rows = db_manager.execute_query(
+            """SELECT COALESCE(SUM(total_price), 0) AS total, COUNT(*) AS count FROM transactions
+               WHERE transaction_type = '銷售' AND date = ? AND shift = ?""",
+            (date, shift)
+        )
+        return {'total': float(rows[0]['total']), 'count': int(rows[0]['count'])}
+    except Exception as e:
+        logger.error(f"讀取班別銷售總額時出錯: {str(e)}")
+        return {'total': 0, 'count': 0}
+
 # 保存主數據
 def save_master_data(df, sheet_name):
     """保存主數據（系統配置或員工廠商）"""
@@ -159,83 +272,233 @@ def save_master_data(df, sheet_name):
         return False
 
 # 保存庫存資料
-def save_inventory(df):
-    """保存庫存資料"""
+def save_inventory(df, deleted=None):
+    """
+    保存庫存資料
+
+    df 含有「版本」欄位時（庫存管理頁面）只寫入表單中的產品：內容有變更的產品必須與載入時的版本相同才更新，
+    版本為空的列視為新產品，deleted 中的產品同樣只在版本相同時刪除；表單載入後才新增的產品不受影響。
+    任何一筆版本不符時整批不寫入並拋出 InventoryConflictError。
+    沒有「版本」欄位時以整份資料取代庫存。
+
+    參數:
+        df (DataFrame): 庫存資料
+        deleted (list, optional): 被刪除的產品 [(產品編號, 版本)]
+
+    返回:
+        bool: 是否成功保存
+    """
+    conn = db_manager.get_connection()
+    # 自行控制交易，檢查版本與寫入之間不會有其他寫入
+    conn.isolation_level = None
     try:
-        conn = db_manager.get_connection()
         cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        if '版本' in df.columns:
+            conflicts = _save_inventory_rows(cursor, df, deleted or [])
+        else:
+            _replace_inventory(cursor, df)
+            conflicts = []
+        cursor.execute("ROLLBACK" if conflicts else "COMMIT")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        logger.error(f"保存庫存資料時出錯: {str(e)}")
+        return False
+    finally:
+        conn.close()
+    
+    if conflicts:
+        INVENTORY_CONFLICTS.inc(len(conflicts), operation='admin_save')
+        INVENTORY_CONFLICT_FAILURES.inc(operation='admin_save')
+        logger.warning(f"庫存資料已被修改，拒絕保存: 產品編號 {conflicts}")
+        raise InventoryConflictError(conflicts)
+    
+    logger.info("已更新庫存資料")
+    return True
+
+# 依版本寫入表單中的產品，返回版本不符的產品編號
+def _save_inventory_rows(cursor, df, deleted):
+    current = {row['product_id']: row for row in cursor.execute(
+        "SELECT product_id, product_name, unit, quantity, unit_price, supplier, version FROM inventory"
+    ).fetchall()}
+    conflicts = []
+    
+    # 先刪除，表單中可以用相同名稱與單位重新新增
+    for product_id, version in deleted:
+        product_id = int(product_id)
+        if product_id in current and current[product_id]['version'] != int(version):
+            conflicts.append(product_id)
+        elif product_id in current:
+            cursor.execute("DELETE FROM inventory WHERE product_id = ?", (product_id,))
+    
+    for _, row in df.iterrows():
+        product_id = int(row['產品編號'])
+        values = (row['產品名稱'], row['單位'], float(row['數量']), float(row['單價']), row['供應商'])
+        existing = current.get(product_id)
         
-        # 清空現有資料
-        cursor.execute("DELETE FROM inventory")
-        
-        # 插入新資料
-        for _, row in df.iterrows():
+        if row['版本'] is None or pd.isna(row['版本']):
+            # 新產品：編號已被其他交易使用時視為衝突
+            if existing is not None:
+                conflicts.append(product_id)
+                continue
             cursor.execute(
                 """INSERT INTO inventory (product_id, product_name, unit, quantity, unit_price, supplier) 
                    VALUES (?, ?, ?, ?, ?, ?)""",
-                (
-                    int(row['產品編號']), row['產品名稱'], row['單位'], 
-                    float(row['數量']), float(row['單價']), row['供應商']
-                )
+                (product_id,) + values
             )
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info("已更新庫存資料")
-        return True
-    except Exception as e:
-        logger.error(f"保存庫存資料時出錯: {str(e)}")
-        return False
+        elif existing is None:
+            # 載入後已被刪除（例如售完）
+            conflicts.append(product_id)
+        elif tuple(existing)[1:6] == values:
+            # 內容沒有變更，不需要寫入
+            continue
+        elif existing['version'] != int(row['版本']):
+            conflicts.append(product_id)
+        else:
+            cursor.execute(
+                """UPDATE inventory
+                   SET product_name = ?, unit = ?, quantity = ?, unit_price = ?, supplier = ?, version = version + 1
+                   WHERE product_id = ?""",
+                values + (product_id,)
+            )
+    return conflicts
+
+# 以整份資料取代庫存
+def _replace_inventory(cursor, df):
+    # 新的版本大於所有現有版本，之前載入的表單都會被視為過期
+    next_version = cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM inventory").fetchone()[0]
+    cursor.execute("DELETE FROM inventory")
+    
+    for _, row in df.iterrows():
+        cursor.execute(
+            """INSERT INTO inventory (product_id, product_name, unit, quantity, unit_price, supplier, version) 
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (
+                int(row['產品編號']), row['產品名稱'], row['單位'], 
+                float(row['數量']), float(row['單價']), row['供應商'], next_version
+            )
+        )
 
 # 添加交易記錄
-def add_transaction(transaction_data):
-    """添加新的交易記錄"""
+def add_transaction(transaction_data, quantity_change=None):
+    """
+    添加新的交易記錄
+    
+    參數:
+        transaction_data (dict): 交易資料（中文欄位）
+        quantity_change (float, optional): 同一個交易內對該產品單位的庫存變動（銷售、退貨為負數）；
+            產品已不存在或庫存不足時不記錄交易
+    
+    返回:
+        int: 交易ID，未記錄時返回 None
+    """
     ensure_transactions_data()  # 確保交易記錄表存在
     
+    conn = db_manager.get_connection()
+    # 自行控制交易，交易記錄與庫存變動一起寫入或一起放棄
+    conn.isolation_level = None
     try:
-        conn = db_manager.get_connection()
         cursor = conn.cursor()
-        
-        # 獲取最大交易ID
-        cursor.execute("SELECT MAX(transaction_id) FROM transactions")
-        result = cursor.fetchone()
-        max_id = result[0] if result[0] is not None else 0
-        transaction_id = max_id + 1
-        
-        # 添加交易ID
-        transaction_data['交易ID'] = transaction_id
+        cursor.execute("BEGIN IMMEDIATE")
         
         # 從交易資料中取出欄位數據
         shift = transaction_data.get('班別', '')
         return_reason = transaction_data.get('退貨原因', '')
         
-        # 執行插入操作
+        # 執行插入操作（冪等鍵重複時唯一索引會拒絕插入）
+        # 交易ID由資料庫自動編號，多個 worker 同時記錄交易不會取得相同的ID
         cursor.execute(
-            """INSERT INTO transactions (transaction_id, transaction_type, date, time, staff, shift, 
-               product_id, product_name, unit, quantity, unit_price, total_price, supplier, return_reason) 
+            """INSERT INTO transactions (transaction_type, date, time, staff, shift, 
+               product_id, product_name, unit, quantity, unit_price, total_price, supplier, return_reason,
+               idempotency_key) 
                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
             (
-                transaction_id, transaction_data['交易類型'], 
+                transaction_data['交易類型'], 
                 str(transaction_data['日期']), transaction_data['時間'], 
                 transaction_data['員工'], shift,
                 transaction_data['產品編號'], transaction_data['產品名稱'], 
                 transaction_data['單位'], float(transaction_data['數量']), 
                 float(transaction_data['單價']), float(transaction_data['總價']), 
-                transaction_data['供應商'], return_reason
+                transaction_data['供應商'], return_reason,
+                transaction_data.get('冪等鍵') or None
             )
         )
+        transaction_id = cursor.lastrowid
         
-        conn.commit()
-        conn.close()
+        if quantity_change is not None and not _apply_inventory_change(
+                cursor, transaction_data['產品編號'], transaction_data['單位'], quantity_change):
+            cursor.execute("ROLLBACK")
+            return None
         
-        logger.info(f"已添加交易記錄，ID: {transaction_id}")
-        return transaction_id
+        cursor.execute("COMMIT")
     except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
         logger.error(f"添加交易記錄時出錯: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
         return None
+    finally:
+        conn.close()
+    
+    transaction_data['交易ID'] = transaction_id
+    
+    # 更新分析立方體
+    from models.analytics_cube import record_transaction
+    record_transaction(transaction_data)
+    
+    logger.debug(f"已添加交易記錄，ID: {transaction_id}")
+    return transaction_id
+
+# 在交易內變更庫存數量
+def _apply_inventory_change(cursor, product_id, unit, quantity_change):
+    """
+    變更庫存數量並將版本加一，數量為0時從庫存中移除（呼叫端已以 BEGIN IMMEDIATE 取得寫入鎖）
+    
+    返回:
+        bool: 是否成功變更，產品不存在或變更後數量為負數時為 False
+    """
+    row = cursor.execute(
+        "SELECT quantity FROM inventory WHERE product_id = ? AND unit = ?", (product_id, unit)
+    ).fetchone()
+    if row is None:
+        logger.warning(f"找不到產品: 產品編號 {product_id}, 單位 {unit}")
+        return False
+    
+    new_quantity = row[0] + quantity_change
+    if new_quantity < 0:
+        logger.warning(f"庫存不足: 產品編號 {product_id}, 單位 {unit}, 庫存 {row[0]}, 變動 {quantity_change}")
+        return False
+    
+    if new_quantity == 0:
+        cursor.execute("DELETE FROM inventory WHERE product_id = ? AND unit = ?", (product_id, unit))
+        logger.info(f"產品已從庫存中移除: 產品編號 {product_id}, 單位 {unit}")
+    else:
+        cursor.execute(
+            "UPDATE inventory SET quantity = ?, version = version + 1 WHERE product_id = ? AND unit = ?",
+            (new_quantity, product_id, unit)
+        )
+    return True
+
+# 依冪等鍵查詢交易
+def find_transaction_by_idempotency_key(idempotency_key):
+    """
+    查詢已使用此冪等鍵記錄的交易（使用唯一索引，只需一次查詢）
+    
+    參數:
+        idempotency_key (str): 客戶端產生的冪等鍵
+        
+    返回:
+        dict: 交易記錄（中文欄位），沒有時返回 None
+    """
+    if not idempotency_key:
+        return None
+    rows = db_manager.execute_query(
+        f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE idempotency_key = ?",
+        (idempotency_key,)
+    )
+    return dict(rows[0]) if rows else None
 
 # 獲取員工和廠商列表
 def get_staff_and_farmers():
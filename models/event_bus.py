@@ -0,0 +1,238 @@
+"""
+事件匯流排模組
+庫存與銷售的變動寫入 events 資料表，各 worker 的背景執行緒讀取新事件後分送給本程序的訂閱者（/api/stream），
+所以不論交易由哪個 worker 處理，所有收銀台都會收到變動
+
+沒有訂閱者時背景執行緒不讀取資料表
+"""
+import os
+import json
+import time
+import queue
+import threading
+from utils.common import logger
+from database import db_manager
+
+# 背景執行緒讀取新事件的間隔（秒），同一程序發布的事件會立即分送
+EVENT_POLL_INTERVAL = 0.5
+
+# 事件保留時間（秒）與清理間隔
+EVENT_RETENTION_SECONDS = 3600
+EVENT_PRUNE_INTERVAL = 300
+
+# 重新連線時最多補送的事件數，超過時通知客戶端重新載入
+EVENT_REPLAY_LIMIT = 500
+
+# 每個訂閱者最多暫存的事件數，來不及處理時通知客戶端重新載入
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# 每個 worker 同時連線的訂閱者上限（每個連線佔用一個執行緒，預設使用一半的執行緒）
+MAX_SUBSCRIBERS = int(os.environ.get('GAS_STATION_STREAM_MAX_CLIENTS')
+                      or max(1, int(os.environ.get('GAS_STATION_THREADS', 4)) // 2))
+
+# 通知客戶端重新載入完整資料的事件
+RESYNC_EVENT = 'resync'
+
+# 發布事件
+def publish(event_type, data):
+    """
+    將事件寫入 events 資料表
+
+    發布失敗只記錄錯誤，不影響交易本身。
+
+    參數:
+        event_type (str): 事件類型，例如 'inventory'、'sale'
+        data (dict): 事件內容（可轉為 JSON）
+
+    返回:
+        int: 事件編號，失敗時返回 None
+    """
+    try:
+        conn = db_manager.get_connection()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO events (event_type, payload, created_at) VALUES (?, ?, ?)",
+                (event_type, json.dumps(data, ensure_ascii=False), time.time())
+            )
+            conn.commit()
+            event_id = cursor.lastrowid
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"發布事件時出錯: {str(e)}")
+        return None
+
+    bus.wake()
+    return event_id
+
+# 讀取指定編號之後的事件
+def read_events(after_id, limit=EVENT_REPLAY_LIMIT):
+    """
+    返回:
+        list: [(事件編號, 事件類型, 內容dict)]
+    """
+    rows = db_manager.execute_query(
+        "SELECT event_id, event_type, payload FROM events WHERE event_id > ? ORDER BY event_id LIMIT ?",
+        (after_id, limit)
+    )
+    return [(row['event_id'], row['event_type'], json.loads(row['payload'])) for row in rows or []]
+
+# 目前最新與最舊的事件編號
+def _event_id_range():
+    rows = db_manager.execute_query("SELECT MIN(event_id) AS first_id, MAX(event_id) AS last_id FROM events")
+    if not rows or rows[0]['last_id'] is None:
+        return None, 0
+    return rows[0]['first_id'], rows[0]['last_id']
+
+# 格式化為 Server-Sent Events 訊息
+def format_sse(event):
+    event_id, event_type, data = event
+    lines = [f"event: {event_type}", f"data: {json.dumps(data, ensure_ascii=False)}"]
+    if event_id is not None:
+        lines.insert(0, f"id: {event_id}")
+    return '\n'.join(lines) + '\n\n'
+
+class Subscription:
+    """單一串流連線的事件佇列"""
+
+    def __init__(self, last_id):
+        self.last_id = last_id
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, event):
+        if event[0] is not None and event[0] <= self.last_id:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # 客戶端處理太慢，清空佇列並要求重新載入
+            self._drain()
+            self._queue.put_nowait((None, RESYNC_EVENT, {}))
+        if event[0] is not None:
+            self.last_id = event[0]
+
+    def get(self, timeout):
+        """等待下一個事件，逾時返回 None"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+class EventBus:
+    """本程序的訂閱者清單與讀取事件的背景執行緒"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._has_subscribers = threading.Condition(self._lock)
+        self._thread = None
+        self._last_id = None
+        self._last_prune = 0.0
+
+    def subscribe(self, last_event_id=None):
+        """
+        新增訂閱者
+
+        參數:
+            last_event_id (str): 客戶端最後收到的事件編號（Last-Event-ID），會補送之後的事件
+
+        返回:
+            Subscription: 已達連線上限時返回 None
+        """
+        with self._lock:
+            if len(self._subscribers) >= MAX_SUBSCRIBERS:
+                return None
+            if self._last_id is None:
+                self._last_id = _event_id_range()[1]
+
+            subscription = Subscription(self._last_id)
+            if last_event_id not in (None, ''):
+                self._replay(subscription, last_event_id)
+
+            self._subscribers.add(subscription)
+            self._has_subscribers.notify_all()
+            self._ensure_thread()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                # 沒有訂閱者期間的事件不需要分送，下一個訂閱者從最新的事件開始
+                self._last_id = None
+
+    def wake(self):
+        """有新事件時立即讀取，不等待下一次輪詢"""
+        self._wake.set()
+
+    def _replay(self, subscription, last_event_id):
+        # 在鎖內執行，背景執行緒不會同時分送，補送的事件不會重複或遺漏
+        try:
+            after_id = int(last_event_id)
+        except ValueError:
+            subscription.put((None, RESYNC_EVENT, {}))
+            return
+
+        first_id, _ = _event_id_range()
+        events = [event for event in read_events(after_id) if event[0] <= self._last_id]
+        if len(events) >= EVENT_REPLAY_LIMIT or (first_id is not None and first_id > after_id + 1):
+            # 事件已被清理或太多，改為重新載入
+            subscription.put((None, RESYNC_EVENT, {}))
+            return
+
+        subscription.last_id = after_id
+        for event in events:
+            subscription.put(event)
+        subscription.last_id = self._last_id
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._subscribers:
+                    self._has_subscribers.wait()
+
+            self._wake.wait(EVENT_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self._dispatch()
+                self._prune()
+            except Exception as e:
+                logger.error(f"讀取事件時出錯: {str(e)}")
+                time.sleep(EVENT_POLL_INTERVAL)
+
+    def _dispatch(self):
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = _event_id_range()[1]
+            events = read_events(self._last_id)
+            for event in events:
+                for subscription in self._subscribers:
+                    subscription.put(event)
+                self._last_id = event[0]
+
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < EVENT_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        deleted = db_manager.execute_command(
+            "DELETE FROM events WHERE created_at < ?", (now - EVENT_RETENTION_SECONDS,)
+        )
+        if deleted:
+            logger.debug(f"已清理 {deleted} 筆過期事件")
+
+# 本程序的事件匯流排
+bus = EventBus()
@@ -1,25 +1,35 @@
-import pandas as pd
+import time
+import random
 from utils.common import logger
+from utils.metrics import INVENTORY_CONFLICTS, INVENTORY_CONFLICT_FAILURES
 from database import db_manager
 from models.data_manager import read_inventory, save_inventory
+from utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# 庫存數量更新遇到版本衝突時的嘗試次數與第一次重試前的等待秒數（之後每次加倍）
+INVENTORY_UPDATE_ATTEMPTS = 5
+INVENTORY_RETRY_DELAY = 0.005
 
 # 添加新產品到庫存
 def add_new_product(product_name, unit, quantity, unit_price, supplier):
     """添加新產品到庫存"""
     try:
-        # 獲取最大產品ID
-        result = db_manager.execute_query("SELECT MAX(product_id) FROM inventory")
-        max_id = result[0][0] if result and result[0][0] is not None else 0
-        new_id = max_id + 1
-        
-        # 執行插入操作
+        # 執行插入操作（產品編號由資料庫自動編號，多個 worker 同時新增產品不會取得相同的編號）
         query = """
-            INSERT INTO inventory (product_id, product_name, unit, quantity, unit_price, supplier)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO inventory (product_name, unit, quantity, unit_price, supplier)
+            VALUES (?, ?, ?, ?, ?)
         """
-        params = (new_id, product_name, unit, float(quantity), float(unit_price), supplier)
+        params = (product_name, unit, float(quantity), float(unit_price), supplier)
         
-        db_manager.execute_command(query, params)
+        conn = db_manager.get_connection()
+        try:
+            cursor = conn.execute(query, params)
+            new_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
         
         logger.info(f"已添加新產品: {product_name}, 編號: {new_id}")
         return new_id
@@ -29,45 +39,66 @@ def add_new_product(product_name, unit, quantity, unit_price, supplier):
 
 # 更新庫存數量
 def update_inventory_quantity(product_id, unit, quantity_change):
-    """更新庫存數量"""
+    """
+    更新庫存數量
+
+    以版本欄位進行比較後寫入（compare-and-swap）：讀取數量與版本，只在版本未改變時寫入並將版本加一；
+    其他收銀台或 worker 搶先更新時重新讀取再試，最多 INVENTORY_UPDATE_ATTEMPTS 次。
+    每次重新讀取後都會檢查庫存，變更後數量為負數時不更新。
+    記錄交易時應使用 add_transaction(quantity_change=...)，交易記錄與庫存變動在同一個交易中寫入。
+
+    返回:
+        bool: 是否成功更新（產品不存在、庫存不足或持續衝突時為 False）
+    """
+    params = (product_id, unit)
     try:
-        # 先查詢當前數量
-        query = """
-            SELECT quantity FROM inventory
-            WHERE product_id = ? AND unit = ?
-        """
-        params = (product_id, unit)
-        
-        result = db_manager.execute_query(query, params)
-        
-        if not result:
-            logger.warning(f"找不到產品: 產品編號 {product_id}, 單位 {unit}")
-            return False
-        
-        current_quantity = result[0][0]
-        new_quantity = current_quantity + quantity_change
-        
-        if new_quantity <= 0:
-            # 如果數量為0或負數，從庫存中刪除該產品
-            query = """
-                DELETE FROM inventory
+        for attempt in range(INVENTORY_UPDATE_ATTEMPTS):
+            # 先查詢當前數量與版本
+            result = db_manager.execute_query("""
+                SELECT quantity, version FROM inventory
                 WHERE product_id = ? AND unit = ?
-            """
-            db_manager.execute_command(query, params)
-            logger.info(f"產品已從庫存中移除: 產品編號 {product_id}, 單位 {unit}")
-        else:
-            # 更新數量
-            query = """
-                UPDATE inventory
-                SET quantity = ?
-                WHERE product_id = ? AND unit = ?
-            """
-            params = (new_quantity, product_id, unit)
+            """, params)
+            
+            if not result:
+                logger.warning(f"找不到產品: 產品編號 {product_id}, 單位 {unit}")
+                return False
+            
+            current_quantity, version = result[0]['quantity'], result[0]['version']
+            new_quantity = current_quantity + quantity_change
             
-            db_manager.execute_command(query, params)
-            logger.info(f"已更新庫存數量: 產品編號 {product_id}, 單位 {unit}, 新數量 {new_quantity}")
+            if new_quantity < 0:
+                logger.warning(f"庫存不足: 產品編號 {product_id}, 單位 {unit}, 庫存 {current_quantity}, 變動 {quantity_change}")
+                return False
+            
+            if new_quantity == 0:
+                # 數量為0時從庫存中刪除該產品
+                changed = db_manager.execute_command("""
+                    DELETE FROM inventory
+                    WHERE product_id = ? AND unit = ? AND version = ?
+                """, params + (version,))
+                if changed:
+                    logger.info(f"產品已從庫存中移除: 產品編號 {product_id}, 單位 {unit}")
+            else:
+                # 更新數量
+                changed = db_manager.execute_command("""
+                    UPDATE inventory
+                    SET quantity = ?, version = version + 1
+                    WHERE product_id = ? AND unit = ? AND version = ?
+                """, (new_quantity,) + params + (version,))
+                if changed:
+                    logger.debug(f"已更新庫存數量: 產品編號 {product_id}, 單位 {unit}, 新數量 {new_quantity}")
+            
+            if changed:
+                return True
+            
+            # 版本已被其他交易更新，稍候重新讀取
+            INVENTORY_CONFLICTS.inc(operation='quantity')
+            logger.debug(f"庫存版本衝突，重新嘗試: 產品編號 {product_id}, 單位 {unit}, 第 {attempt + 1} 次")
+            time.sleep(INVENTORY_RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
         
-        return True
+        INVENTORY_CONFLICT_FAILURES.inc(operation='quantity')
+        logger.error(f"庫存更新持續衝突，已放棄: 產品編號 {product_id}, 單位 {unit}, 變動 {quantity_change}")
+        return False
     except Exception as e:
         logger.error(f"更新庫存數量時出錯: {str(e)}")
         return False
@@ -148,18 +179,44 @@ def get_products_by_supplier(supplier):
             return []
         
         # 整理產品列表
-        products = []
-        for row in rows:
-            products.append({
-                'product_id': int(row['product_id']),
-                'name': row['product_name'],
-                'unit': row['unit'],
-                'quantity': float(row['quantity']),
-                'price': float(row['unit_price']),
-                'supplier': row['supplier']
-            })
-        
-        return products
+        return [_product_from_row(row) for row in rows]
     except Exception as e:
         logger.error(f"按廠商查詢產品時出錯: {str(e)}")
         return []
+
+# 一次查詢所有廠商的產品
+def get_products_grouped_by_supplier(suppliers=None):
+    """
+    以單一查詢取得廠商對應產品列表的字典
+
+    參數:
+        suppliers (list, optional): 只保留這些廠商，未指定時返回全部
+
+    返回:
+        dict: {廠商: [產品, ...]}，沒有庫存的廠商不會出現在字典中
+    """
+    try:
+        rows = db_manager.execute_query("SELECT * FROM inventory ORDER BY supplier, product_id")
+        wanted = set(suppliers) if suppliers is not None else None
+        
+        products_by_supplier = {}
+        for row in rows or []:
+            if wanted is not None and row['supplier'] not in wanted:
+                continue
+            products_by_supplier.setdefault(row['supplier'], []).append(_product_from_row(row))
+        
+        return products_by_supplier
+    except Exception as e:
+        logger.error(f"查詢廠商產品列表時出錯: {str(e)}")
+        return {}
+
+# 將庫存資料列轉換為產品字典
+def _product_from_row(row):
+    return {
+        'product_id': int(row['product_id']),
+        'name': row['product_name'],
+        'unit': row['unit'],
+        'quantity': float(row['quantity']),
+        'price': float(row['unit_price']),
+        'supplier': row['supplier']
+    }
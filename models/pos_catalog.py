@@ -0,0 +1,117 @@
+"""
+收銀台產品目錄模組
+以單一查詢建立有庫存產品的精簡目錄（含所有單位、單價、數量），
+附上版本標記，讓收銀台只需下載一次完整目錄，之後只取變動部分
+"""
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from utils.common import logger
+from database import db_manager
+
+# 每個單位資料的欄位順序（以陣列傳送，減少傳輸量）
+UNIT_FIELDS = ['unit', 'unit_price', 'quantity', 'product_id', 'supplier']
+
+# 保留的舊版本快照數量，用來計算差異
+SNAPSHOT_HISTORY = 32
+
+# 版本 -> {產品名稱: 產品資料}
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+# 建立目前的產品目錄
+def build_catalog():
+    """
+    讀取庫存並建立有庫存產品的目錄
+
+    只要產品的任一單位有庫存，就列出該產品的所有單位。
+
+    返回:
+        tuple: (版本, {產品名稱: 產品資料})
+    """
+    rows = db_manager.execute_query(
+        "SELECT product_id, product_name, unit, quantity, unit_price, supplier "
+        "FROM inventory ORDER BY product_name, product_id"
+    )
+
+    products = OrderedDict()
+    for row in rows or []:
+        product = products.setdefault(row['product_name'], {'name': row['product_name'], 'units': []})
+        product['units'].append([row['unit'], float(row['unit_price']), float(row['quantity']),
+                                 int(row['product_id']), row['supplier']])
+
+    catalog = OrderedDict(
+        (name, product) for name, product in products.items()
+        if any(unit[2] > 0 for unit in product['units'])
+    )
+
+    digest = hashlib.sha1(json.dumps(list(catalog.values()), ensure_ascii=False).encode('utf-8'))
+    version = digest.hexdigest()[:12]
+
+    # 記住這個版本，之後可以計算差異
+    with _snapshots_lock:
+        if version in _snapshots:
+            _snapshots.move_to_end(version)
+        else:
+            _snapshots[version] = catalog
+            while len(_snapshots) > SNAPSHOT_HISTORY:
+                _snapshots.popitem(last=False)
+
+    return version, catalog
+
+# 取得單一產品所有單位的目前資料
+def get_product_units(product_name):
+    """
+    參數:
+        product_name (str): 產品名稱
+
+    返回:
+        list: 依 UNIT_FIELDS 排列的單位資料，產品已不在庫存中時為空列表
+    """
+    rows = db_manager.execute_query(
+        "SELECT product_id, unit, quantity, unit_price, supplier FROM inventory "
+        "WHERE product_name = ? ORDER BY product_id",
+        (product_name,)
+    )
+    return [[row['unit'], float(row['unit_price']), float(row['quantity']),
+             int(row['product_id']), row['supplier']] for row in rows or []]
+
+# 取得完整目錄
+def get_catalog():
+    """
+    返回:
+        dict: {'version', 'fields', 'products'}
+    """
+    version, catalog = build_catalog()
+    return {'version': version, 'fields': UNIT_FIELDS, 'products': list(catalog.values())}
+
+# 取得自指定版本以來的變動
+def get_catalog_delta(since):
+    """
+    計算自 since 版本以來變動的產品
+
+    伺服器重新啟動或版本太舊而找不到快照時，返回完整目錄（full 為 True）。
+
+    參數:
+        since (str): 收銀台目前持有的版本
+
+    返回:
+        dict: {'version', 'full', 'fields', 'products', 'removed'}
+    """
+    version, catalog = build_catalog()
+
+    if since == version:
+        return {'version': version, 'full': False, 'fields': UNIT_FIELDS, 'products': [], 'removed': []}
+
+    with _snapshots_lock:
+        previous = _snapshots.get(since)
+
+    if previous is None:
+        logger.debug(f"找不到目錄版本 {since}，返回完整目錄")
+        return {'version': version, 'full': True, 'fields': UNIT_FIELDS,
+                'products': list(catalog.values()), 'removed': []}
+
+    changed = [product for name, product in catalog.items() if previous.get(name) != product]
+    removed = [name for name in previous if name not in catalog]
+    return {'version': version, 'full': False, 'fields': UNIT_FIELDS, 'products': changed, 'removed': removed}
@@ -0,0 +1,423 @@
+"""
+報表引擎模組
+統一計算報表資料（只讀取與彙總一次），再交由可替換的輸出端寫出
+本地報表與雲端報表共用同一套計算邏輯
+"""
+import os
+import io
+import time
+import calendar
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.common import REPORTS_PATH, logger
+from models.data_manager import read_master_data, read_transactions, read_inventory
+from utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# 廠商詳細報表各明細工作表保留的欄位
+PURCHASE_DETAIL_COLUMNS = ['日期', '時間', '產品名稱', '單位', '數量', '單價', '總價', '員工']
+SALE_DETAIL_COLUMNS = ['日期', '時間', '班別', '產品名稱', '單位', '數量', '單價', '總價', '員工']
+RETURN_DETAIL_COLUMNS = ['日期', '時間', '產品名稱', '單位', '數量', '單價', '總價', '員工', '退貨原因']
+INVENTORY_DETAIL_COLUMNS = ['產品編號', '產品名稱', '單位', '數量', '單價', '供應商', '庫存價值']
+
+# 基本報表檔名
+FARMER_REPORT_NAME = '廠商月報.xlsx'
+STAFF_REPORT_NAME = '員工月報.xlsx'
+FINANCIAL_REPORT_NAME = '收支表月報.xlsx'
+FARMER_DETAIL_DIR = '廠商詳細報表'
+
+# 決定報表期間
+def resolve_report_period(year=None, month=None, start_date=None, end_date=None):
+    """
+    決定報表的查詢日期範圍、目錄名稱和期間描述
+
+    月報會換算成該月第一天到最後一天，只讀取該月的交易。
+
+    返回:
+        dict: {'start_date', 'end_date', 'dir_name', 'label'}
+    """
+    if start_date and end_date:
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'dir_name': f"{start_date}_to_{end_date}",
+            'label': f"{start_date} 至 {end_date}"
+        }
+
+    last_day = calendar.monthrange(year, month)[1]
+    return {
+        'start_date': f"{year}-{month:02d}-01",
+        'end_date': f"{year}-{month:02d}-{last_day:02d}",
+        'dir_name': f"{year}年{month:02d}月",
+        'label': f"{year}年{month:02d}月"
+    }
+
+# 讀取報表所需的全部資料
+def load_report_data(period):
+    """
+    一次讀取報表期間的交易、庫存和員工廠商資料
+
+    參數:
+        period (dict): resolve_report_period 的結果
+
+    返回:
+        dict: 報表資料
+    """
+    transactions_df = read_transactions(None, period['start_date'], period['end_date'])
+    if transactions_df.empty:
+        sales_df = purchases_df = returns_df = transactions_df
+    else:
+        sales_df = transactions_df[transactions_df['交易類型'] == '銷售']
+        purchases_df = transactions_df[transactions_df['交易類型'] == '進貨']
+        returns_df = transactions_df[transactions_df['交易類型'] == '退貨']
+
+    staff_farmers_df = read_master_data('員工廠商')
+
+    return {
+        'period': period,
+        'sales': sales_df,
+        'purchases': purchases_df,
+        'returns': returns_df,
+        'inventory': read_inventory(),
+        'farmers': staff_farmers_df[staff_farmers_df['類型'] == 'farmer'],
+        'staffs': staff_farmers_df[staff_farmers_df['類型'] == 'staff']
+    }
+
+# 依欄位加總總價
+def _sum_by(df, column):
+    if df.empty:
+        return {}
+    return df.groupby(column)['總價'].sum().to_dict()
+
+# 依供應商分組
+def _group_by_supplier(df):
+    if df.empty:
+        return {}
+    return {name: group for name, group in df.groupby('供應商', sort=False)}
+
+# 建立分潤報表
+def _commission_report(people, sales_by_name, name_column):
+    names = people['名稱'].tolist()
+    rates = people['分潤比例'].tolist()
+    totals = [sales_by_name.get(name, 0) for name in names]
+    return pd.DataFrame({
+        name_column: names,
+        '總銷售額': totals,
+        '分潤比例': rates,
+        '分潤金額': [total * rate for total, rate in zip(totals, rates)]
+    }, columns=[name_column, '總銷售額', '分潤比例', '分潤金額'])
+
+# 計算基本報表
+def compute_basic_reports(data):
+    """
+    計算廠商月報、員工月報和收支表月報
+
+    參數:
+        data (dict): load_report_data 的結果
+
+    返回:
+        list: [(檔名, DataFrame), ...]
+    """
+    sales_df = data['sales']
+
+    farmer_report = _commission_report(data['farmers'], _sum_by(sales_df, '供應商'), '廠商')
+    staff_report = _commission_report(data['staffs'], _sum_by(sales_df, '員工'), '員工')
+
+    total_sales = sales_df['總價'].sum() if not sales_df.empty else 0
+    total_purchases = data['purchases']['總價'].sum() if not data['purchases'].empty else 0
+    total_returns = data['returns']['總價'].sum() if not data['returns'].empty else 0
+    staff_commission = staff_report['分潤金額'].sum()
+    farmer_commission = farmer_report['分潤金額'].sum()
+    net_profit = total_sales - staff_commission - farmer_commission
+
+    financial_report = pd.DataFrame({
+        '項目': ['總營業額', '進貨成本', '退貨金額', '員工分潤', '廠商分潤', '淨利潤'],
+        '金額': [total_sales, total_purchases, total_returns, staff_commission, farmer_commission, net_profit]
+    })
+
+    return [
+        (FARMER_REPORT_NAME, farmer_report),
+        (STAFF_REPORT_NAME, staff_report),
+        (FINANCIAL_REPORT_NAME, financial_report)
+    ]
+
+# 取出明細工作表
+def _detail_sheet(group, columns):
+    if group is None or group.empty:
+        return pd.DataFrame(columns=columns)
+    return group[[col for col in columns if col in group.columns]]
+
+# 計算廠商詳細報表
+def iter_farmer_detailed_reports(data):
+    """
+    逐一產生每個廠商的詳細報表內容
+
+    交易與庫存先依供應商分組一次，每個廠商直接取用自己的分組，
+    不需要對每個廠商重新篩選整份交易資料。
+
+    參數:
+        data (dict): load_report_data 的結果
+
+    返回:
+        generator: 每次產生 (檔名, [(工作表名稱, DataFrame), ...])
+    """
+    sales_by_supplier = _group_by_supplier(data['sales'])
+    purchases_by_supplier = _group_by_supplier(data['purchases'])
+    returns_by_supplier = _group_by_supplier(data['returns'])
+    inventory_by_supplier = _group_by_supplier(data['inventory'])
+
+    for _, farmer in data['farmers'].iterrows():
+        farmer_name = farmer['名稱']
+        commission_rate = farmer['分潤比例']
+
+        farmer_sales = sales_by_supplier.get(farmer_name)
+        farmer_purchases = purchases_by_supplier.get(farmer_name)
+        farmer_returns = returns_by_supplier.get(farmer_name)
+        current_inventory = inventory_by_supplier.get(farmer_name)
+
+        total_sales = farmer_sales['總價'].sum() if farmer_sales is not None else 0
+        total_purchases = farmer_purchases['總價'].sum() if farmer_purchases is not None else 0
+        total_returns = farmer_returns['總價'].sum() if farmer_returns is not None else 0
+        commission_amount = total_sales * commission_rate
+
+        # 庫存明細與庫存價值
+        if current_inventory is not None:
+            inventory_data = current_inventory.copy()
+            inventory_data['庫存價值'] = inventory_data['數量'] * inventory_data['單價']
+            inventory_value = inventory_data['庫存價值'].sum()
+        else:
+            inventory_data = pd.DataFrame(columns=INVENTORY_DETAIL_COLUMNS)
+            inventory_value = 0
+
+        summary_df = pd.DataFrame({
+            '項目': ['廠商名稱', '報表期間', '銷售總額', '進貨總額', '退貨總額', '分潤比例', '分潤金額', '庫存價值'],
+            '內容': [farmer_name, data['period']['label'], total_sales, total_purchases,
+                    total_returns, f"{commission_rate:.2%}", commission_amount, inventory_value]
+        })
+
+        sheets = [
+            ('總覽', summary_df),
+            ('進貨明細', _detail_sheet(farmer_purchases, PURCHASE_DETAIL_COLUMNS)),
+            ('銷售明細', _detail_sheet(farmer_sales, SALE_DETAIL_COLUMNS)),
+            ('退貨明細', _detail_sheet(farmer_returns, RETURN_DETAIL_COLUMNS)),
+            ('庫存明細', inventory_data)
+        ]
+
+        yield f"{farmer_name}詳細報表.xlsx", sheets
+
+# 將工作表寫入Excel
+def _write_excel(target, sheets):
+    with pd.ExcelWriter(target) as writer:
+        for sheet_name, df in sheets:
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+class ReportSink:
+    """
+    報表輸出端基底類別
+    報表引擎只負責計算，實際寫到哪裡由輸出端決定
+    """
+
+    def write_workbook(self, relative_path, sheets):
+        """
+        寫出一個Excel活頁簿
+
+        參數:
+            relative_path (str): 相對於報表根目錄的路徑
+            sheets (list): [(工作表名稱, DataFrame), ...]
+
+        返回:
+            dict: 報表文件資訊 {'name', 'path', ...}
+        """
+        raise NotImplementedError
+
+    def location(self, relative_dir):
+        """返回報表目錄在此輸出端中的位置"""
+        return relative_dir
+
+    def finalize(self):
+        """所有報表寫完後呼叫，讓輸出端完成收尾工作"""
+        return None
+
+class LocalReportSink(ReportSink):
+    """
+    本地檔案輸出端
+    """
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir or REPORTS_PATH
+
+    def location(self, relative_dir):
+        return os.path.join(self.base_dir, relative_dir)
+
+    def write_workbook(self, relative_path, sheets):
+        path = os.path.join(self.base_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_excel(path, sheets)
+        return {'name': os.path.basename(path), 'path': path}
+
+class MemoryReportSink(ReportSink):
+    """
+    記憶體輸出端
+    報表內容保存在 files 字典中（相對路徑 -> 位元組），適合測試與效能量測
+    """
+
+    def __init__(self):
+        self.files = {}
+
+    def write_workbook(self, relative_path, sheets):
+        buffer = io.BytesIO()
+        _write_excel(buffer, sheets)
+        self.files[relative_path] = buffer.getvalue()
+        return {'name': os.path.basename(relative_path), 'path': relative_path}
+
+class DriveReportSink(ReportSink):
+    """
+    Google Drive輸出端
+    報表先寫到本地，所有本地檔案完成後才在背景上傳，不拖慢報表產生
+    """
+
+    def __init__(self, drive_connector, local_sink=None, remote_root='reports'):
+        """
+        參數:
+            drive_connector (GoogleDriveConnector): Google Drive連接器
+            local_sink (LocalReportSink, optional): 本地輸出端
+            remote_root (str): 雲端報表根目錄
+        """
+        self.drive_connector = drive_connector
+        self.local_sink = local_sink or LocalReportSink()
+        self.remote_root = remote_root
+        self.pending_uploads = []
+        self.share_links = {}
+        self.upload_future = None
+
+    def location(self, relative_dir):
+        return self.local_sink.location(relative_dir)
+
+    def write_workbook(self, relative_path, sheets):
+        report = self.local_sink.write_workbook(relative_path, sheets)
+        self.pending_uploads.append((report['path'], relative_path))
+        report['share_link'] = None
+        return report
+
+    def finalize(self):
+        """在背景執行緒上傳所有報表，返回可等待結果的 Future"""
+        if not self.pending_uploads:
+            return None
+        uploads, self.pending_uploads = self.pending_uploads, []
+        self.upload_future = _upload_executor().submit(self._upload_all, uploads)
+        return self.upload_future
+
+    def _upload_all(self, uploads):
+        """同時上傳報表並建立分享連結，返回 {相對路徑: 分享連結}"""
+        from utils.cloud.transfer import run_transfers
+
+        # 先依序確認雲端目錄（每個目錄只確認一次）
+        ensured_dirs = {}
+        tasks = []
+        for local_path, relative_path in uploads:
+            remote_dir = f"{self.remote_root}/{os.path.dirname(relative_path).replace(os.sep, '/')}"
+            try:
+                if remote_dir not in ensured_dirs:
+                    ensured_dirs[remote_dir] = self.drive_connector.ensure_directory(remote_dir)
+            except Exception as e:
+                logger.error(f"建立雲端報表目錄 {remote_dir} 時出錯: {str(e)}")
+                ensured_dirs[remote_dir] = None
+            if not ensured_dirs[remote_dir]:
+                logger.error(f"無法建立雲端報表目錄: {remote_dir}")
+                continue
+            tasks.append((relative_path, _upload_with_share_link(local_path, ensured_dirs[remote_dir]),
+                          os.path.getsize(local_path)))
+
+        summary = run_transfers(self.drive_connector, tasks, '報表上傳')
+        for relative_path, share_link in summary['results'].items():
+            if share_link is not None:
+                self.share_links[relative_path] = share_link
+            else:
+                logger.error(f"上傳報表到雲端失敗: {relative_path}")
+        return dict(self.share_links)
+
+# 上傳報表並建立分享連結的傳輸工作（建立連結失敗時返回空字串，不重新上傳）
+def _upload_with_share_link(local_path, folder_id):
+    def upload(client):
+        file_id = client.upload_file_to_folder(local_path, folder_id)
+        if not file_id:
+            return None
+        return client.create_share_link(file_id) or ''
+    return upload
+
+# 報表背景上傳使用的執行緒（單一執行緒依序處理各次上傳，每次上傳內再同時傳輸多個檔案）
+_executor = None
+_executor_lock = threading.Lock()
+
+def _upload_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report-upload')
+        return _executor
+
+# 寫出基本報表
+def write_basic_reports(data, sink):
+    dir_name = data['period']['dir_name']
+    return [sink.write_workbook(os.path.join(dir_name, name), [('Sheet1', df)])
+            for name, df in compute_basic_reports(data)]
+
+# 寫出廠商詳細報表
+def write_farmer_detailed_reports(data, sink):
+    dir_name = os.path.join(data['period']['dir_name'], FARMER_DETAIL_DIR)
+    return [sink.write_workbook(os.path.join(dir_name, name), sheets)
+            for name, sheets in iter_farmer_detailed_reports(data)]
+
+# 報表產生主流程
+def run_reports(year=None, month=None, start_date=None, end_date=None,
+                include_basic=True, include_farmer_details=False, sink=None):
+    """
+    讀取一次資料，依需要產生基本報表和廠商詳細報表
+
+    參數:
+        year (int, optional): 年份
+        month (int, optional): 月份
+        start_date (str, optional): 開始日期
+        end_date (str, optional): 結束日期
+        include_basic (bool): 是否產生基本報表
+        include_farmer_details (bool): 是否產生廠商詳細報表
+        sink (ReportSink, optional): 輸出端，預設為本地檔案
+
+    返回:
+        tuple: (是否成功, 報表目錄, 報表文件列表)
+    """
+    sink = sink or LocalReportSink()
+    try:
+        period = resolve_report_period(year, month, start_date, end_date)
+
+        started = time.perf_counter()
+        data = load_report_data(period)
+        load_seconds = time.perf_counter() - started
+
+        if include_basic and data['sales'].empty and data['purchases'].empty and data['returns'].empty:
+            logger.warning(f"找不到指定期間的交易數據: {period['label']}")
+            return False, None, []
+
+        report_files = []
+        report_dir = sink.location(period['dir_name'])
+
+        started = time.perf_counter()
+        if include_basic:
+            report_files.extend(write_basic_reports(data, sink))
+        if include_farmer_details:
+            report_files.extend(write_farmer_detailed_reports(data, sink))
+            if not include_basic:
+                report_dir = sink.location(os.path.join(period['dir_name'], FARMER_DETAIL_DIR))
+        write_seconds = time.perf_counter() - started
+
+        sink.finalize()
+
+        logger.info(f"報表生成成功，共 {len(report_files)} 個報表，保存在: {report_dir}"
+                    f"（讀取 {load_seconds:.2f} 秒，計算與寫出 {write_seconds:.2f} 秒）")
+        return True, report_dir, report_files
+    except Exception as e:
+        logger.error(f"生成報表時出錯: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return False, None, []
@@ -1,13 +1,42 @@
 import os
-import pandas as pd
 from utils.common import get_taiwan_time, logger
 from models.data_manager import add_transaction, read_inventory
 from models.inventory import update_inventory_quantity, get_product_details
 from database import db_manager
 
+# 發布庫存變動事件（/api/stream）
+def _publish_inventory_change(product_name):
+    from models.event_bus import publish
+    from models.pos_catalog import get_product_units, UNIT_FIELDS
+    
+    publish('inventory', {'name': product_name, 'fields': UNIT_FIELDS, 'units': get_product_units(product_name)})
+
+# 查詢冪等鍵已記錄的交易
+def _find_replay(idempotency_key, transaction_type):
+    """
+    同一個冪等鍵已記錄過交易時返回該交易（只需一次索引查詢，不寫入資料）
+    
+    返回:
+        dict: 原交易記錄，沒有時返回 None；鍵已被其他類型的交易使用時 raise ValueError
+    """
+    from models.data_manager import find_transaction_by_idempotency_key
+    
+    existing = find_transaction_by_idempotency_key(idempotency_key)
+    if existing is None:
+        return None
+    if existing['交易類型'] != transaction_type:
+        raise ValueError(f"冪等鍵已用於{existing['交易類型']}交易 ID {existing['交易ID']}")
+    logger.info(f"重複的{transaction_type}請求，返回原交易: ID {existing['交易ID']}")
+    return existing
+
 # 記錄進貨
-def record_purchase(date, supplier, product_name, unit, quantity, unit_price, staff):
+def record_purchase(date, supplier, product_name, unit, quantity, unit_price, staff, idempotency_key=None):
     try:
+        # 重複的請求直接返回原交易
+        existing = _find_replay(idempotency_key, '進貨')
+        if existing:
+            return existing['交易ID']
+        
         # 計算總價
         total_price = quantity * unit_price
         
@@ -30,9 +59,13 @@ def record_purchase(date, supplier, product_name, unit, quantity, unit_price, st
             '單價': unit_price,
             '總價': total_price,
             '供應商': supplier,
-            '退貨原因': ''  # 進貨不需要退貨原因
+            '退貨原因': '',  # 進貨不需要退貨原因
+            '冪等鍵': idempotency_key
         }
         
+        # 已有的產品單位在記錄交易時一起增加庫存；新產品或新單位先建立庫存條目
+        quantity_change = None
+        
         # 如果產品已存在，添加產品編號並更新庫存
         if product_info:
             # 查找相同單位的產品
@@ -40,9 +73,8 @@ def record_purchase(date, supplier, product_name, unit, quantity, unit_price, st
             
             if matching_unit:
                 # 產品和單位都匹配，更新數量
-                product_id = matching_unit['product_id']
-                transaction_data['產品編號'] = product_id
-                update_inventory_quantity(product_id, unit, quantity)
+                transaction_data['產品編號'] = matching_unit['product_id']
+                quantity_change = quantity
             else:
                 # 產品存在但單位不同，創建新的產品條目
                 from models.inventory import add_new_product
@@ -55,41 +87,107 @@ def record_purchase(date, supplier, product_name, unit, quantity, unit_price, st
             transaction_data['產品編號'] = product_id
         
         # 添加交易記錄
-        transaction_id = add_transaction(transaction_data)
+        transaction_id = add_transaction(transaction_data, quantity_change)
+        
+        if not transaction_id:
+            # 交易未記錄（同一個冪等鍵的請求同時送達被唯一索引拒絕，或寫入失敗），撤銷剛才建立的庫存條目
+            if quantity_change is None:
+                update_inventory_quantity(transaction_data['產品編號'], unit, -quantity)
+            existing = _find_replay(idempotency_key, '進貨')
+            if existing:
+                return existing['交易ID']
+            logger.error(f"進貨記錄失敗: 產品 {product_name}, 數量 {quantity} {unit}")
+            return None
+        
+        _publish_inventory_change(product_name)
         
-        logger.info(f"已記錄進貨交易: ID {transaction_id}, 產品 {product_name}, 數量 {quantity} {unit}")
+        logger.info(f"已記錄進貨交易: ID {transaction_id}, 產品 {product_name}, 數量 {quantity} {unit}",
+                    extra={'audit': True})
         return transaction_id
     except Exception as e:
         logger.error(f"記錄進貨時出錯: {str(e)}")
         return None
 
 # 記錄銷售
-def record_sale(date, shift, staff, product_name, unit, quantity, unit_price):
+def record_sale(date, shift, staff, product_name, unit, quantity, unit_price, idempotency_key=None):
+    # 冪等鍵的檢查由 record_sale_detailed 處理，重複的請求返回原交易ID
+    result = record_sale_detailed(date, shift, staff, product_name, unit, quantity, unit_price,
+                                  idempotency_key=idempotency_key)
+    return result['transaction_id'] if result['success'] else None
+
+# 產品單位目前的庫存（已從庫存中移除時為0）
+def _current_quantity(product_id, unit):
+    rows = db_manager.execute_query(
+        "SELECT quantity FROM inventory WHERE product_id = ? AND unit = ?",
+        (product_id, unit)
+    )
+    return float(rows[0]['quantity']) if rows else 0.0
+
+# 組合銷售結果（該單位目前的庫存與本班累計）
+def _sale_result(transaction_id, product_id, unit, total_price, date, shift, duplicate=False):
+    from models.data_manager import read_shift_sales_total
+    
+    return {
+        'success': True,
+        'duplicate': duplicate,
+        'transaction_id': transaction_id,
+        'product_id': int(product_id),
+        'unit': unit,
+        'remaining_quantity': _current_quantity(product_id, unit),
+        'total_price': total_price,
+        'shift_sales': read_shift_sales_total(date, shift)
+    }
+
+# 已記錄過的銷售（冪等鍵重複）
+def _sale_replay(existing):
+    return _sale_result(existing['交易ID'], existing['產品編號'], existing['單位'], existing['總價'],
+                        existing['日期'], existing['班別'], duplicate=True)
+
+# 記錄銷售並返回更新後的庫存
+def record_sale_detailed(date, shift, staff, product_name, unit, quantity, unit_price,
+                         idempotency_key=None, sale_time=None):
+    """
+    記錄銷售並返回收銀台更新畫面所需的資料
+    
+    參數:
+        idempotency_key (str): 客戶端產生的冪等鍵，同一個鍵只會記錄一次
+        sale_time (str): 銷售時間 HH:MM:SS（離線暫存的銷售使用收銀台記錄的時間），預設為現在
+    
+    返回:
+        dict: 成功時為 {'success': True, 'duplicate', 'transaction_id', 'product_id', 'unit',
+              'remaining_quantity', 'total_price', 'shift_sales'}，失敗時為 {'success': False, 'message'}
+              重複的請求返回原交易，duplicate 為 True
+    """
     try:
+        # 已記錄過的請求只需一次索引查詢
+        existing = _find_replay(idempotency_key, '銷售')
+        if existing:
+            return _sale_replay(existing)
+        
         # 獲取產品詳情
         product_info = get_product_details(product_name=product_name)
         
         if not product_info:
             logger.error(f"找不到產品: {product_name}")
-            return None
+            return {'success': False, 'message': f"找不到產品: {product_name}"}
         
         # 查找相同單位的產品
         matching_unit = next((u for u in product_info['units_info'] if u['unit'] == unit), None)
         
         if not matching_unit:
             logger.error(f"找不到產品單位: {product_name}, {unit}")
-            return None
+            return {'success': False, 'message': f"找不到產品單位: {product_name}, {unit}"}
         
         # 檢查庫存是否足夠
         if matching_unit['quantity'] < quantity:
             logger.error(f"庫存不足: {product_name}, {unit}, 需要 {quantity}, 庫存 {matching_unit['quantity']}")
-            return None
+            return {'success': False, 'message': f"庫存不足: {product_name} 剩餘 {matching_unit['quantity']} {unit}"}
         
         # 計算總價
         total_price = quantity * unit_price
         
         # 獲取台灣時間
-        current_time = get_taiwan_time().strftime('%H:%M:%S')
+        current_time = sale_time or get_taiwan_time().strftime('%H:%M:%S')
         
         # 準備交易數據
         transaction_data = {
@@ -105,24 +203,55 @@ def record_sale(date, shift, staff, product_name, unit, quantity, unit_price):
             '單價': unit_price,
             '總價': total_price,
             '供應商': matching_unit['supplier'],
-            '退貨原因': ''  # 銷售不需要退貨原因
+            '退貨原因': '',  # 銷售不需要退貨原因
+            '冪等鍵': idempotency_key
         }
         
-        # 添加交易記錄
-        transaction_id = add_transaction(transaction_data)
+        # 添加交易記錄並減少庫存（同一個交易，庫存已被其他收銀台賣出時不記錄）
+        transaction_id = add_transaction(transaction_data, -quantity)
         
-        # 更新庫存（減少庫存數量）
-        update_inventory_quantity(matching_unit['product_id'], unit, -quantity)
+        if not transaction_id:
+            # 同一個冪等鍵的請求同時送達時，後到的會被唯一索引拒絕
+            existing = _find_replay(idempotency_key, '銷售')
+            if existing:
+                return _sale_replay(existing)
+            remaining = _current_quantity(matching_unit['product_id'], unit)
+            if remaining < quantity:
+                return {'success': False, 'message': f"庫存不足: {product_name} 剩餘 {remaining} {unit}"}
+            return {'success': False, 'message': "銷售記錄失敗"}
         
-        logger.info(f"已記錄銷售交易: ID {transaction_id}, 產品 {product_name}, 數量 {quantity} {unit}")
-        return transaction_id
+        result = _sale_result(transaction_id, matching_unit['product_id'], unit, total_price, date, shift)
+        
+        # 通知其他收銀台與庫存頁面
+        from models.event_bus import publish
+        _publish_inventory_change(product_name)
+        publish('sale', {
+            'transaction_id': transaction_id,
+            'date': date,
+            'shift': shift,
+            'staff': staff,
+            'product_name': product_name,
+            'unit': unit,
+            'quantity': quantity,
+            'total_price': total_price,
+            'shift_sales': result['shift_sales']
+        })
+        
+        logger.info(f"已記錄銷售交易: ID {transaction_id}, 產品 {product_name}, 數量 {quantity} {unit}",
+                    extra={'audit': True})
+        return result
     except Exception as e:
         logger.error(f"記錄銷售時出錯: {str(e)}")
-        return None
+        return {'success': False, 'message': f"記錄銷售時出錯: {str(e)}"}
 
 # 記錄退貨
-def record_return(date, supplier, product_name, unit, quantity, staff, reason):
+def record_return(date, supplier, product_name, unit, quantity, staff, reason, idempotency_key=None):
     try:
+        # 重複的請求直接返回原交易
+        existing = _find_replay(idempotency_key, '退貨')
+        if existing:
+            return existing['交易ID']
+        
         # 獲取產品詳情
         product_info = get_product_details(product_name=product_name)
         
@@ -163,16 +292,25 @@ def record_return(date, supplier, product_name, unit, quantity, staff, reason):
             '單價': unit_price,
             '總價': total_price,
             '供應商': supplier,
-            '退貨原因': reason
+            '退貨原因': reason,
+            '冪等鍵': idempotency_key
         }
         
-        # 添加交易記錄
-        transaction_id = add_transaction(transaction_data)
+        # 添加交易記錄並減少庫存（同一個交易，庫存不足時不記錄）
+        transaction_id = add_transaction(transaction_data, -quantity)
+        
+        if not transaction_id:
+            # 同一個冪等鍵的請求同時送達時，後到的會被唯一索引拒絕
+            existing = _find_replay(idempotency_key, '退貨')
+            if existing:
+                return existing['交易ID']
+            logger.error(f"退貨記錄失敗: {product_name}, {unit}, 數量 {quantity}")
+            return None
         
-        # 更新庫存（減少庫存數量）
-        update_inventory_quantity(matching_unit['product_id'], unit, -quantity)
+        _publish_inventory_change(product_name)
         
-        logger.info(f"已記錄退貨交易: ID {transaction_id}, 產品 {product_name}, 數量 {quantity} {unit}")
+        logger.info(f"已記錄退貨交易: ID {transaction_id}, 產品 {product_name}, 數量 {quantity} {unit}",
+                    extra={'audit': True})
         return transaction_id
     except Exception as e:
         logger.error(f"記錄退貨時出錯: {str(e)}")
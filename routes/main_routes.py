@@ -1,17 +1,28 @@
-from flask import render_template, request, redirect, url_for, jsonify, Blueprint, send_file, session, flash
+from flask import render_template, request, redirect, url_for, jsonify, Blueprint, send_file, session, flash, Response
 from utils.common import get_taiwan_time, logger, get_current_shift
 from models.data_manager import get_staff_and_farmers, read_inventory, add_new_farmer, read_master_data, save_master_data
-from models.inventory import get_product_details, get_products_by_supplier
+from models.inventory import get_product_details, get_products_by_supplier, get_products_grouped_by_supplier
 from models.transactions import record_purchase, record_sale, record_return
 from models.report_generator import generate_reports
 from flask_login import login_required, current_user
 from auth import authorized_required
-import pandas as pd
 import os
+import io
+import csv
+import zlib
+import uuid
 from datetime import datetime
+from utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 main_routes = Blueprint('main_routes', __name__)
 
+# 取得請求的冪等鍵（Idempotency-Key 標頭或表單欄位 idempotency_key）
+def _idempotency_key(data=None):
+    data = request.form if data is None else data
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key') or None
+
 # 主頁路由
 @main_routes.route('/index')
 @login_required
@@ -19,7 +30,7 @@ main_routes = Blueprint('main_routes', __name__)
 def index():
     today = get_taiwan_time().strftime('%Y-%m-%d')
     current_shift = get_current_shift()
-    logger.info(f"訪問首頁，日期：{today}，班別：{current_shift}")
+    logger.debug(f"訪問首頁，日期：{today}，班別：{current_shift}")
     return render_template('index.html', today=today, current_shift=current_shift)
 
 # 選擇操作頁面
@@ -27,7 +38,7 @@ def index():
 @login_required
 @authorized_required
 def select_operation():
-    logger.info("訪問選擇操作頁面")
+    logger.debug("訪問選擇操作頁面")
     return render_template('select_operation.html')
 
 # 進貨頁面
@@ -71,13 +82,14 @@ def purchase():
         unit_price = float(request.form.get('unit_price'))
         staff = request.form.get('staff')
         
-        logger.info(f"進貨記錄：日期={date}, 供應商={supplier}, 產品={product_name}, 單位={unit}, 數量={quantity}, 單價={unit_price}, 員工={staff}")
+        logger.debug(f"進貨記錄：日期={date}, 供應商={supplier}, 產品={product_name}, 單位={unit}, 數量={quantity}, 單價={unit_price}, 員工={staff}")
         
         try:
-            transaction_id = record_purchase(date, supplier, product_name, unit, quantity, unit_price, staff)
+            transaction_id = record_purchase(date, supplier, product_name, unit, quantity, unit_price, staff,
+                                             idempotency_key=_idempotency_key())
             
             if transaction_id:
-                logger.info("進貨記錄成功")
+                logger.debug("進貨記錄成功")
                 return redirect(url_for('main_routes.select_operation'))
             else:
                 logger.error("進貨記錄失敗")
@@ -90,8 +102,11 @@ def purchase():
     
     # 讀取員工和廠商列表
     staff, suppliers = get_staff_and_farmers()
-    logger.info(f"訪問進貨頁面，加載員工列表{staff}和廠商列表{suppliers}")
-    return render_template('purchase.html', staff=staff, suppliers=suppliers)
+    logger.debug(f"訪問進貨頁面，員工 {len(staff)} 人，廠商 {len(suppliers)} 家")
+    return render_template('purchase.html', staff=staff, suppliers=suppliers, idempotency_key=uuid.uuid4().hex)
+
+# 退貨頁面直接嵌入的產品數上限
+RETURN_GOODS_EMBED_MAX_PRODUCTS = 500
 
 # 退貨頁面
 @main_routes.route('/return_goods', methods=['GET', 'POST'])
@@ -108,13 +123,14 @@ def return_goods():
         staff = request.form.get('staff')
         reason = request.form.get('reason', '')
         
-        logger.info(f"退貨記錄：日期={date}, 廠商={supplier}, 產品={product_name}, 單位={unit}, 數量={quantity}, 員工={staff}, 原因={reason}")
+        logger.debug(f"退貨記錄：日期={date}, 廠商={supplier}, 產品={product_name}, 單位={unit}, 數量={quantity}, 員工={staff}, 原因={reason}")
         
         try:
-            transaction_id = record_return(date, supplier, product_name, unit, quantity, staff, reason)
+            transaction_id = record_return(date, supplier, product_name, unit, quantity, staff, reason,
+                                           idempotency_key=_idempotency_key())
             
             if transaction_id:
-                logger.info("退貨記錄成功")
+                logger.debug("退貨記錄成功")
                 return redirect(url_for('main_routes.select_operation'))
             else:
                 logger.error("退貨記錄失敗")
@@ -128,15 +144,16 @@ def return_goods():
     # 讀取員工和廠商列表
     staff, suppliers = get_staff_and_farmers()
     
-    # 為每個廠商讀取產品列表
-    products_by_supplier = {}
-    for supplier in suppliers:
-        products = get_products_by_supplier(supplier)
-        if products:
-            products_by_supplier[supplier] = products
+    # 以單一查詢讀取所有廠商的產品列表
+    products_by_supplier = get_products_grouped_by_supplier(suppliers)
     
-    logger.info(f"訪問退貨頁面，加載員工列表{staff}和廠商清單")
-    return render_template('return_goods.html', staff=staff, suppliers=suppliers, products_by_supplier=products_by_supplier)
+    # 產品太多時不嵌入頁面，改由頁面依廠商向 /api/supplier_products 載入
+    if sum(len(products) for products in products_by_supplier.values()) > RETURN_GOODS_EMBED_MAX_PRODUCTS:
+        products_by_supplier = {}
+    
+    logger.debug(f"訪問退貨頁面，員工 {len(staff)} 人")
+    return render_template('return_goods.html', staff=staff, suppliers=suppliers, products_by_supplier=products_by_supplier,
+                           idempotency_key=uuid.uuid4().hex)
 
 # 銷售頁面
 @main_routes.route('/sale', methods=['GET', 'POST'])
@@ -153,13 +170,14 @@ def sale():
         quantity = float(request.form.get('quantity'))
         unit_price = float(request.form.get('unit_price'))
         
-        logger.info(f"銷售記錄：日期={date}, 班別={shift}, 員工={staff}, 產品={product_name}, 單位={unit}, 數量={quantity}, 單價={unit_price}")
+        logger.debug(f"銷售記錄：日期={date}, 班別={shift}, 員工={staff}, 產品={product_name}, 單位={unit}, 數量={quantity}, 單價={unit_price}")
         
         try:
-            transaction_id = record_sale(date, shift, staff, product_name, unit, quantity, unit_price)
+            transaction_id = record_sale(date, shift, staff, product_name, unit, quantity, unit_price,
+                                         idempotency_key=_idempotency_key())
             
             if transaction_id:
-                logger.info("銷售記錄成功")
+                logger.debug("銷售記錄成功")
                 return redirect(url_for('main_routes.select_operation'))
             else:
                 logger.error("銷售記錄失敗")
@@ -170,20 +188,135 @@ def sale():
             logger.error(traceback.format_exc())
             return f"銷售記錄發生錯誤: {str(e)}", 500
     
+    from models.pos_catalog import build_catalog
+    
     staff, _ = get_staff_and_farmers()
-    inventory = read_inventory()
-    # 取得有庫存的產品列表（確保產品名稱不重複）
-    products = inventory[inventory['數量'] > 0]['產品名稱'].unique().tolist()
+    # 取得有庫存的產品列表（頁面載入後會再以 /api/pos/bootstrap 取得完整目錄）
+    _, catalog = build_catalog()
+    products = list(catalog.keys())
     
-    logger.info(f"訪問銷售頁面，加載員工列表{staff}和產品列表{products}")
-    return render_template('sale.html', staff=staff, products=products)
+    logger.debug(f"訪問銷售頁面，員工 {len(staff)} 人，產品 {len(products)} 項")
+    return render_template('sale.html', staff=staff, products=products, idempotency_key=uuid.uuid4().hex)
+
+# 收銀台送出銷售的必填欄位
+SALE_API_FIELDS = ['date', 'shift', 'staff', 'product_name', 'unit', 'quantity', 'unit_price']
+
+# 批次送出銷售的筆數上限
+SALE_BATCH_MAX_ITEMS = 200
+
+# 檢查並轉換收銀台送出的銷售資料
+def _parse_sale_payload(data):
+    """
+    返回:
+        tuple: (銷售參數dict, None)，資料不正確時為 (None, 錯誤訊息)
+    """
+    missing = [field for field in SALE_API_FIELDS if data.get(field) in (None, '')]
+    if missing:
+        return None, f"缺少欄位: {', '.join(missing)}"
+    
+    try:
+        quantity = float(data.get('quantity'))
+        unit_price = float(data.get('unit_price'))
+    except (TypeError, ValueError):
+        return None, "數量和單價必須是數字"
+    if quantity <= 0 or unit_price < 0:
+        return None, "數量必須大於0，單價不可為負數"
+    
+    # 離線暫存的銷售帶有收銀台記錄的時間
+    sale_time = data.get('time') or None
+    if sale_time:
+        try:
+            sale_time = datetime.strptime(sale_time, '%H:%M:%S').strftime('%H:%M:%S')
+        except (TypeError, ValueError):
+            return None, "時間格式必須是 HH:MM:SS"
+    
+    return {
+        'date': data.get('date'),
+        'shift': data.get('shift'),
+        'staff': data.get('staff'),
+        'product_name': data.get('product_name'),
+        'unit': data.get('unit'),
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'idempotency_key': data.get('idempotency_key') or None,
+        'sale_time': sale_time
+    }, None
+
+# API路由：收銀台送出銷售
+@main_routes.route('/api/sale', methods=['POST'])
+@login_required
+@authorized_required
+def api_sale():
+    """
+    以 JSON 記錄一筆銷售，返回交易ID、該單位更新後的庫存與本班累計銷售，
+    收銀台不需要重新導向和重新載入頁面
+    """
+    from models.transactions import record_sale_detailed
+    
+    data = request.get_json(silent=True) or request.form
+    sale_args, error = _parse_sale_payload(data)
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+    sale_args['idempotency_key'] = _idempotency_key(data)
+    
+    result = record_sale_detailed(**sale_args)
+    if not result['success']:
+        return jsonify(result), 409
+    
+    result['product_name'] = sale_args['product_name']
+    return jsonify(result)
+
+# API路由：批次送出收銀台離線暫存的銷售
+@main_routes.route('/api/sales/batch', methods=['POST'])
+@login_required
+@authorized_required
+def api_sales_batch():
+    """
+    依序記錄多筆銷售，每筆都必須帶有冪等鍵（重送的銷售只返回原交易，不會重複記錄）
+    
+    請求: {"sales": [{"idempotency_key", "date", "shift", "staff", "product_name", "unit",
+                      "quantity", "unit_price", "time"}, ...]}
+    返回: {"results": [{"idempotency_key", "success", "duplicate", "transaction_id", "shift_sales", "message"}, ...]}
+    """
+    from models.transactions import record_sale_detailed
+    
+    sales = (request.get_json(silent=True) or {}).get('sales')
+    if not isinstance(sales, list) or not sales:
+        return jsonify({'success': False, 'message': "請提供 sales 列表"}), 400
+    if len(sales) > SALE_BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f"每批最多 {SALE_BATCH_MAX_ITEMS} 筆"}), 413
+    
+    results = []
+    for item in sales:
+        item = item if isinstance(item, dict) else {}
+        key = item.get('idempotency_key')
+        sale_args, error = _parse_sale_payload(item)
+        if not error and not key:
+            error = "缺少欄位: idempotency_key"
+        if error:
+            results.append({'idempotency_key': key, 'success': False, 'message': error})
+            continue
+        
+        result = record_sale_detailed(**sale_args)
+        results.append({
+            'idempotency_key': key,
+            'success': result['success'],
+            'duplicate': result.get('duplicate', False),
+            'transaction_id': result.get('transaction_id'),
+            'shift_sales': result.get('shift_sales'),
+            'message': result.get('message', '')
+        })
+    
+    recorded = sum(1 for result in results if result['success'] and not result['duplicate'])
+    logger.info(f"批次銷售：共 {len(results)} 筆，新記錄 {recorded} 筆")
+    return jsonify({'success': True, 'results': results})
 
 # 班別銷售查詢頁面
 @main_routes.route('/shift_sales', methods=['GET', 'POST'])
 @login_required
 @authorized_required
 def shift_sales():
-    from models.data_manager import read_transactions
+    from models.data_manager import read_shift_sales
     
     today = get_taiwan_time().strftime('%Y-%m-%d')
     current_shift = get_current_shift()
@@ -191,37 +324,35 @@ def shift_sales():
     # 準備班別選項
     shifts = ['早班', '午班', '晚班']
     
-    # 初始化銷售數據
-    sales_data = None
-    total_sales_amount = 0
-    date = today
-    shift = current_shift
+    # 表單提交或網址參數（收銀機終端可用 GET 查詢）
+    params = request.form if request.method == 'POST' else request.args
+    date = params.get('date') or today
+    shift = params.get('shift') or current_shift
+    want_json = request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
     
-    if request.method == 'POST':
-        # 獲取選擇的日期和班別
-        date = request.form.get('date')
-        shift = request.form.get('shift')
-        
-        # 讀取銷售數據
-        sales_df = read_transactions('銷售')
-        
-        # 過濾指定日期和班別的數據
-        sales_data = sales_df[(sales_df['日期'] == date) & (sales_df['班別'] == shift)]
-        
-        # 計算總銷售額
-        total_sales_amount = sales_data['總價'].sum() if not sales_data.empty else 0
-        
-        logger.info(f"查詢班別銷售：日期={date}, 班別={shift}, 找到 {len(sales_data)} 筆記錄")
-    
-    # 將 DataFrame 轉換為可以在模板中使用的列表
-    sales_records = [] if sales_data is None or sales_data.empty else sales_data.to_dict('records')
+    # 初始化銷售數據
+    shift_data = {'records': [], 'total': 0, 'count': 0}
+    
+    if request.method == 'POST' or 'date' in request.args or 'shift' in request.args or want_json:
+        # 只讀取指定日期和班別的銷售
+        shift_data = read_shift_sales(date, shift)
+        logger.debug(f"查詢班別銷售：日期={date}, 班別={shift}, 找到 {shift_data['count']} 筆記錄")
+    
+    if want_json:
+        return jsonify({
+            'date': date,
+            'shift': shift,
+            'total': shift_data['total'],
+            'count': shift_data['count'],
+            'records': shift_data['records']
+        })
     
     return render_template('shift_sales.html', 
                            date=date, 
                            shift=shift, 
                            shifts=shifts, 
-                           sales_records=sales_records, 
-                           total_sales_amount=total_sales_amount)
+                           sales_records=shift_data['records'], 
+                           total_sales_amount=shift_data['total'])
 
 # API路由：取得產品詳情
 @main_routes.route('/api/product_details/<product_name>')
@@ -230,7 +361,7 @@ def shift_sales():
 def api_product_details(product_name):
     try:
         # 打印診斷信息
-        logger.info(f"API請求產品詳情：'{product_name}'")
+        logger.debug(f"API請求產品詳情：'{product_name}'")
         
         details = get_product_details(product_name=product_name)
         if details:
@@ -239,7 +370,7 @@ def api_product_details(product_name):
                 logger.error(f"產品 '{product_name}' 的 units 列表為空或不存在")
                 return jsonify({"error": "產品單位資料不完整"}), 500
                 
-            logger.info(f"回傳 API 結果: 找到 {len(details['units'])} 種單位")
+            logger.debug(f"回傳 API 結果: 找到 {len(details['units'])} 種單位")
             
             # 特別設置正確的 Content-Type 以確保中文正確顯示
             response = jsonify(details)
@@ -261,7 +392,7 @@ def api_product_details(product_name):
 def api_supplier_products(supplier_name):
     try:
         # 打印診斷信息
-        logger.info(f"API請求廠商產品：'{supplier_name}'")
+        logger.debug(f"API請求廠商產品：'{supplier_name}'")
         
         # 獲取廠商產品
         products = get_products_by_supplier(supplier_name)
@@ -270,12 +401,16 @@ def api_supplier_products(supplier_name):
             logger.warning(f"找不到廠商 '{supplier_name}' 的庫存產品")
             return jsonify({"error": "找不到廠商庫存"}), 404
             
-        logger.info(f"回傳 API 結果: 找到 {len(products)} 個產品")
+        logger.debug(f"回傳 API 結果: 找到 {len(products)} 個產品")
         
         # 特別設置正確的 Content-Type 以確保中文正確顯示
         response = jsonify({"products": products})
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
+        
+        # 以內容雜湊作為 ETag，庫存未變動時瀏覽器重新驗證只會得到 304
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"獲取廠商產品時發生錯誤: {str(e)}")
         import traceback
@@ -287,18 +422,153 @@ def api_supplier_products(supplier_name):
 @login_required
 @authorized_required
 def api_inventory():
-    logger.info("訪問庫存API")
+    logger.debug("訪問庫存API")
     inventory_data = read_inventory()
     return jsonify(inventory_data.to_dict('records'))
 
+# API路由：收銀台初始資料（員工、班別、產品目錄）
+@main_routes.route('/api/pos/bootstrap')
+@login_required
+@authorized_required
+def api_pos_bootstrap():
+    from models.pos_catalog import get_catalog
+    from models.data_manager import read_shift_sales_total
+    
+    staff, _ = get_staff_and_farmers()
+    shift = get_current_shift()
+    date = get_taiwan_time().strftime('%Y-%m-%d')
+    payload = get_catalog()
+    payload.update({
+        'staff': staff,
+        'shift': shift,
+        'date': date,
+        'shift_sales': read_shift_sales_total(date, shift)
+    })
+    return jsonify(payload)
+
+# API路由：收銀台產品目錄變動
+@main_routes.route('/api/pos/delta')
+@login_required
+@authorized_required
+def api_pos_delta():
+    from models.pos_catalog import get_catalog_delta
+    
+    return jsonify(get_catalog_delta(request.args.get('since', '')))
+
+# 串流連線的最長時間（秒），之後由瀏覽器帶 Last-Event-ID 重新連線，讓連線分散到各 worker
+STREAM_MAX_SECONDS = 300
+
+# 沒有事件時送出保持連線訊息的間隔（秒），也用來偵測已斷線的客戶端
+STREAM_HEARTBEAT_SECONDS = 15
+
+# API路由：庫存與銷售變動的 Server-Sent Events 串流
+@main_routes.route('/api/stream')
+@login_required
+@authorized_required
+def api_stream():
+    """
+    推送事件：
+        inventory  單一產品所有單位的最新庫存（格式同收銀台目錄）
+        sale       新的銷售與本班累計
+        resync     需要重新載入完整資料
+    """
+    import time
+    from models.event_bus import bus, format_sse
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = bus.subscribe(last_event_id)
+    if subscription is None:
+        # 連線數已達上限，收銀台改用 /api/pos/delta
+        response = jsonify({'success': False, 'message': "即時更新連線數已達上限"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                yield format_sse(event) if event else ': keepalive\n\n'
+        finally:
+            bus.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# 交易記錄CSV匯出的欄位順序
+EXPORT_CSV_COLUMNS = ['交易ID', '交易類型', '日期', '時間', '員工', '班別', '產品編號', '產品名稱',
+                      '單位', '數量', '單價', '總價', '供應商', '退貨原因']
+
+# 每批從資料庫讀取的交易筆數
+EXPORT_CHUNK_SIZE = 1000
+
+# API路由：串流匯出交易記錄CSV
+@main_routes.route('/api/transactions/export.csv')
+@login_required
+@authorized_required
+def api_export_transactions_csv():
+    from models.data_manager import iter_transactions
+    
+    # 從查詢參數取得篩選條件
+    transaction_type = request.args.get('type') or None
+    start_date = request.args.get('start_date') or None
+    end_date = request.args.get('end_date') or None
+    supplier = request.args.get('supplier') or None
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    logger.info(f"匯出交易記錄CSV: 類型={transaction_type}, 開始日期={start_date}, 結束日期={end_date}, 供應商={supplier}, gzip={use_gzip}")
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        
+        # 加上BOM讓Excel正確辨識UTF-8中文
+        buffer.write('\ufeff')
+        writer.writerow(EXPORT_CSV_COLUMNS)
+        
+        for rows in iter_transactions(transaction_type, start_date, end_date, supplier, chunk_size=EXPORT_CHUNK_SIZE):
+            for row in rows:
+                writer.writerow([row[col] for col in EXPORT_CSV_COLUMNS])
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+        
+        # 輸出剩餘內容（沒有任何資料時只有標題列）
+        remaining = buffer.getvalue()
+        if remaining:
+            yield remaining.encode('utf-8')
+    
+    def generate_gzip():
+        # wbits=31 產生標準gzip格式
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in generate_csv():
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    
+    file_name = f"transactions_{get_taiwan_time().strftime('%Y%m%d_%H%M%S')}.csv"
+    if use_gzip:
+        response = Response(generate_gzip(), mimetype='application/gzip')
+        file_name += '.gz'
+    else:
+        response = Response(generate_csv(), mimetype='text/csv')
+        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    
+    response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # 庫存頁面
 @main_routes.route('/inventory')
 @login_required
 @authorized_required
 def inventory():
-    logger.info("訪問庫存頁面")
+    logger.debug("訪問庫存頁面")
     inventory_data = read_inventory()
-    logger.info(f"庫存數據計數：{len(inventory_data)}")
+    logger.debug(f"庫存數據計數：{len(inventory_data)}")
     return render_template('inventory.html', inventory=inventory_data.to_dict('records'))
 
 # 下載報表檔案
@@ -316,6 +586,37 @@ def download_report(path):
     else:
         return f"找不到報表文件: {path}", 404
 
+# 打包下載整批報表（ZIP串流）
+@main_routes.route('/download_report_bundle/<path:run>')
+@login_required
+@authorized_required
+def download_report_bundle(run):
+    from utils.common import REPORTS_PATH
+    from utils.zip_stream import collect_zip_entries, compute_zip_size, can_stream_zip, iter_zip_stream
+    from werkzeug.utils import safe_join
+    from urllib.parse import quote
+    
+    # 防止存取報表目錄以外的路徑
+    run_dir = safe_join(REPORTS_PATH, run)
+    if not run_dir or not os.path.isdir(run_dir):
+        return f"找不到報表目錄: {run}", 404
+    
+    entries = collect_zip_entries(run_dir)
+    if not entries:
+        return f"報表目錄中沒有檔案: {run}", 404
+    
+    if not can_stream_zip(entries):
+        logger.error(f"報表目錄過大，無法打包: {run}")
+        return "報表目錄過大，請分別下載", 413
+    
+    logger.info(f"打包下載報表: {run}，共 {len(entries)} 個檔案")
+    
+    zip_name = f"{os.path.basename(os.path.normpath(run_dir))}.zip"
+    response = Response(iter_zip_stream(entries), mimetype='application/zip')
+    response.headers['Content-Length'] = str(compute_zip_size(entries))
+    response.headers['Content-Disposition'] = f"attachment; filename=\"reports.zip\"; filename*=UTF-8''{quote(zip_name)}"
+    return response
+
 # 報表生成頁面
 @main_routes.route('/generate_reports', methods=['GET', 'POST'])
 @login_required
@@ -352,6 +653,7 @@ def generate_reports_route():
         )
         
         if success:
+            from utils.common import REPORTS_PATH
             logger.info(f"報表生成成功，儲存於：{report_dir}")
             
             # 添加下載URL
@@ -366,11 +668,16 @@ def generate_reports_route():
                     sub_path = os.path.join(dir_name, file_name)
                     report['url'] = url_for('main_routes.download_report', path=sub_path)
             
+            # 整批打包下載連結
+            run = os.path.relpath(report_dir, REPORTS_PATH)
+            bundle_url = url_for('main_routes.download_report_bundle', run=run)
+            
             # 返回 JSON 響應，包含成功消息和下載連結
             return jsonify({
                 'success': True,
                 'message': f"報表已生成完成，檢視期間: {date_range_str}",
-                'files': report_files
+                'files': report_files,
+                'bundle_url': bundle_url
             })
         else:
             logger.error(f"生成報表失敗")
@@ -385,7 +692,7 @@ def generate_reports_route():
     years = list(range(current_year - 5, current_year + 1))
     months = list(range(1, 13))
     
-    logger.info("訪問報表生成頁面")
+    logger.debug("訪問報表生成頁面")
     return render_template('generate_reports.html', years=years, months=months, 
                           current_year=current_year, current_month=current_month)
 
@@ -415,9 +722,39 @@ def admin_dashboard():
         flash("請先登入")
         return redirect(url_for('main_routes.admin_login'))
     
-    logger.info("訪問管理控制台")
+    logger.debug("訪問管理控制台")
     return render_template('admin_dashboard.html')
 
+# API路由：分析立方體查詢
+@main_routes.route('/api/analytics/cube')
+@login_required
+@authorized_required
+def api_analytics_cube():
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "需要管理員權限"}), 403
+
+    import time
+    from models.analytics_cube import cube, DIMENSIONS
+
+    group_by = [dim for dim in request.args.get('group_by', '').split(',') if dim]
+    filters = {dim: request.args.get(dim) for dim in DIMENSIONS if request.args.get(dim)}
+    # 預設只統計銷售
+    filters.setdefault('type', '銷售')
+
+    try:
+        started = time.perf_counter()
+        result = cube.query(group_by=group_by,
+                            start_date=request.args.get('start_date'),
+                            end_date=request.args.get('end_date'),
+                            filters=filters,
+                            limit=request.args.get('limit', type=int))
+        result['group_by'] = group_by
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"查詢分析立方體時發生錯誤: {str(e)}")
+        return jsonify({"error": f"發生錯誤: {str(e)}"}), 500
+
 # 系統設定頁面
 @main_routes.route('/admin/system_config', methods=['GET', 'POST'])
 @login_required
@@ -508,7 +845,7 @@ def admin_inventory():
     if not session.get('admin_logged_in'):
         return redirect(url_for('main_routes.admin_login'))
     
-    from models.data_manager import save_inventory
+    from models.data_manager import save_inventory, InventoryConflictError
     
     if request.method == 'POST':
         # 處理表單提交
@@ -520,6 +857,9 @@ def admin_inventory():
             quantities = request.form.getlist('quantity')
             unit_prices = request.form.getlist('unit_price')
             suppliers = request.form.getlist('supplier')
+            # 載入頁面時的版本（新增的列為空白），以及被刪除的產品
+            versions = request.form.getlist('version')
+            deleted = list(zip(request.form.getlist('deleted_product_id'), request.form.getlist('deleted_version')))
             
             # 創建DataFrame
             df = pd.DataFrame({
@@ -528,25 +868,32 @@ def admin_inventory():
                 '單位': units,
                 '數量': [float(q) for q in quantities],
                 '單價': [float(p) for p in unit_prices],
-                '供應商': suppliers
+                '供應商': suppliers,
+                '版本': [int(v) if v else None for v in versions]
             })
             
-            # 保存到資料庫
-            success = save_inventory(df)
+            # 保存到資料庫（內容已被收銀台或其他管理者修改時整批拒絕）
+            success = save_inventory(df, deleted)
             
             if success:
                 logger.info("庫存資料更新成功")
+                # 通知收銀台重新載入整份目錄
+                from models.event_bus import publish, RESYNC_EVENT
+                publish(RESYNC_EVENT, {})
                 flash("庫存資料已更新")
             else:
                 logger.error("庫存資料更新失敗")
                 flash("庫存資料更新失敗", "error")
                 
+        except InventoryConflictError as e:
+            flash(f"產品編號 {', '.join(str(pid) for pid in e.product_ids)} 在開啟頁面後已被修改（例如收銀台售出），"
+                  f"變更未保存，請確認下方最新資料後重新修改", "error")
         except Exception as e:
             logger.error(f"庫存資料更新發生錯誤: {str(e)}")
             flash(f"發生錯誤: {str(e)}", "error")
     
-    # 讀取當前庫存資料
-    inventory_data = read_inventory()
+    # 讀取當前庫存資料（含版本）
+    inventory_data = read_inventory(include_version=True)
     
     return render_template('admin_inventory.html', inventory=inventory_data.to_dict('records'))
 
@@ -567,7 +914,7 @@ def admin_transactions():
         end_date = request.form.get('end_date')
         
         transactions_data = read_transactions(transaction_type, start_date, end_date)
-        logger.info(f"查詢交易記錄: 類型={transaction_type}, 開始日期={start_date}, 結束日期={end_date}")
+        logger.debug(f"查詢交易記錄: 類型={transaction_type}, 開始日期={start_date}, 結束日期={end_date}")
         
         return render_template('admin_transactions.html', 
                               transactions=transactions_data.to_dict('records'),
@@ -0,0 +1,165 @@
+"""
+正式環境啟動入口
+使用 gunicorn（多 worker、多執行緒）提供服務；未安裝 gunicorn 或在 Windows 上時改用 waitress
+
+資料庫初始化在啟動 worker 前執行一次，各 worker 以 create_app(initialize=False) 建立應用。
+各 worker 把效能指標寫入共用目錄（GAS_STATION_METRICS_DIR，預設為暫存目錄下依埠號命名的目錄），
+/metrics 合併所有 worker 的數值。
+gunicorn 收到 HUP 訊號時會平順地重新載入：先啟動載入新程式碼的 worker，再讓舊 worker 處理完請求後結束。
+
+使用方式:
+    python serve.py
+    python serve.py --workers 4 --threads 8 --port 8080
+
+設定也可以使用環境變數：
+    GAS_STATION_HOST、GAS_STATION_PORT、GAS_STATION_WORKERS、GAS_STATION_THREADS、
+    GAS_STATION_TIMEOUT、GAS_STATION_SERVER（auto / gunicorn / waitress）
+"""
+import os
+import sys
+import secrets
+import argparse
+import tempfile
+import subprocess
+from utils.common import logger
+
+# 專案根目錄
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# 預設值
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 2
+DEFAULT_THREADS = 4
+# 報表生成可能需要較長時間
+DEFAULT_TIMEOUT = 120
+
+def parse_args(argv=None):
+    env = os.environ
+    parser = argparse.ArgumentParser(description='以正式環境模式啟動加油站POS系統')
+    parser.add_argument('--host', default=env.get('GAS_STATION_HOST', DEFAULT_HOST), help='監聽位址')
+    parser.add_argument('--port', type=int, default=int(env.get('GAS_STATION_PORT', DEFAULT_PORT)), help='監聽埠號')
+    parser.add_argument('--workers', type=int, default=int(env.get('GAS_STATION_WORKERS', DEFAULT_WORKERS)),
+                        help='worker 程序數量（waitress 只使用單一程序）')
+    parser.add_argument('--threads', type=int, default=int(env.get('GAS_STATION_THREADS', DEFAULT_THREADS)),
+                        help='每個 worker 的執行緒數量')
+    parser.add_argument('--timeout', type=int, default=int(env.get('GAS_STATION_TIMEOUT', DEFAULT_TIMEOUT)),
+                        help='請求逾時秒數')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress'],
+                        default=env.get('GAS_STATION_SERVER', 'auto'), help='使用的 WSGI 伺服器')
+    return parser.parse_args(argv)
+
+# 選擇 WSGI 伺服器
+def choose_server(preferred):
+    if preferred != 'auto':
+        return preferred
+    if os.name != 'nt':
+        try:
+            import gunicorn  # noqa: F401
+            return 'gunicorn'
+        except ImportError:
+            pass
+    return 'waitress'
+
+# 在獨立程序中初始化資料
+def initialize_in_subprocess():
+    """
+    執行 app.initialize_data()
+
+    gunicorn 主程序不匯入應用程式碼，HUP 重新載入時新的 worker 才會載入新版本，
+    所以初始化在短暫的子程序中進行。
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', 'from app import initialize_data; initialize_data()'],
+        cwd=BASE_PATH
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"資料初始化失敗，結束代碼 {result.returncode}")
+
+# 以 gunicorn 啟動
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class POSApplication(BaseApplication):
+        """在程式中設定並啟動 gunicorn"""
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # 在每個 worker 中建立應用，HUP 重新載入時會使用新的程式碼
+            from app import create_app
+            return create_app(initialize=False)
+
+    from utils.metrics import METRICS_DIR_ENV, reset_metrics_dir, mark_process_dead
+
+    # worker 繼承主程序的環境變數，共用同一個指標目錄
+    metrics_dir = os.environ.setdefault(
+        METRICS_DIR_ENV, os.path.join(tempfile.gettempdir(), f"gas_station_metrics_{args.port}"))
+
+    # 主程序啟動時初始化一次資料庫，並清除上一次執行留下的指標檔案
+    def on_starting(server):
+        reset_metrics_dir(metrics_dir)
+        initialize_in_subprocess()
+
+    # worker 結束後不再計入它的數值指標
+    def child_exit(server, worker):
+        mark_process_dead(worker.pid, metrics_dir)
+
+    # 重新載入時補上新版本的資料庫結構
+    def on_reload(server):
+        initialize_in_subprocess()
+
+    options = {
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'graceful_timeout': 30,
+        'keepalive': 5,
+        'preload_app': False,
+        'accesslog': '-',
+        'on_starting': on_starting,
+        'on_reload': on_reload,
+        'child_exit': child_exit,
+    }
+    logger.info(f"以 gunicorn 啟動：{options['bind']}，{args.workers} 個 worker，每個 {args.threads} 個執行緒")
+    POSApplication(options).run()
+
+# 以 waitress 啟動
+def run_waitress(args):
+    from waitress import serve
+    from app import create_app
+
+    app = create_app()
+    logger.info(f"以 waitress 啟動：{args.host}:{args.port}，{args.threads} 個執行緒")
+    serve(app, host=args.host, port=args.port, threads=args.threads, channel_timeout=args.timeout)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 未設定 SECRET_KEY 時產生一把，讓所有 worker 共用（必須在載入 config 之前設定）
+    os.environ.setdefault('GAS_STATION_SECRET_KEY', secrets.token_hex(16))
+
+    from config import check_required_config
+    errors = check_required_config()
+    if errors:
+        for message in errors:
+            print(f"錯誤: {message}")
+        return 1
+
+    server = choose_server(args.server)
+    if server == 'gunicorn':
+        run_gunicorn(args)
+    else:
+        run_waitress(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -52,7 +52,8 @@ class CloudConfigManager:
             "sync_check_interval": 60,
             "conflict_resolution_strategy": "cloud_wins",
             "retry_attempts": 3,
-            "retry_delay": 5
+            "retry_delay": 5,
+            "database_sync_mode": "delta"
         }
         
         try:
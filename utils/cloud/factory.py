@@ -0,0 +1,102 @@
+"""
+雲端物件工廠 for GAS_STATION_POS_v2
+Google Drive 連接器、同步管理器等物件在第一次使用時才建立，匯入模組時不載入 Google API，
+也不進行認證或連線檢查；每個程序只建立一次並共用
+
+雲端模式下可在啟動後以背景執行緒認證（不開啟瀏覽器），應用不必等待 Google Drive 回應
+"""
+import threading
+from utils.common import logger
+
+# 已建立的物件
+_instances = {}
+_lock = threading.RLock()
+
+# 背景認證執行緒
+_auth_thread = None
+
+# 取得或建立共用物件
+def _get_or_create(name, create):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _instances[name] = create()
+    return instance
+
+# 雲端配置管理器
+def get_cloud_config():
+    """
+    返回:
+        CloudConfigManager: 雲端配置管理器
+    """
+    def create():
+        from utils.cloud.cloud_config_manager import CloudConfigManager
+        return CloudConfigManager()
+    return _get_or_create('cloud_config', create)
+
+# Google Drive 連接器
+def get_drive_connector():
+    """
+    返回未認證的連接器，第一次使用 Drive API 前由呼叫端或背景認證執行緒認證
+
+    返回:
+        GoogleDriveConnector: Google Drive 連接器（不會開啟瀏覽器進行授權）
+    """
+    def create():
+        from utils.cloud.google_drive_connector import GoogleDriveConnector
+        cloud_config = get_cloud_config()
+        return GoogleDriveConnector(
+            credentials_path=cloud_config.get("credentials_path"),
+            token_path=cloud_config.get("token_path"),
+            interactive=False
+        )
+    return _get_or_create('drive_connector', create)
+
+# 同步管理器
+def get_sync_manager():
+    """
+    返回:
+        SyncManager: 同步管理器（第一次讀取 is_connected 時才檢查連線）
+    """
+    def create():
+        from utils.cloud.sync_manager import SyncManager
+        return SyncManager(get_drive_connector())
+    return _get_or_create('sync_manager', create)
+
+# 雲端 Excel 管理器
+def get_excel_manager():
+    """
+    返回:
+        CloudExcelManager: 雲端 Excel 管理器
+    """
+    def create():
+        from utils.cloud.excel_manager import CloudExcelManager
+        return CloudExcelManager(get_drive_connector())
+    return _get_or_create('excel_manager', create)
+
+# 在背景認證 Google Drive
+def start_background_authentication():
+    """
+    雲端模式下以背景執行緒載入已保存的令牌並建立 Drive 服務；非雲端模式不做任何事
+
+    返回:
+        threading.Thread: 認證執行緒，未啟動時返回 None
+    """
+    global _auth_thread
+    if not get_cloud_config().is_cloud_mode():
+        return None
+
+    with _lock:
+        if _auth_thread is not None:
+            return _auth_thread
+
+        def authenticate():
+            connector = get_drive_connector()
+            if not connector.authorized and not connector.authenticate():
+                logger.warning("Google Drive 背景認證失敗，雲端功能將在下次使用時重試")
+
+        _auth_thread = threading.Thread(target=authenticate, name='drive-auth', daemon=True)
+        _auth_thread.start()
+    return _auth_thread
@@ -6,15 +6,12 @@ import os
 import io
 import pickle
 import logging
+import threading
 from typing import List, Dict, Optional, Union, Tuple, Any
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google.auth.exceptions import RefreshError
 import time
 
+# Google API 套件載入較慢，在第一次認證或上傳下載時才匯入
+
 # 設置日誌
 logger = logging.getLogger(__name__)
 
@@ -25,20 +22,25 @@ class GoogleDriveConnector:
     # 定義應用程序所需的權限範圍
     SCOPES = ['https://www.googleapis.com/auth/drive']
     
-    def __init__(self, credentials_path='config/credentials.json', token_path='config/token.pickle'):
+    def __init__(self, credentials_path='config/credentials.json', token_path='config/token.pickle', interactive=True):
         """
         初始化Google Drive連接器
         
         參數:
             credentials_path (str): OAuth 2.0憑證JSON文件的路徑
             token_path (str): 保存授權令牌的路徑
+            interactive (bool): 令牌失效時是否開啟瀏覽器重新授權，伺服器上應設為False
         """
         self.credentials_path = credentials_path
         self.token_path = token_path
+        self.interactive = interactive
         self.service = None
         self.root_folder_id = None
         self.root_folder_name = 'GAS_STATION_POS'
         self.authorized = False
+        self._credentials = None
+        # 背景認證與請求執行緒可能同時認證
+        self._auth_lock = threading.Lock()
         
     def authenticate(self) -> bool:
         """
@@ -47,7 +49,20 @@ class GoogleDriveConnector:
         返回:
             bool: 認證是否成功
         """
+        with self._auth_lock:
+            if self.authorized and self.service:
+                return True
+            return self._authenticate()
+    
+    def _authenticate(self) -> bool:
+        """
+        實際的認證流程（呼叫端已持有認證鎖）
+        """
         try:
+            from googleapiclient.discovery import build
+            from google.auth.transport.requests import Request
+            from google.auth.exceptions import RefreshError
+            
             creds = None
             
             # 嘗試從現有令牌加載憑證
@@ -62,21 +77,13 @@ class GoogleDriveConnector:
                         creds.refresh(Request())
                     except RefreshError:
                         # 刷新令牌失效，需要重新認證
-                        if os.path.exists(self.credentials_path):
-                            flow = InstalledAppFlow.from_client_secrets_file(
-                                self.credentials_path, self.SCOPES)
-                            creds = flow.run_local_server(port=0)
-                        else:
-                            logger.error(f"找不到憑證文件: {self.credentials_path}")
+                        creds = self._run_authorization_flow()
+                        if creds is None:
                             return False
                 else:
                     # 需要全新的認證
-                    if os.path.exists(self.credentials_path):
-                        flow = InstalledAppFlow.from_client_secrets_file(
-                            self.credentials_path, self.SCOPES)
-                        creds = flow.run_local_server(port=0)
-                    else:
-                        logger.error(f"找不到憑證文件: {self.credentials_path}")
+                    creds = self._run_authorization_flow()
+                    if creds is None:
                         return False
                 
                 # 保存令牌供以後使用
@@ -84,6 +91,7 @@ class GoogleDriveConnector:
                     pickle.dump(creds, token)
             
             # 創建Drive API服務
+            self._credentials = creds
             self.service = build('drive', 'v3', credentials=creds)
             self.authorized = True
             
@@ -97,6 +105,44 @@ class GoogleDriveConnector:
             self.authorized = False
             return False
     
+    def clone(self) -> 'GoogleDriveConnector':
+        """
+        建立共用憑證與根文件夾、但擁有獨立 Drive 服務物件的連接器，供其他執行緒使用
+        （服務物件底層的 HTTP 連線不是執行緒安全的）
+        
+        返回:
+            GoogleDriveConnector: 新的連接器
+        """
+        if not self.service or not self.root_folder_id:
+            if not self.authenticate():
+                raise RuntimeError("Google Drive 未認證")
+        
+        from googleapiclient.discovery import build
+        client = GoogleDriveConnector(self.credentials_path, self.token_path, interactive=False)
+        client._credentials = self._credentials
+        client.service = build('drive', 'v3', credentials=self._credentials)
+        client.root_folder_id = self.root_folder_id
+        client.authorized = True
+        return client
+    
+    def _run_authorization_flow(self):
+        """
+        開啟瀏覽器進行OAuth授權
+        
+        返回:
+            憑證物件，非互動模式或找不到憑證文件時為None
+        """
+        if not self.interactive:
+            logger.error("Google Drive令牌無效，需要在本機重新授權後才能使用雲端功能")
+            return None
+        if not os.path.exists(self.credentials_path):
+            logger.error(f"找不到憑證文件: {self.credentials_path}")
+            return None
+        
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_path, self.SCOPES)
+        return flow.run_local_server(port=0)
+    
     def _ensure_root_folder(self) -> None:
         """
         確保Google Drive上存在根文件夾
@@ -308,6 +354,7 @@ class GoogleDriveConnector:
             'parents': [parent_id]
         }
         
+        from googleapiclient.http import MediaFileUpload
         media = MediaFileUpload(local_path, resumable=True)
         
         try:
@@ -334,6 +381,48 @@ class GoogleDriveConnector:
             logger.error(f"上傳文件 {remote_filename} 時出錯: {str(e)}")
             return None
     
+    def upload_file_to_folder(self, local_path: str, folder_id: str, file_id: Optional[str] = None) -> Optional[str]:
+        """
+        將文件上傳到指定ID的文件夾，不需逐層查詢文件夾路徑
+        
+        參數:
+            local_path (str): 本地文件路徑
+            folder_id (str): 雲端文件夾ID
+            file_id (Optional[str]): 已知的雲端文件ID，提供時直接更新該文件；未提供時依文件名稱查找
+            
+        返回:
+            Optional[str]: 上傳的文件ID，如果失敗（包含file_id已不存在）則為None
+        """
+        if not self.service:
+            if not self.authenticate():
+                return None
+        
+        remote_filename = os.path.basename(local_path)
+        from googleapiclient.http import MediaFileUpload
+        media = MediaFileUpload(local_path, resumable=True)
+        
+        try:
+            if file_id is None:
+                query = f"name = '{remote_filename}' and '{folder_id}' in parents and trashed = false"
+                results = self.service.files().list(q=query, spaces='drive', fields='files(id)').execute()
+                items = results.get('files', [])
+                file_id = items[0]['id'] if items else None
+            
+            if file_id:
+                file = self.service.files().update(fileId=file_id, media_body=media, fields='id').execute()
+                logger.info(f"已更新文件: {remote_filename}")
+            else:
+                file = self.service.files().create(
+                    body={'name': remote_filename, 'parents': [folder_id]},
+                    media_body=media,
+                    fields='id'
+                ).execute()
+                logger.info(f"已上傳文件: {remote_filename}")
+            return file.get('id')
+        except Exception as e:
+            logger.error(f"上傳文件 {remote_filename} 時出錯: {str(e)}")
+            return None
+    
     def download_file(self, file_id: str, local_path: str) -> bool:
         """
         從Google Drive下載文件
@@ -355,6 +444,8 @@ class GoogleDriveConnector:
             if local_dir and not os.path.exists(local_dir):
                 os.makedirs(local_dir, exist_ok=True)
             
+            from googleapiclient.http import MediaIoBaseDownload
+            
             # 創建下載請求
             request = self.service.files().get_media(fileId=file_id)
             
@@ -412,6 +503,8 @@ class GoogleDriveConnector:
                 return None
         
         try:
+            from googleapiclient.http import MediaIoBaseDownload
+            
             # 創建下載請求
             request = self.service.files().get_media(fileId=file_id)
             
@@ -493,6 +586,7 @@ class GoogleDriveConnector:
         
         # 創建臨時內存文件
         file_content = io.BytesIO(content)
+        from googleapiclient.http import MediaIoBaseUpload
         media = MediaIoBaseUpload(file_content, mimetype='application/octet-stream', resumable=True)
         
         try:
@@ -0,0 +1,346 @@
+"""
+SQLite Backup Store for cloud integrations
+以內容雜湊保存資料庫備份：備份切成固定大小的區塊，每個區塊以 SHA-256 命名並壓縮保存，
+各備份之間未變更的頁面只保存一次，數個月的還原點只需要數份完整備份的空間
+
+目錄結構（data/backup/store）:
+    index.json                所有備份的摘要（名稱、建立時間、大小、區塊數），列出備份只需讀取此檔
+    manifests/<name>.json     每個備份的區塊雜湊清單
+    chunks/ab/<sha256>.z      zlib 壓縮的區塊（以雜湊前兩碼分目錄）
+
+保留策略為祖父-父-子（grandfather-father-son）：保留最近的數個備份，以及最近數天、數週、數月各自最新的一個備份，
+刪除備份後清除不再被任何備份引用的區塊。
+"""
+import os
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from typing import Optional, Dict, List, Any
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+# 區塊大小（SQLite 頁面大小的整數倍，修改的頁面只影響所在的區塊）
+CHUNK_SIZE = 64 * 1024
+
+# 區塊壓縮等級
+CHUNK_COMPRESS_LEVEL = 6
+
+# 索引格式版本
+INDEX_FORMAT = 1
+
+# 預設保留策略：最近的備份數，以及保留各自最新備份的天數、週數、月數
+DEFAULT_RETENTION = {'recent': 10, 'daily': 14, 'weekly': 8, 'monthly': 12}
+
+# 清除區塊時保留最近使用過的區塊的秒數（其他程序正在加入的備份尚未寫入清單，需大於一次備份的時間）
+GC_GRACE_SECONDS = 3600
+
+# 同一個備份庫目錄共用的鎖（同一程序中可能有多個管理器各自建立 BackupStore）
+_store_locks = {}
+_store_locks_guard = threading.Lock()
+
+def _store_lock(root: str) -> threading.RLock:
+    with _store_locks_guard:
+        return _store_locks.setdefault(os.path.abspath(root), threading.RLock())
+
+# 依保留策略決定要保留的備份
+def select_retained(backups: List[Dict[str, Any]], retention: Dict[str, int]) -> List[str]:
+    """
+    參數:
+        backups (List[Dict[str, Any]]): 備份摘要，需包含 name 與 created_at
+        retention (Dict[str, int]): 保留策略 {'recent', 'daily', 'weekly', 'monthly'}
+
+    返回:
+        List[str]: 要保留的備份名稱
+    """
+    ordered = sorted(backups, key=lambda item: item['created_at'], reverse=True)
+    keep = {item['name'] for item in ordered[:retention.get('recent', 0)]}
+
+    periods = {
+        'daily': lambda moment: moment.strftime('%Y-%m-%d'),
+        'weekly': lambda moment: moment.isocalendar()[:2],
+        'monthly': lambda moment: (moment.year, moment.month)
+    }
+    for period, key_of in periods.items():
+        limit = retention.get(period, 0)
+        seen = set()
+        for item in ordered:
+            if len(seen) >= limit:
+                break
+            key = key_of(datetime.fromtimestamp(item['created_at']))
+            if key not in seen:
+                # 每個期間保留最新的一個備份
+                seen.add(key)
+                keep.add(item['name'])
+
+    return [item['name'] for item in ordered if item['name'] in keep]
+
+class BackupStore:
+    """
+    內容雜湊備份庫
+    索引保存在記憶體中，其他程序修改 index.json 後會在下次使用時重新讀取
+    """
+
+    def __init__(self, root: str):
+        """
+        參數:
+            root (str): 備份庫目錄
+        """
+        self.root = root
+        self.index_path = os.path.join(root, 'index.json')
+        self.manifest_dir = os.path.join(root, 'manifests')
+        self.chunk_dir = os.path.join(root, 'chunks')
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        os.makedirs(self.chunk_dir, exist_ok=True)
+
+        self._lock = _store_lock(root)
+        self._index = None
+        self._index_mtime = None
+
+    def list_backups(self) -> List[Dict[str, Any]]:
+        """
+        返回:
+            List[Dict[str, Any]]: 備份摘要（最新的在前）
+        """
+        with self._lock:
+            return list(self._load_index()['backups'])
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        返回:
+            Dict[str, Any]: 備份摘要，不存在時為None
+        """
+        for item in self.list_backups():
+            if item['name'] == name:
+                return item
+        return None
+
+    def add(self, source_path: str, name: str, created_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        將資料庫檔案加入備份庫（同名的備份會被取代）
+
+        參數:
+            source_path (str): 資料庫檔案（備份期間不可被修改，通常為線上備份產生的暫存檔）
+            name (str): 備份名稱
+            created_at (float, optional): 建立時間，預設為現在
+
+        返回:
+            Dict[str, Any]: 備份摘要，另包含本次新增的區塊數（new_chunks）與新增的壓縮位元組數（stored_bytes）
+        """
+        name = os.path.basename(name)
+        digest = hashlib.sha256()
+        chunks = []
+        new_chunks = 0
+        stored_bytes = 0
+
+        # 寫入區塊到加入索引之間持有鎖，同一程序中的 collect_garbage 不會刪除已存在而略過寫入的區塊
+        with self._lock:
+            with open(source_path, 'rb') as f:
+                while True:
+                    data = f.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    digest.update(data)
+                    chunk_hash = hashlib.sha256(data).hexdigest()
+                    chunks.append(chunk_hash)
+                    written = self._write_chunk(chunk_hash, data)
+                    if written:
+                        new_chunks += 1
+                        stored_bytes += written
+
+            entry = {
+                'name': name,
+                'created_at': created_at if created_at is not None else time.time(),
+                'size': os.path.getsize(source_path),
+                'sha256': digest.hexdigest(),
+                'chunks': len(chunks)
+            }
+            self._write_json(self._manifest_path(name), {'name': name, 'sha256': entry['sha256'], 'chunks': chunks})
+
+            index = self._load_index()
+            backups = [item for item in index['backups'] if item['name'] != name]
+            backups.append(entry)
+            backups.sort(key=lambda item: item['created_at'], reverse=True)
+            index['backups'] = backups
+            self._save_index(index)
+
+        return dict(entry, new_chunks=new_chunks, stored_bytes=stored_bytes)
+
+    def restore(self, name: str, target_path: str) -> None:
+        """
+        將備份還原為檔案（目的路徑以 .gz 結尾時以 gzip 壓縮），逐區塊檢查雜湊，內容不符時拋出 ValueError
+
+        參數:
+            name (str): 備份名稱
+            target_path (str): 目的檔案
+        """
+        manifest = self._read_json(self._manifest_path(name))
+        if manifest is None:
+            raise ValueError(f"備份不存在: {name}")
+
+        digest = hashlib.sha256()
+        opener = gzip.open if target_path.endswith('.gz') else open
+        with opener(target_path, 'wb') as f:
+            for chunk_hash in manifest['chunks']:
+                data = self._read_chunk(chunk_hash)
+                digest.update(data)
+                f.write(data)
+
+        if digest.hexdigest() != manifest['sha256']:
+            raise ValueError(f"備份內容與雜湊不符: {name}")
+
+    def delete(self, name: str) -> bool:
+        """
+        刪除備份（區塊在 collect_garbage 時才刪除）
+
+        返回:
+            bool: 備份是否存在
+        """
+        with self._lock:
+            index = self._load_index()
+            backups = [item for item in index['backups'] if item['name'] != name]
+            if len(backups) == len(index['backups']):
+                return False
+            index['backups'] = backups
+            self._save_index(index)
+
+            manifest_path = self._manifest_path(name)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        return True
+
+    def apply_retention(self, retention: Optional[Dict[str, int]] = None) -> List[str]:
+        """
+        依祖父-父-子策略刪除多餘的備份並清除未引用的區塊
+
+        參數:
+            retention (Dict[str, int], optional): 保留策略，預設為DEFAULT_RETENTION
+
+        返回:
+            List[str]: 被刪除的備份名稱
+        """
+        with self._lock:
+            backups = self._load_index()['backups']
+            keep = set(select_retained(backups, retention or DEFAULT_RETENTION))
+            removed = [item['name'] for item in backups if item['name'] not in keep]
+            for name in removed:
+                self.delete(name)
+                logger.info(f"已刪除舊備份: {name}")
+
+            if removed:
+                self.collect_garbage()
+        return removed
+
+    def collect_garbage(self) -> int:
+        """
+        刪除不再被任何備份引用的區塊
+
+        同一程序中的 add 與此方法共用鎖；其他程序正在加入的備份尚未寫入清單，
+        它使用的區塊會更新修改時間，GC_GRACE_SECONDS 內使用過的區塊不會被刪除。
+
+        返回:
+            int: 刪除的區塊數
+        """
+        with self._lock:
+            cutoff = time.time() - GC_GRACE_SECONDS
+            referenced = set()
+            for file in os.listdir(self.manifest_dir):
+                if file.endswith('.json'):
+                    referenced.update(self._read_json(os.path.join(self.manifest_dir, file))['chunks'])
+
+            removed = 0
+            for prefix in os.listdir(self.chunk_dir):
+                prefix_dir = os.path.join(self.chunk_dir, prefix)
+                for file in os.listdir(prefix_dir):
+                    path = os.path.join(prefix_dir, file)
+                    if file.endswith('.z') and file[:-2] not in referenced and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+        if removed:
+            logger.info(f"已清除 {removed} 個未引用的備份區塊")
+        return removed
+
+    def stored_size(self) -> int:
+        """
+        返回:
+            int: 所有區塊的壓縮後總大小
+        """
+        total = 0
+        for prefix in os.listdir(self.chunk_dir):
+            prefix_dir = os.path.join(self.chunk_dir, prefix)
+            total += sum(os.path.getsize(os.path.join(prefix_dir, file)) for file in os.listdir(prefix_dir))
+        return total
+
+    def _chunk_path(self, chunk_hash: str) -> str:
+        return os.path.join(self.chunk_dir, chunk_hash[:2], f"{chunk_hash}.z")
+
+    def _manifest_path(self, name: str) -> str:
+        return os.path.join(self.manifest_dir, f"{os.path.basename(name)}.json")
+
+    def _write_chunk(self, chunk_hash: str, data: bytes) -> int:
+        """
+        返回:
+            int: 新寫入的壓縮位元組數，區塊已存在時為0
+        """
+        path = self._chunk_path(chunk_hash)
+        if os.path.exists(path):
+            # 更新修改時間，其他程序清除區塊時視為使用中
+            os.utime(path)
+            return 0
+        content = zlib.compress(data, CHUNK_COMPRESS_LEVEL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_atomic(path, content)
+        return len(content)
+
+    def _read_chunk(self, chunk_hash: str) -> bytes:
+        path = self._chunk_path(chunk_hash)
+        if not os.path.exists(path):
+            raise ValueError(f"備份區塊遺失: {chunk_hash}")
+        with open(path, 'rb') as f:
+            content = f.read()
+        try:
+            data = zlib.decompress(content)
+        except zlib.error:
+            raise ValueError(f"備份區塊已損壞: {chunk_hash}")
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise ValueError(f"備份區塊已損壞: {chunk_hash}")
+        return data
+
+    def _load_index(self) -> Dict[str, Any]:
+        mtime = os.path.getmtime(self.index_path) if os.path.exists(self.index_path) else None
+        if self._index is None or mtime != self._index_mtime:
+            self._index = self._read_json(self.index_path) or {'format': INDEX_FORMAT, 'backups': []}
+            self._index_mtime = mtime
+        return self._index
+
+    def _save_index(self, index: Dict[str, Any]) -> None:
+        self._write_json(self.index_path, index)
+        self._index = index
+        self._index_mtime = os.path.getmtime(self.index_path)
+
+    def _read_json(self, path: str) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_json(self, path: str, data: Dict[str, Any]) -> None:
+        self._write_atomic(path, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def _write_atomic(self, path: str, content: bytes) -> None:
+        # 寫入暫存檔後再改名，中斷時不會留下不完整的檔案
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
@@ -3,16 +3,104 @@ SQLite Base Manager for cloud integrations
 基本的SQLite資料庫管理功能
 """
 import os
+import gzip
 import time
 import sqlite3
 import shutil
 import logging
-from typing import Optional
+import tempfile
+from typing import Optional, Dict, Any
 from utils.cloud.google_drive_connector import GoogleDriveConnector
+from utils.cloud.sqlite.backup_store import BackupStore
+from utils.metrics import BACKUP_SECONDS, BACKUP_BYTES, BACKUP_STORED_BYTES, BACKUP_FAILURES
 
 # 設置日誌
 logger = logging.getLogger(__name__)
 
+# 線上備份每一步複製的頁數（4KB 頁約 1MB），步驟之間暫停讓收銀台的寫入可以進行
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.005
+
+# 複製期間資料庫被其他連線寫入時 SQLite 會從頭開始複製，超過次數後改為一次複製完成
+# （一次複製期間寫入會等待，小型資料庫只需數十毫秒，遠低於連線的5秒等待時間）
+BACKUP_MAX_RESTARTS = 3
+
+class _BackupRestarted(Exception):
+    """線上備份重新開始的次數過多"""
+
+# 以 SQLite 線上備份複製資料庫
+def copy_database(source_path: str, target_path: str, pages: int = BACKUP_PAGES_PER_STEP,
+                  pause: float = BACKUP_STEP_PAUSE) -> Dict[str, Any]:
+    """
+    以 sqlite3.Connection.backup 分批複製資料庫，讀取一致的內容（包含 WAL 中尚未寫回的資料），
+    每一步之間不持有鎖，寫入不會被整個備份期間阻擋
+
+    參數:
+        source_path (str): 來源資料庫
+        target_path (str): 目的資料庫（內容會被取代）
+        pages (int): 每一步複製的頁數，-1 表示一次複製完成
+        pause (float): 每一步之後暫停的秒數
+
+    返回:
+        Dict[str, Any]: {'pages', 'bytes', 'seconds', 'restarts'}
+    """
+    started = time.perf_counter()
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        state['remaining'] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _BackupRestarted:
+            logger.warning(f"備份期間資料庫持續被寫入，改為一次複製: {source_path}")
+            source.backup(target)
+        page_size = target.execute("PRAGMA page_size").fetchone()[0]
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    return {
+        'pages': page_count,
+        'bytes': page_count * page_size,
+        'seconds': time.perf_counter() - started,
+        'restarts': state['restarts']
+    }
+
+# 檢查資料庫檔案是否完整
+def check_database(path: str) -> bool:
+    """
+    返回:
+        bool: PRAGMA quick_check 是否通過
+    """
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchall()
+    finally:
+        conn.close()
+    if [row[0] for row in result] != ['ok']:
+        logger.error(f"資料庫檢查失敗: {path}: {'; '.join(str(row[0]) for row in result[:5])}")
+        return False
+    return True
+
+# 讀取資料庫的結構版本（PRAGMA user_version）
+def _schema_version(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
 class BaseSQLiteManager:
     """
     基本的SQLite資料庫管理類
@@ -42,78 +130,157 @@ class BaseSQLiteManager:
         self.backup_dir = os.path.join(os.path.dirname(self.local_db_path), 'backup')
         os.makedirs(self.backup_dir, exist_ok=True)
     
-    def backup_local_database(self, backup_name: Optional[str] = None) -> str:
+    @property
+    def backup_store(self) -> BackupStore:
+        """
+        本地備份庫（data/backup/store），第一次使用時將舊版的完整備份檔匯入
+        """
+        store = getattr(self, '_backup_store', None)
+        if store is None:
+            store = self._backup_store = BackupStore(os.path.join(self.backup_dir, 'store'))
+            self._import_legacy_backups(store)
+        return store
+    
+    def backup_local_database(self, backup_name: Optional[str] = None, prune: bool = True) -> str:
         """
-        備份本地資料庫
+        以 SQLite 線上備份建立本地資料庫的備份，執行 quick_check 後存入備份庫，
+        並依保留策略刪除舊備份
         
         參數:
-            backup_name (str, optional): 備份檔案名稱，預設使用時間戳
+            backup_name (str, optional): 備份名稱，預設使用時間戳
+            prune (bool): 是否依保留策略刪除舊備份（還原前的備份不刪除，避免刪掉要還原的備份）
             
         返回:
-            str: 備份檔案路徑，如果失敗則為空字串
+            str: 備份名稱，如果失敗則為空字串
         """
+        temp_path = None
         try:
             if not os.path.exists(self.local_db_path):
                 logger.warning(f"本地資料庫不存在，無法備份: {self.local_db_path}")
                 return ""
             
-            # 生成備份文件名
+            # 生成備份名稱
             if backup_name is None:
                 timestamp = time.strftime("%Y%m%d_%H%M%S")
                 backup_name = f"gas_station_backup_{timestamp}.db"
             
-            backup_path = os.path.join(self.backup_dir, backup_name)
+            # 先複製到暫存檔，檢查通過後才存入備份庫，不會留下不完整的備份
+            fd, temp_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+            os.close(fd)
+            stats = copy_database(self.local_db_path, temp_path)
+            if not check_database(temp_path):
+                raise ValueError("備份內容檢查失敗")
             
-            # 建立備份目錄
-            os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+            entry = self.backup_store.add(temp_path, backup_name)
+            stats.update(chunks=entry['chunks'], new_chunks=entry['new_chunks'], stored_bytes=entry['stored_bytes'])
+            self.last_backup_stats = stats
+            BACKUP_SECONDS.observe(stats['seconds'])
+            BACKUP_BYTES.inc(stats['bytes'])
+            BACKUP_STORED_BYTES.inc(stats['stored_bytes'])
             
-            # 使用shutil複製文件
-            shutil.copy2(self.local_db_path, backup_path)
-            logger.info(f"已備份本地資料庫到: {backup_path}")
+            throughput = stats['bytes'] / stats['seconds'] / 1024 / 1024 if stats['seconds'] > 0 else 0
+            logger.info(f"已備份本地資料庫: {entry['name']}（{stats['pages']} 頁，"
+                        f"{stats['bytes'] / 1024 / 1024:.1f} MB，{stats['seconds']:.2f} 秒，{throughput:.1f} MB/s，"
+                        f"新增 {stats['new_chunks']}/{stats['chunks']} 個區塊共 {stats['stored_bytes'] / 1024:.0f} KB，"
+                        f"重新開始 {stats['restarts']} 次）")
             
-            # 保留最近20個備份，刪除舊的
-            self._cleanup_old_backups(20)
+            if prune:
+                self.backup_store.apply_retention()
             
-            return backup_path
+            return entry['name']
             
         except Exception as e:
+            BACKUP_FAILURES.inc()
             logger.error(f"備份本地資料庫時出錯: {str(e)}")
             return ""
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
     
-    def _cleanup_old_backups(self, keep_count: int = 20) -> None:
+    def restore_local_backup(self, backup_name: str) -> None:
         """
-        清理舊的備份，只保留最近的指定數量
+        以備份庫中的備份取代本地資料庫的內容，備份不存在或已損壞時拋出 ValueError
         
         參數:
-            keep_count (int): 要保留的備份數量
+            backup_name (str): 備份名稱
         """
+        fd, temp_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            self.backup_store.restore(backup_name, temp_path)
+            self._restore_local_database(temp_path)
+        finally:
+            os.remove(temp_path)
+    
+    def _restore_local_database(self, backup_path: str) -> None:
+        """
+        以備份檔（.db 或 .db.gz）取代本地資料庫的內容
+        
+        透過 SQLite 線上備份一次寫入，其他連線不會讀到一半的檔案；備份檔檢查失敗時拋出 ValueError。
+        結構版本較舊的備份先在暫存複本上更新結構再寫入，其他 worker 不需要重新初始化。
+        
+        參數:
+            backup_path (str): 備份檔案路徑
+        """
+        from database.core.init import DB_PATH, SCHEMA_VERSION, init_db, upgrade_database
+        
+        source_path = backup_path
+        temp_path = None
         try:
-            if not os.path.exists(self.backup_dir):
-                return
-            
-            # 獲取所有備份
-            backups = []
-            for file in os.listdir(self.backup_dir):
-                if file.startswith("gas_station_backup_") and file.endswith(".db"):
-                    backups.append(file)
-            
-            # 如果備份數量未超過保留數量，直接返回
-            if len(backups) <= keep_count:
-                return
-            
-            # 按修改時間排序（最舊的在前）
-            backups.sort(key=lambda x: os.path.getmtime(os.path.join(self.backup_dir, x)))
-            
-            # 刪除多餘的舊備份
-            for i in range(len(backups) - keep_count):
-                try:
-                    os.remove(os.path.join(self.backup_dir, backups[i]))
-                    logger.info(f"已刪除舊備份: {backups[i]}")
-                except Exception as e:
-                    logger.error(f"刪除舊備份時出錯: {backups[i]}, {str(e)}")
+            if backup_path.endswith('.gz'):
+                fd, temp_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+                with os.fdopen(fd, 'wb') as dst, gzip.open(backup_path, 'rb') as src:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                source_path = temp_path
             
-        except Exception as e:
-            logger.error(f"清理舊備份時出錯: {str(e)}")
+            if not check_database(source_path):
+                raise ValueError(f"備份檔案已損壞: {backup_path}")
+            
+            if _schema_version(source_path) < SCHEMA_VERSION:
+                if temp_path is None:
+                    fd, temp_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+                    os.close(fd)
+                    copy_database(backup_path, temp_path, pages=-1, pause=0)
+                    source_path = temp_path
+                if not upgrade_database(source_path):
+                    raise ValueError(f"無法更新備份的資料庫結構: {backup_path}")
+            
+            copy_database(source_path, self.local_db_path, pages=-1, pause=0)
+            
+            # 本程序重新檢查結構版本，不沿用還原前的記錄
+            if os.path.abspath(self.local_db_path) == os.path.abspath(DB_PATH):
+                init_db(force=True)
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _import_legacy_backups(self, store: BackupStore) -> None:
+        """
+        將舊版保存在備份目錄中的完整備份檔（gas_station_backup_*.db / .db.gz）匯入備份庫後刪除
+        
+        參數:
+            store (BackupStore): 備份庫
+        """
+        for file in sorted(os.listdir(self.backup_dir)):
+            if not (file.startswith("gas_station_backup_") and file.endswith((".db", ".db.gz"))):
+                continue
+            path = os.path.join(self.backup_dir, file)
+            temp_path = None
+            try:
+                source_path = path
+                if file.endswith('.gz'):
+                    fd, temp_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+                    with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                    source_path = temp_path
+                store.add(source_path, file[:-3] if file.endswith('.gz') else file, os.path.getmtime(path))
+                os.remove(path)
+                logger.info(f"已將舊備份匯入備份庫: {file}")
+            except Exception as e:
+                logger.error(f"匯入舊備份時出錯: {file}, {str(e)}")
+            finally:
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
     
     def _close_all_connections(self) -> None:
         """
@@ -3,24 +3,51 @@ SQLite Cloud Manager for cloud integrations
 雲端同步相關的SQLite資料庫管理功能
 """
 import os
+import json
+import gzip
 import time
+import sqlite3
+import tempfile
 import logging
 from typing import Optional, Dict, List, Any
-from utils.cloud.sqlite.base_manager import BaseSQLiteManager
+from utils.cloud.sqlite.base_manager import BaseSQLiteManager, copy_database
+from utils.cloud.sqlite import delta_sync
 
 # 設置日誌
 logger = logging.getLogger(__name__)
 
+# 增量同步的雲端目錄
+DELTA_REMOTE_DIR = 'data/sync'
+DELTA_CHANGES_DIR = f'{DELTA_REMOTE_DIR}/changes'
+DELTA_MANIFEST_PATH = f'{DELTA_REMOTE_DIR}/manifest.json'
+
+# 變更集累積到一定數量，或總大小超過快照的一定比例時，重新上傳快照並刪除變更集
+DELTA_COMPACT_CHANGESETS = 100
+DELTA_COMPACT_RATIO = 0.5
+
 class CloudSQLiteManager(BaseSQLiteManager):
     """
     雲端SQLite資料庫管理類
     提供同步、雲端備份和還原等功能
     """
     
+    @property
+    def sync_mode(self) -> str:
+        """
+        資料庫同步模式（雲端配置 database_sync_mode）
+        
+        返回:
+            str: 'delta' 只上傳變更過的資料列，'full' 每次上傳整個資料庫檔案
+        """
+        from utils.cloud.factory import get_cloud_config
+        return get_cloud_config().get('database_sync_mode', 'delta')
+    
     def upload_database(self, local_path: Optional[str] = None, remote_path: Optional[str] = None) -> bool:
         """
         上傳本地資料庫到雲端
         
+        增量同步模式下（未指定路徑時）改為上傳上次同步之後的變更集。
+        
         參數:
             local_path (str, optional): 本地資料庫路徑，預設為self.local_db_path
             remote_path (str, optional): 雲端保存路徑，預設為self.remote_db_path
@@ -28,6 +55,9 @@ class CloudSQLiteManager(BaseSQLiteManager):
         返回:
             bool: 是否成功上傳
         """
+        if self.sync_mode == 'delta' and local_path is None and remote_path is None:
+            return self.sync_delta()
+        
         try:
             local_path = local_path or self.local_db_path
             remote_path = remote_path or self.remote_db_path
@@ -65,6 +95,12 @@ class CloudSQLiteManager(BaseSQLiteManager):
         返回:
             bool: 是否成功下載
         """
+        if self.sync_mode == 'delta' and remote_path is None:
+            # 只有雲端沒有增量同步資料時才改為下載完整資料庫（增量模式不再更新該檔案，還原失敗時不能以舊檔覆蓋）
+            restored = self.restore_from_delta(local_path)
+            if restored is not None:
+                return restored
+        
         try:
             remote_path = remote_path or self.remote_db_path
             local_path = local_path or self.local_db_path
@@ -106,6 +142,12 @@ class CloudSQLiteManager(BaseSQLiteManager):
             elif force_direction == 'download':
                 return self.download_database()
             
+            # 增量同步以本地資料庫為準，只有本地資料庫不存在時才從雲端還原
+            if self.sync_mode == 'delta':
+                if not os.path.exists(self.local_db_path):
+                    return self.download_database()
+                return self.upload_database()
+            
             # 自動決定同步方向
             local_exists = os.path.exists(self.local_db_path)
             remote_exists = self.drive_connector.is_file_exists_by_path(self.remote_db_path)
@@ -149,6 +191,200 @@ class CloudSQLiteManager(BaseSQLiteManager):
             logger.error(f"同步資料庫時出錯: {str(e)}")
             return False
     
+    def sync_delta(self) -> bool:
+        """
+        上傳上次同步之後的變更集（尚未有快照時先上傳完整快照）
+        
+        返回:
+            bool: 是否成功同步
+        """
+        if not os.path.exists(self.local_db_path):
+            logger.error(f"本地資料庫不存在: {self.local_db_path}")
+            return False
+        
+        conn = sqlite3.connect(self.local_db_path)
+        try:
+            manifest = delta_sync.load_manifest(conn)
+            if not manifest or delta_sync.get_meta(conn, delta_sync.TRACKING_KEY) != '1':
+                conn.close()
+                return self.upload_snapshot()
+            
+            last_change_id, changes = delta_sync.collect_changes(conn)
+            if not changes:
+                logger.info("沒有需要同步的資料庫變更")
+                return True
+            
+            # 先上傳變更集再更新清單，清單更新失敗時下次會重新上傳這些變更
+            content = delta_sync.encode_changeset(changes)
+            sequence = manifest['sequence'] + 1
+            name = f"{sequence:08d}.jsonl.gz"
+            if not self.drive_connector.upload_file_content(content, f"{DELTA_CHANGES_DIR}/{name}"):
+                logger.error(f"上傳變更集失敗: {name}")
+                return False
+            
+            manifest['sequence'] = sequence
+            manifest['changesets'].append({'name': name, 'size': len(content), 'count': len(changes),
+                                           'created_at': time.time()})
+            if not self._upload_manifest(manifest):
+                return False
+            
+            with conn:
+                delta_sync.clear_changes(conn, last_change_id)
+                delta_sync.set_meta(conn, delta_sync.MANIFEST_KEY, json.dumps(manifest))
+            logger.info(f"已上傳變更集 {name}: {len(changes)} 筆資料，{len(content)} bytes")
+            
+            if self._needs_compaction(manifest):
+                conn.close()
+                return self.upload_snapshot()
+            return True
+        except Exception as e:
+            logger.error(f"增量同步資料庫時出錯: {str(e)}")
+            return False
+        finally:
+            conn.close()
+    
+    def upload_snapshot(self) -> bool:
+        """
+        上傳完整的資料庫快照作為增量同步的基準，並刪除快照已包含的變更集
+        
+        返回:
+            bool: 是否成功上傳
+        """
+        conn = sqlite3.connect(self.local_db_path)
+        try:
+            # 開啟變更記錄後才建立快照，快照期間的寫入會同時出現在快照與下一個變更集（重複套用沒有影響）
+            with conn:
+                last_change_id = delta_sync.enable_tracking(conn)
+            old_manifest = delta_sync.load_manifest(conn)
+            sequence = old_manifest.get('sequence', 0)
+            
+            content = self._snapshot_content(conn)
+            name = f"snapshot-{sequence:08d}.db.gz"
+            if not self.drive_connector.upload_file_content(content, f"{DELTA_REMOTE_DIR}/{name}"):
+                logger.error(f"上傳資料庫快照失敗: {name}")
+                return False
+            
+            manifest = {
+                'format': delta_sync.CHANGESET_FORMAT,
+                'snapshot': name,
+                'snapshot_size': len(content),
+                'snapshot_time': time.time(),
+                'sequence': sequence,
+                'changesets': []
+            }
+            if not self._upload_manifest(manifest):
+                return False
+            
+            with conn:
+                delta_sync.clear_changes(conn, last_change_id)
+                delta_sync.set_meta(conn, delta_sync.MANIFEST_KEY, json.dumps(manifest))
+            logger.info(f"已上傳資料庫快照 {name}: {len(content)} bytes")
+            
+            # 清單已指向新快照，刪除舊快照與已合併的變更集
+            for item in old_manifest.get('changesets', []):
+                self.drive_connector.delete_file_by_path(f"{DELTA_CHANGES_DIR}/{item['name']}")
+            if old_manifest.get('snapshot') not in (None, name):
+                self.drive_connector.delete_file_by_path(f"{DELTA_REMOTE_DIR}/{old_manifest['snapshot']}")
+            return True
+        except Exception as e:
+            logger.error(f"上傳資料庫快照時出錯: {str(e)}")
+            return False
+        finally:
+            conn.close()
+    
+    def restore_from_delta(self, local_path: Optional[str] = None) -> Optional[bool]:
+        """
+        下載雲端快照並依序套用變更集，重建本地資料庫
+        
+        參數:
+            local_path (str, optional): 還原的目的路徑，預設為self.local_db_path
+            
+        返回:
+            Optional[bool]: 是否成功還原，雲端沒有增量同步清單時返回None
+        """
+        local_path = local_path or self.local_db_path
+        temp_path = None
+        try:
+            manifest_info = self.drive_connector.find_file(os.path.basename(DELTA_MANIFEST_PATH), DELTA_REMOTE_DIR)
+            if not manifest_info:
+                logger.info("雲端沒有增量同步資料")
+                return None
+            
+            content = self.drive_connector.get_file_content(manifest_info['id'])
+            if not content:
+                logger.error("下載增量同步清單失敗")
+                return False
+            manifest = json.loads(content)
+            
+            snapshot = self.drive_connector.get_file_content_by_path(f"{DELTA_REMOTE_DIR}/{manifest['snapshot']}")
+            if not snapshot:
+                logger.error(f"下載資料庫快照失敗: {manifest['snapshot']}")
+                return False
+            
+            fd, temp_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(local_path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.decompress(snapshot))
+            
+            conn = sqlite3.connect(temp_path)
+            try:
+                with conn:
+                    for item in manifest['changesets']:
+                        changeset = self.drive_connector.get_file_content_by_path(f"{DELTA_CHANGES_DIR}/{item['name']}")
+                        if changeset is None:
+                            raise ValueError(f"下載變更集失敗: {item['name']}")
+                        delta_sync.apply_changeset(conn, delta_sync.decode_changeset(changeset))
+                    # 還原後的資料已與雲端一致
+                    conn.execute("DELETE FROM sync_changelog")
+                    delta_sync.set_meta(conn, delta_sync.MANIFEST_KEY, json.dumps(manifest))
+            finally:
+                conn.close()
+            
+            if os.path.exists(local_path):
+                # 透過 SQLite 寫入現有資料庫，其他連線不會讀到替換到一半的檔案
+                self.backup_local_database()
+                copy_database(temp_path, local_path, pages=-1, pause=0)
+            else:
+                os.replace(temp_path, local_path)
+                temp_path = None
+            logger.info(f"已從雲端快照與 {len(manifest['changesets'])} 個變更集還原資料庫")
+            return True
+        except Exception as e:
+            logger.error(f"從增量同步資料還原資料庫時出錯: {str(e)}")
+            return False
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _snapshot_content(self, conn: sqlite3.Connection) -> bytes:
+        """
+        以 SQLite 線上備份建立一致的快照（寫入不需暫停），返回 gzip 壓縮後的內容
+        """
+        fd, temp_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            target = sqlite3.connect(temp_path)
+            try:
+                conn.backup(target)
+            finally:
+                target.close()
+            with open(temp_path, 'rb') as f:
+                return gzip.compress(f.read())
+        finally:
+            os.remove(temp_path)
+    
+    def _upload_manifest(self, manifest: Dict[str, Any]) -> bool:
+        content = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        if not self.drive_connector.upload_file_content(content, DELTA_MANIFEST_PATH):
+            logger.error("上傳增量同步清單失敗")
+            return False
+        return True
+    
+    def _needs_compaction(self, manifest: Dict[str, Any]) -> bool:
+        changesets = manifest['changesets']
+        total_size = sum(item['size'] for item in changesets)
+        return (len(changesets) >= DELTA_COMPACT_CHANGESETS
+                or total_size >= manifest['snapshot_size'] * DELTA_COMPACT_RATIO)
+    
     def backup_to_cloud(self, backup_name: Optional[str] = None) -> bool:
         """
         備份資料庫到雲端
@@ -165,19 +401,25 @@ class CloudSQLiteManager(BaseSQLiteManager):
                 timestamp = time.strftime("%Y%m%d_%H%M%S")
                 backup_name = f"gas_station_backup_{timestamp}.db"
             
-            local_backup_path = self.backup_local_database(backup_name)
+            backup_name = self.backup_local_database(backup_name)
             
-            if not local_backup_path:
+            if not backup_name:
                 return False
             
-            # 上傳備份到雲端
-            remote_backup_path = f"data/backup/{backup_name}"
+            # 上傳備份到雲端（以 gzip 壓縮的單一檔案保存）
+            remote_backup_path = f"data/backup/{backup_name}.gz"
             
             # 確保雲端備份目錄存在
             self.drive_connector.ensure_directory("data/backup")
             
-            # 上傳備份
-            file_id = self.drive_connector.upload_file(local_backup_path, None, remote_backup_path)
+            # 從備份庫匯出後上傳
+            export_path = os.path.join(self.backup_dir, f"{backup_name}.gz")
+            try:
+                self.backup_store.restore(backup_name, export_path)
+                file_id = self.drive_connector.upload_file(export_path, None, remote_backup_path)
+            finally:
+                if os.path.exists(export_path):
+                    os.remove(export_path)
             
             if file_id:
                 logger.info(f"已成功上傳備份到雲端: {remote_backup_path}")
@@ -201,9 +443,11 @@ class CloudSQLiteManager(BaseSQLiteManager):
         返回:
             bool: 是否成功還原
         """
+        current_backup = None
+        temp_backup_path = None
         try:
             # 先備份當前資料庫
-            current_backup = self.backup_local_database()
+            current_backup = self.backup_local_database(prune=False)
             
             if is_cloud_backup:
                 # 從雲端下載備份
@@ -216,21 +460,16 @@ class CloudSQLiteManager(BaseSQLiteManager):
                     logger.error(f"從雲端下載備份失敗: {remote_backup_path}")
                     return False
                 
-                backup_path = temp_backup_path
+                # 檢查備份後透過 SQLite 寫入主資料庫，不需關閉其他連線
+                self._restore_local_database(temp_backup_path)
             else:
-                # 使用本地備份
-                backup_path = os.path.join(self.backup_dir, backup_name)
-                
-                if not os.path.exists(backup_path):
-                    logger.error(f"本地備份不存在: {backup_path}")
+                # 使用本地備份庫
+                if self.backup_store.get(backup_name) is None:
+                    logger.error(f"本地備份不存在: {backup_name}")
                     return False
+                
+                self.restore_local_backup(backup_name)
             
-            # 備份資料庫恢復前，需要先關閉所有連接
-            self._close_all_connections()
-            
-            # 還原備份到主資料庫
-            import shutil
-            shutil.copy2(backup_path, self.local_db_path)
             logger.info(f"已從備份還原資料庫: {backup_name}")
             
             # 如果是從雲端下載的臨時備份，清理它
@@ -241,13 +480,14 @@ class CloudSQLiteManager(BaseSQLiteManager):
             
         except Exception as e:
             logger.error(f"還原資料庫時出錯: {str(e)}")
+            if is_cloud_backup and temp_backup_path and os.path.exists(temp_backup_path):
+                os.remove(temp_backup_path)
             # 嘗試恢復之前的資料庫
-            if current_backup and os.path.exists(current_backup):
+            if current_backup:
                 try:
-                    import shutil
-                    shutil.copy2(current_backup, self.local_db_path)
+                    self.restore_local_backup(current_backup)
                     logger.info(f"已恢復到還原前的資料庫")
-                except:
+                except Exception:
                     pass
             return False
     
@@ -264,20 +504,14 @@ class CloudSQLiteManager(BaseSQLiteManager):
         result = {'local': [], 'cloud': []}
         
         try:
-            # 列出本地備份
-            if os.path.exists(self.backup_dir):
-                for file in os.listdir(self.backup_dir):
-                    if file.startswith("gas_station_backup_") and file.endswith(".db"):
-                        result['local'].append(file)
-                
-                # 按修改時間排序（最新的在前）
-                result['local'].sort(key=lambda x: os.path.getmtime(os.path.join(self.backup_dir, x)), reverse=True)
+            # 列出本地備份（備份庫索引已按建立時間排序，最新的在前）
+            result['local'] = [item['name'] for item in self.backup_store.list_backups()]
             
             # 列出雲端備份
             if include_cloud:
                 cloud_backups = self.drive_connector.list_files_in_folder("data/backup")
                 for file in cloud_backups:
-                    if file.get('name', '').startswith("gas_station_backup_") and file.get('name', '').endswith(".db"):
+                    if file.get('name', '').startswith("gas_station_backup_") and file.get('name', '').endswith((".db", ".db.gz")):
                         result['cloud'].append(file.get('name'))
                 
                 # 按修改時間排序（最新的在前）
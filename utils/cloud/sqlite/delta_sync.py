@@ -0,0 +1,147 @@
+"""
+SQLite Delta Sync for cloud integrations
+以觸發器記錄的變更清單（sync_changelog）產生增量變更集，同步流量只與交易量相關，與資料庫大小無關
+
+雲端目錄結構（data/sync）:
+    manifest.json             目前的快照與之後的變更集清單
+    snapshot.db.gz            完整資料庫快照（gzip）
+    changes/00000001.jsonl.gz 變更集：每行一筆 {"table", "rowid", "row"}，row 為 null 表示刪除
+
+觸發器只記錄變更的資料表與 rowid，上傳時再讀取該筆資料的最新內容，同一筆資料多次修改只上傳一次。
+套用變更集是冪等的（INSERT OR REPLACE / DELETE），快照期間同時寫入的變更重複套用也不會出錯。
+"""
+import io
+import gzip
+import json
+import time
+import sqlite3
+from typing import Dict, List, Tuple, Any
+
+# 變更集格式版本
+CHANGESET_FORMAT = 1
+
+# 資料表變更追蹤開關（sync_meta 中的鍵，觸發器在值為 '1' 時才記錄）
+TRACKING_KEY = 'tracking'
+
+# 本地保存的雲端清單（避免每次同步都下載 manifest.json）
+MANIFEST_KEY = 'manifest'
+
+# 每次讀取變更內容的批次大小
+CHANGE_BATCH_SIZE = 500
+
+# 讀取同步中繼資料
+def get_meta(conn: sqlite3.Connection, key: str, default: Any = None) -> Any:
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+# 寫入同步中繼資料
+def set_meta(conn: sqlite3.Connection, key: str, value: Any) -> None:
+    conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+# 讀取本地保存的雲端清單
+def load_manifest(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """
+    返回:
+        Dict[str, Any]: 雲端清單，尚未上傳快照時為空字典
+    """
+    value = get_meta(conn, MANIFEST_KEY)
+    return json.loads(value) if value else {}
+
+# 開始記錄變更
+def enable_tracking(conn: sqlite3.Connection) -> int:
+    """
+    開啟變更記錄並返回目前最後的變更編號（快照包含此編號之前的所有變更）
+
+    返回:
+        int: 最後的變更編號
+    """
+    set_meta(conn, TRACKING_KEY, '1')
+    row = conn.execute("SELECT COALESCE(MAX(change_id), 0) FROM sync_changelog").fetchone()
+    return row[0]
+
+# 讀取尚未上傳的變更
+def collect_changes(conn: sqlite3.Connection) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    合併同一筆資料的多次變更，讀取每筆資料目前的內容
+
+    返回:
+        Tuple[int, List[Dict[str, Any]]]: (最後的變更編號, 變更清單)，沒有變更時編號為0
+    """
+    rows = conn.execute("""
+        SELECT table_name, row_id, MAX(change_id) AS change_id
+        FROM sync_changelog
+        GROUP BY table_name, row_id
+        ORDER BY change_id
+    """).fetchall()
+    if not rows:
+        return 0, []
+
+    last_change_id = max(row[2] for row in rows)
+    by_table = {}
+    for table_name, row_id, change_id in rows:
+        by_table.setdefault(table_name, []).append(row_id)
+
+    current = {}
+    for table_name, row_ids in by_table.items():
+        for start in range(0, len(row_ids), CHANGE_BATCH_SIZE):
+            batch = row_ids[start:start + CHANGE_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            cursor = conn.execute(
+                f"SELECT rowid AS __rowid, * FROM {table_name} WHERE rowid IN ({placeholders})", batch
+            )
+            columns = [column[0] for column in cursor.description]
+            for values in cursor.fetchall():
+                record = dict(zip(columns, values))
+                current[(table_name, record.pop('__rowid'))] = record
+
+    # 依最後變更的順序輸出
+    changes = [{'table': table_name, 'rowid': row_id, 'row': current.get((table_name, row_id))}
+               for table_name, row_id, _ in rows]
+    return last_change_id, changes
+
+# 刪除已上傳的變更
+def clear_changes(conn: sqlite3.Connection, last_change_id: int) -> None:
+    conn.execute("DELETE FROM sync_changelog WHERE change_id <= ?", (last_change_id,))
+
+# 產生壓縮的變更集
+def encode_changeset(changes: List[Dict[str, Any]]) -> bytes:
+    """
+    返回:
+        bytes: gzip 壓縮的 JSON Lines，第一行為格式資訊
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+        header = {'format': CHANGESET_FORMAT, 'created_at': time.time(), 'count': len(changes)}
+        f.write((json.dumps(header) + '\n').encode('utf-8'))
+        for change in changes:
+            f.write((json.dumps(change, ensure_ascii=False) + '\n').encode('utf-8'))
+    return buffer.getvalue()
+
+# 解析變更集
+def decode_changeset(content: bytes) -> List[Dict[str, Any]]:
+    lines = gzip.decompress(content).decode('utf-8').splitlines()
+    header = json.loads(lines[0])
+    if header.get('format') != CHANGESET_FORMAT:
+        raise ValueError(f"不支援的變更集格式: {header.get('format')}")
+    return [json.loads(line) for line in lines[1:] if line]
+
+# 套用變更集
+def apply_changeset(conn: sqlite3.Connection, changes: List[Dict[str, Any]]) -> int:
+    """
+    將變更套用到資料庫（呼叫端負責交易）
+
+    返回:
+        int: 套用的變更數
+    """
+    for change in changes:
+        table_name, row = change['table'], change['row']
+        if row is None:
+            conn.execute(f"DELETE FROM {table_name} WHERE rowid = ?", (change['rowid'],))
+        else:
+            columns = list(row)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                [row[column] for column in columns]
+            )
+    return len(changes)
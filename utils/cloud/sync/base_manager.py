@@ -43,12 +43,28 @@ class BaseSyncManager:
         # 加載同步狀態
         self.sync_status = self._load_sync_status()
         
-        # 網絡連接狀態
-        self.is_connected = self._check_connection()
+        # 網絡連接狀態（第一次讀取 is_connected 時才檢查，建立管理器不需要等待 Google Drive）
+        self._is_connected = None
         
         # 本地資料庫路徑
         self.db_path = os.path.join(DATA_PATH, 'gas_station.db')
     
+    @property
+    def is_connected(self):
+        """
+        網絡連接狀態
+        
+        返回:
+            bool: 是否連接正常
+        """
+        if self._is_connected is None:
+            self._is_connected = self._check_connection()
+        return self._is_connected
+    
+    @is_connected.setter
+    def is_connected(self, value):
+        self._is_connected = value
+    
     def _load_sync_status(self):
         """
         加載同步狀態文件
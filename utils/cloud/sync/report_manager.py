@@ -3,83 +3,230 @@ Report Sync Manager for GAS_STATION_POS_v2
 報表同步管理功能
 """
 import os
+import json
+import hashlib
 import logging
-from typing import Tuple
+from datetime import datetime
+from typing import Tuple, List, Dict, Any, Optional
 from utils.common import REPORTS_PATH
 from utils.cloud.sync.base_manager import BaseSyncManager
+from utils.cloud.transfer import run_transfers
 
 # 設置日誌
 logger = logging.getLogger(__name__)
 
+# 報表同步清單（保存在緩存目錄）
+REPORT_MANIFEST_FILE = 'report_sync_manifest.json'
+REPORT_MANIFEST_FORMAT = 1
+
+# 計算文件的 SHA-256
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# 上傳報表的傳輸工作：以記錄的ID更新，雲端文件已被刪除時改為依名稱查找或新建
+def _upload_report(local_path: str, folder_id: str, remote_id: Optional[str]):
+    def upload(client):
+        file_id = client.upload_file_to_folder(local_path, folder_id, remote_id)
+        if not file_id and remote_id:
+            file_id = client.upload_file_to_folder(local_path, folder_id)
+        return file_id
+    return upload
+
+# 刪除雲端報表的傳輸工作
+def _delete_report(remote_id: str):
+    return lambda client: True if client.delete_file(remote_id) else None
+
+# 下載報表的傳輸工作
+def _download_report(file_id: str, local_path: str):
+    return lambda client: True if client.download_file(file_id, local_path) else None
+
+# 雲端文件是否比本地文件新（本地不存在或無法判斷時視為較新）
+def _remote_is_newer(file: Dict[str, Any], local_path: str) -> bool:
+    if not os.path.exists(local_path):
+        return True
+    modified_time = file.get('modifiedTime')
+    if not modified_time:
+        return True
+    remote_mod_time = datetime.fromisoformat(modified_time.replace('Z', '+00:00')).timestamp()
+    return remote_mod_time > os.path.getmtime(local_path)
+
 class ReportSyncManager(BaseSyncManager):
     """
     報表同步管理類
     專門用於報表文件的同步管理
     """
     
-    def sync_reports(self) -> Tuple[int, int]:
+    def sync_reports(self, delete_remote: bool = False) -> Tuple[int, int]:
         """
-        同步報表文件
+        同步報表文件，只上傳新增或內容變更的文件
+        
+        本地清單記錄每個文件的大小、修改時間、SHA-256 與雲端文件ID：大小與修改時間相同的文件直接略過，
+        只有修改時間改變的文件比對雜湊後略過，變更的文件以記錄的ID更新雲端文件。
+        沒有需要上傳的文件時不會呼叫 Google Drive。
+        
+        參數:
+            delete_remote (bool): 是否刪除本地已不存在的報表在雲端的副本
         
         返回:
-            Tuple[int, int]: (成功數量, 失敗數量)
+            Tuple[int, int]: (上傳與刪除成功數量, 失敗數量)，未變更的文件不計入
         """
-        # 檢查網絡連接
-        if not self.update_connection_status():
-            logger.warning("網絡連接不可用，無法同步報表")
-            return (0, 0)
-        
         # 檢查報表目錄是否存在
         if not os.path.exists(REPORTS_PATH):
             logger.warning(f"報表目錄不存在: {REPORTS_PATH}")
             return (0, 0)
         
+        manifest = self._load_report_manifest()
+        entries = manifest['files']
+        pending, removed, unchanged = self._scan_reports(entries)
+        
+        if not pending and not (delete_remote and removed):
+            # 本地已刪除的報表不再追蹤
+            for rel_path in removed:
+                del entries[rel_path]
+            if removed:
+                self._save_report_manifest(manifest)
+            logger.info(f"報表沒有變更，略過同步（{unchanged} 個文件）")
+            return (0, 0)
+        
+        # 檢查網絡連接
+        if not self.update_connection_status():
+            logger.warning("網絡連接不可用，無法同步報表")
+            return (0, 0)
+        
         success_count = 0
         fail_count = 0
+        folder_ids = {}
         
-        # 遍歷報表目錄
-        for root, dirs, files in os.walk(REPORTS_PATH):
-            # 獲取相對路徑
-            rel_path = os.path.relpath(root, REPORTS_PATH)
-            remote_dir = f"reports/{rel_path}" if rel_path != '.' else "reports"
+        try:
+            # 先依序確認雲端目錄（每個目錄只確認一次），再同時上傳
+            tasks = []
+            for rel_path, entry in pending:
+                remote_dir = '/'.join(['reports'] + rel_path.split('/')[:-1])
+                if remote_dir not in folder_ids:
+                    folder_ids[remote_dir] = self.drive_connector.ensure_directory(remote_dir)
+                if not folder_ids[remote_dir]:
+                    logger.error(f"創建雲端目錄失敗: {remote_dir}")
+                    fail_count += 1
+                    continue
+                
+                local_file_path = os.path.join(REPORTS_PATH, *rel_path.split('/'))
+                remote_id = entries.get(rel_path, {}).get('remote_id')
+                tasks.append((rel_path, _upload_report(local_file_path, folder_ids[remote_dir], remote_id), entry['size']))
             
-            # 確保雲端目錄存在
-            if not self.drive_connector.ensure_directory(remote_dir):
-                logger.error(f"創建雲端目錄失敗: {remote_dir}")
-                fail_count += len(files)
-                continue
+            uploads = run_transfers(self.drive_connector, tasks, '報表上傳')
+            for rel_path, entry in pending:
+                file_id = uploads['results'].get(rel_path)
+                if file_id:
+                    entries[rel_path] = dict(entry, remote_id=file_id)
+                    success_count += 1
+                elif rel_path in uploads['results']:
+                    logger.error(f"報表同步失敗: reports/{rel_path}")
+                    fail_count += 1
             
-            # 同步文件
-            for file_name in files:
-                local_file_path = os.path.join(root, file_name)
-                remote_file_path = f"{remote_dir}/{file_name}"
-                
-                try:
-                    # 上傳文件
-                    file_id = self.drive_connector.upload_file(local_file_path, None, remote_file_path)
-                    
-                    if file_id:
-                        logger.info(f"報表同步成功: {remote_file_path}")
-                        success_count += 1
-                    else:
-                        logger.error(f"報表同步失敗: {remote_file_path}")
-                        fail_count += 1
-                except Exception as e:
-                    logger.error(f"同步報表時出錯 {remote_file_path}: {str(e)}")
+            # 本地已刪除的報表
+            tasks = []
+            for rel_path in removed:
+                remote_id = entries[rel_path].get('remote_id')
+                if delete_remote and remote_id:
+                    tasks.append((rel_path, _delete_report(remote_id), 0))
+                else:
+                    del entries[rel_path]
+            
+            deletions = run_transfers(self.drive_connector, tasks, '雲端報表刪除')
+            for rel_path, result in deletions['results'].items():
+                if result:
+                    del entries[rel_path]
+                    success_count += 1
+                else:
                     fail_count += 1
+        finally:
+            self._save_report_manifest(manifest)
         
+        logger.info(f"報表同步完成: 上傳 {len(pending)} 個，未變更 {unchanged} 個，"
+                    f"本地已刪除 {len(removed)} 個，失敗 {fail_count} 個")
         return (success_count, fail_count)
     
+    def _scan_reports(self, entries: Dict[str, Dict[str, Any]]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str], int]:
+        """
+        比對報表目錄與清單
+        
+        參數:
+            entries (Dict[str, Dict[str, Any]]): 清單中的文件記錄（只修改時間改變的文件會直接更新）
+        
+        返回:
+            Tuple: (需要上傳的 [(相對路徑, 新記錄)], 本地已刪除的相對路徑, 未變更的文件數)
+        """
+        pending = []
+        seen = set()
+        unchanged = 0
+        
+        for root, dirs, files in os.walk(REPORTS_PATH):
+            dirs.sort()
+            for file_name in sorted(files):
+                local_file_path = os.path.join(root, file_name)
+                rel_path = os.path.relpath(local_file_path, REPORTS_PATH).replace(os.sep, '/')
+                seen.add(rel_path)
+                
+                stat = os.stat(local_file_path)
+                entry = entries.get(rel_path)
+                if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                    unchanged += 1
+                    continue
+                
+                current = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _file_sha256(local_file_path)}
+                if entry and entry.get('remote_id') and entry['sha256'] == current['sha256']:
+                    # 只有修改時間改變，內容相同不需上傳
+                    entries[rel_path] = dict(entry, **current)
+                    unchanged += 1
+                    continue
+                pending.append((rel_path, current))
+        
+        removed = [rel_path for rel_path in entries if rel_path not in seen]
+        return pending, removed, unchanged
+    
+    def _load_report_manifest(self) -> Dict[str, Any]:
+        """
+        返回:
+            Dict[str, Any]: 報表同步清單 {'format', 'files': {相對路徑: {'size', 'mtime_ns', 'sha256', 'remote_id'}}}
+        """
+        path = os.path.join(self.cache_dir, REPORT_MANIFEST_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('format') == REPORT_MANIFEST_FORMAT:
+                    return manifest
+            except Exception as e:
+                logger.error(f"讀取報表同步清單時出錯: {str(e)}")
+        return {'format': REPORT_MANIFEST_FORMAT, 'files': {}}
+    
+    def _save_report_manifest(self, manifest: Dict[str, Any]) -> None:
+        path = os.path.join(self.cache_dir, REPORT_MANIFEST_FILE)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.error(f"保存報表同步清單時出錯: {str(e)}")
+    
     def download_reports(self, remote_dir="reports", local_dir=None) -> Tuple[int, int]:
         """
         從雲端下載報表文件
         
+        逐層列出雲端目錄（同一層的目錄同時列出），再同時下載比本地新的文件；
+        下載到報表目錄的文件會記錄到同步清單，之後不會被當成新文件上傳。
+        
         參數:
             remote_dir (str): 雲端報表目錄
             local_dir (str): 本地保存目錄，預設為REPORTS_PATH
             
         返回:
-            Tuple[int, int]: (成功數量, 失敗數量)
+            Tuple[int, int]: (成功數量, 失敗數量)，已是最新而略過的文件計入成功
         """
         if local_dir is None:
             local_dir = REPORTS_PATH
@@ -89,69 +236,60 @@ class ReportSyncManager(BaseSyncManager):
             logger.warning("網絡連接不可用，無法下載報表")
             return (0, 0)
         
-        # 確保本地目錄存在
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir, exist_ok=True)
-        
         success_count = 0
         fail_count = 0
+        downloads = []
         
-        try:
-            # 獲取雲端目錄中的所有文件
-            files = self.drive_connector.list_files_in_folder(remote_dir)
-            
-            for file in files:
-                file_name = file.get('name')
-                file_id = file.get('id')
-                
-                if not file_name or not file_id:
+        # 逐層列出目錄
+        folders = [(remote_dir, local_dir)]
+        while folders:
+            tasks = [(folder, (lambda path: lambda client: client.list_files(path))(folder[0]), 0) for folder in folders]
+            listing = run_transfers(self.drive_connector, tasks, '雲端報表目錄列出')
+            folders = []
+            for (folder_remote, folder_local), files in listing['results'].items():
+                if files is None:
+                    logger.error(f"列出雲端報表目錄失敗: {folder_remote}")
+                    fail_count += 1
                     continue
                 
-                # 如果是目錄，遞歸下載
-                if file.get('mimeType') == 'application/vnd.google-apps.folder':
-                    sub_remote_dir = f"{remote_dir}/{file_name}"
-                    sub_local_dir = os.path.join(local_dir, file_name)
-                    
-                    # 確保子目錄存在
-                    if not os.path.exists(sub_local_dir):
-                        os.makedirs(sub_local_dir, exist_ok=True)
-                    
-                    # 遞歸下載子目錄
-                    sub_success, sub_fail = self.download_reports(sub_remote_dir, sub_local_dir)
-                    success_count += sub_success
-                    fail_count += sub_fail
-                else:
-                    # 下載文件
-                    local_file_path = os.path.join(local_dir, file_name)
-                    
-                    # 檢查是否需要下載（如果本地文件較新則跳過）
-                    need_download = True
-                    if os.path.exists(local_file_path):
-                        local_mod_time = os.path.getmtime(local_file_path)
-                        remote_mod_time = self.drive_connector.get_file_modified_time(file_id)
-                        
-                        if remote_mod_time is None:
-                            need_download = True
-                        elif isinstance(remote_mod_time, str):
-                            import dateutil.parser
-                            remote_mod_time = dateutil.parser.parse(remote_mod_time).timestamp()
-                            need_download = remote_mod_time > local_mod_time
+                os.makedirs(folder_local, exist_ok=True)
+                for file in files:
+                    file_name = file.get('name')
+                    file_id = file.get('id')
+                    if not file_name or not file_id:
+                        continue
                     
-                    if need_download:
-                        success = self.drive_connector.download_file(file_id, local_file_path)
-                        
-                        if success:
-                            logger.info(f"報表下載成功: {file_name}")
-                            success_count += 1
-                        else:
-                            logger.error(f"報表下載失敗: {file_name}")
-                            fail_count += 1
+                    local_file_path = os.path.join(folder_local, file_name)
+                    if file.get('mimeType') == 'application/vnd.google-apps.folder':
+                        folders.append((f"{folder_remote}/{file_name}", local_file_path))
+                    elif _remote_is_newer(file, local_file_path):
+                        downloads.append((file_id, local_file_path, int(file.get('size') or 0)))
                     else:
                         logger.info(f"報表已是最新，跳過下載: {file_name}")
                         success_count += 1
         
-        except Exception as e:
-            logger.error(f"下載報表時出錯: {str(e)}")
-            fail_count += 1
+        # 同時下載
+        tasks = [(local_file_path, _download_report(file_id, local_file_path), size)
+                 for file_id, local_file_path, size in downloads]
+        results = run_transfers(self.drive_connector, tasks, '報表下載')['results']
+        
+        manifest = self._load_report_manifest()
+        reports_root = os.path.abspath(REPORTS_PATH)
+        for file_id, local_file_path, size in downloads:
+            if not results.get(local_file_path):
+                logger.error(f"報表下載失敗: {local_file_path}")
+                fail_count += 1
+                continue
+            
+            success_count += 1
+            # 記錄到同步清單（內容與雲端相同）
+            abs_path = os.path.abspath(local_file_path)
+            if abs_path.startswith(reports_root + os.sep):
+                stat = os.stat(abs_path)
+                rel_path = os.path.relpath(abs_path, reports_root).replace(os.sep, '/')
+                manifest['files'][rel_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                               'sha256': _file_sha256(abs_path), 'remote_id': file_id}
+        if downloads:
+            self._save_report_manifest(manifest)
         
         return (success_count, fail_count)
@@ -0,0 +1,101 @@
+"""
+Concurrent Drive transfers for GAS_STATION_POS_v2
+以固定大小的執行緒池同時進行多個 Google Drive 上傳、下載或列出目錄
+
+googleapiclient 的服務物件不是執行緒安全的，每個工作執行緒以 GoogleDriveConnector.clone()
+建立自己的連接器（共用憑證與根文件夾，使用獨立的 HTTP 連線）。
+每個傳輸失敗時以指數退避重試，結束後記錄成功數、位元組數與傳輸速率。
+"""
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Tuple
+from utils.metrics import DRIVE_TRANSFERS, DRIVE_TRANSFER_RETRIES
+
+# 設置日誌
+logger = logging.getLogger(__name__)
+
+# 同時進行的傳輸數（Google Drive 對單一使用者的請求頻率有限制，不宜過多）
+TRANSFER_WORKERS = 4
+
+# 每個傳輸的嘗試次數與第一次重試前的等待秒數（之後加倍）
+TRANSFER_ATTEMPTS = 3
+TRANSFER_RETRY_DELAY = 0.5
+
+# 每完成多少比例記錄一次進度
+TRANSFER_PROGRESS_STEP = 0.25
+
+# 傳輸工作：(識別鍵, 以連接器執行傳輸的函式, 傳輸位元組數)；函式返回 None 或拋出例外表示失敗
+TransferTask = Tuple[Any, Callable[[Any], Any], int]
+
+# 同時執行多個傳輸
+def run_transfers(drive_connector, tasks: List[TransferTask], label: str,
+                  workers: int = TRANSFER_WORKERS) -> Dict[str, Any]:
+    """
+    參數:
+        drive_connector (GoogleDriveConnector): 已認證的連接器，各工作執行緒由它建立自己的連接器
+        tasks (List[TransferTask]): 傳輸工作
+        label (str): 日誌與指標使用的名稱（例如 '報表上傳'）
+        workers (int): 最多同時進行的傳輸數
+
+    返回:
+        Dict[str, Any]: {'results': {識別鍵: 結果，失敗為None}, 'succeeded', 'failed', 'retries', 'bytes', 'seconds'}
+    """
+    summary = {'results': {}, 'succeeded': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'seconds': 0.0}
+    if not tasks:
+        return summary
+
+    started = time.perf_counter()
+    local = threading.local()
+    lock = threading.Lock()
+
+    def client():
+        if getattr(local, 'client', None) is None:
+            local.client = drive_connector.clone()
+        return local.client
+
+    def attempt(key, transfer):
+        for number in range(1, TRANSFER_ATTEMPTS + 1):
+            try:
+                result = transfer(client())
+                if result is not None:
+                    return result
+                logger.warning(f"{label}失敗（第 {number} 次）: {key}")
+            except Exception as e:
+                logger.warning(f"{label}出錯（第 {number} 次）: {key}: {str(e)}")
+            if number < TRANSFER_ATTEMPTS:
+                with lock:
+                    summary['retries'] += 1
+                DRIVE_TRANSFER_RETRIES.inc(operation=label)
+                time.sleep(TRANSFER_RETRY_DELAY * (2 ** (number - 1)) * (1 + random.random()))
+        return None
+
+    next_progress = TRANSFER_PROGRESS_STEP
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks))),
+                            thread_name_prefix='drive-transfer') as executor:
+        futures = {executor.submit(attempt, key, transfer): (key, size) for key, transfer, size in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            key, size = futures[future]
+            result = future.result()
+            summary['results'][key] = result
+            if result is None:
+                summary['failed'] += 1
+                DRIVE_TRANSFERS.inc(operation=label, status='failed')
+            else:
+                summary['succeeded'] += 1
+                summary['bytes'] += size
+                DRIVE_TRANSFERS.inc(operation=label, status='succeeded')
+
+            if done / len(tasks) >= next_progress and done < len(tasks):
+                logger.info(f"{label}進度: {done}/{len(tasks)}")
+                while next_progress <= done / len(tasks):
+                    next_progress += TRANSFER_PROGRESS_STEP
+
+    summary['seconds'] = time.perf_counter() - started
+    throughput = summary['bytes'] / summary['seconds'] / 1024 / 1024 if summary['seconds'] > 0 else 0
+    logger.info(f"{label}完成: 成功 {summary['succeeded']}/{len(tasks)} 個，失敗 {summary['failed']} 個，"
+                f"重試 {summary['retries']} 次，{summary['bytes'] / 1024 / 1024:.1f} MB，"
+                f"{summary['seconds']:.1f} 秒，{throughput:.2f} MB/s（{min(workers, len(tasks))} 個執行緒）")
+    return summary
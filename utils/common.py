@@ -3,19 +3,18 @@ import pytz
 import logging
 from datetime import datetime, timedelta
 import shutil
-
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-logger = logging.getLogger(__name__)
+from utils.logging_config import configure_logging
 
 # 配置文件路徑
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_PATH = os.path.join(BASE_PATH, 'data')
-REPORTS_PATH = os.path.join(BASE_PATH, 'reports')
+REPORTS_PATH = os.environ.get('GAS_STATION_REPORTS_PATH') or os.path.join(BASE_PATH, 'reports')
+LOGS_PATH = os.environ.get('GAS_STATION_LOGS_PATH') or os.path.join(BASE_PATH, 'logs')
+
+# 配置日誌（背景執行緒寫入 JSON 日誌檔，見 utils/logging_config.py）
+configure_logging(LOGS_PATH)
+
+logger = logging.getLogger(__name__)
 
 # 獲取台灣時間
 def get_taiwan_time():
@@ -0,0 +1,143 @@
+"""
+回應壓縮模組
+依瀏覽器的 Accept-Encoding 以 brotli 或 gzip 壓縮 HTML 與 JSON 回應，
+static 目錄下的檔案壓縮一次後快取在記憶體中
+"""
+import os
+import gzip
+import threading
+from flask import request, current_app
+from werkzeug.security import safe_join
+from utils.common import logger
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件，未安裝時只使用 gzip
+    brotli = None
+
+# 小於此大小的回應不壓縮（壓縮標頭的成本大於節省的流量）
+COMPRESSION_MIN_SIZE = 500
+
+# 可壓縮的內容類型
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml'
+}
+
+# 壓縮等級（動態回應使用較快的等級，靜態檔案只壓縮一次所以使用最高等級）
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+# 靜態檔案壓縮快取：(路徑, 修改時間, 大小, 編碼) -> 壓縮後內容
+_static_cache = {}
+_static_cache_lock = threading.Lock()
+
+# 壓縮資料
+def _compress(data, encoding, static=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=STATIC_GZIP_LEVEL if static else GZIP_LEVEL, mtime=0)
+
+# 依 Accept-Encoding 選擇編碼
+def choose_encoding(accept_encodings):
+    """
+    參數:
+        accept_encodings (werkzeug.datastructures.Accept): request.accept_encodings
+
+    返回:
+        str: 'br'、'gzip' 或 None
+    """
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+# 取得靜態檔案的壓縮內容（有快取）
+def _compressed_static(path, encoding):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (path, stat.st_mtime_ns, stat.st_size, encoding)
+    with _static_cache_lock:
+        cached = _static_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with open(path, 'rb') as f:
+        data = _compress(f.read(), encoding, static=True)
+
+    with _static_cache_lock:
+        # 移除同一檔案的舊版本
+        for old_key in [k for k in _static_cache if k[0] == path and k[3] == encoding]:
+            del _static_cache[old_key]
+        _static_cache[key] = data
+    return data
+
+# 壓縮回應
+def compress_response(response):
+    """
+    視情況壓縮回應，不符合條件時原樣返回
+
+    不壓縮的情況：串流回應（CSV匯出、ZIP下載等）、已編碼的回應、
+    非文字內容、太小的回應、狀態碼不是 200，以及 Cache-Control: no-transform。
+    """
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if request.endpoint == 'static':
+        # 靜態檔案由 send_file 直接傳送，改用快取的壓縮內容
+        path = safe_join(current_app.static_folder, request.view_args.get('filename', ''))
+        if path is None or (response.content_length or 0) < COMPRESSION_MIN_SIZE:
+            return response
+        data = _compressed_static(path, encoding)
+        if data is None:
+            return response
+        # 關閉 send_file 開啟的檔案
+        if hasattr(response.response, 'close'):
+            response.response.close()
+        response.direct_passthrough = False
+    else:
+        if response.direct_passthrough or response.is_streamed:
+            return response
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return response
+        data = _compress(body, encoding)
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+
+    # 內容已改變，強 ETag 改為弱 ETag（If-None-Match 使用弱比較，304 仍然有效）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+# 在應用中啟用回應壓縮
+def init_compression(app):
+    """註冊 after_request，壓縮所有符合條件的回應"""
+    @app.after_request
+    def compress(response):
+        try:
+            return compress_response(response)
+        except Exception as e:
+            logger.error(f"壓縮回應時出錯: {str(e)}")
+            return response
+
+    logger.info(f"已啟用回應壓縮（{'brotli、' if brotli is not None else ''}gzip）")
@@ -0,0 +1,60 @@
+"""
+延遲載入模組
+pandas、numpy、Google API 等較大的套件在第一次使用時才載入，讓應用啟動與健康檢查不必等待；
+啟動後可以在背景預先載入，第一個請求也不需要等待
+"""
+import types
+import threading
+import importlib
+from utils.common import logger
+
+class LazyModule(types.ModuleType):
+    """第一次存取屬性時才匯入的模組代理"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            # import_module 本身有匯入鎖，多個執行緒同時存取時只會載入一次
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+# 建立延遲載入的模組
+def lazy_import(name):
+    """
+    參數:
+        name (str): 模組名稱，例如 'pandas'
+
+    返回:
+        LazyModule: 使用方式與一般模組相同，例如 pd = lazy_import('pandas'); pd.DataFrame()
+    """
+    return LazyModule(name)
+
+# 在背景預先載入模組
+def preload_in_background(*names):
+    """
+    以背景執行緒匯入模組，應用可以先開始處理請求
+
+    參數:
+        names (str): 模組名稱
+    """
+    def preload():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logger.error(f"預先載入模組 {name} 時出錯: {str(e)}")
+
+    thread = threading.Thread(target=preload, name='preload-modules', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,274 @@
+"""
+日誌設定模組
+請求執行緒只把日誌記錄放入佇列，由背景執行緒（QueueListener）格式化並寫入：
+    logs/gas_station.log  每行一筆 JSON，依大小輪替
+    標準錯誤輸出          文字格式（Docker / gunicorn 收集用）
+
+可用環境變數調整：
+    GAS_STATION_LOG_LEVEL        預設等級（預設 INFO）
+    GAS_STATION_LOG_LEVELS       各模組等級，例如 "main_routes=DEBUG,werkzeug=WARNING"
+                                 （模組可以是日誌名稱或程式檔名）
+    GAS_STATION_LOG_SAMPLE       INFO 以下的取樣限制「筆數/秒數」，例如 "20/60" 表示
+                                 同一行程式碼每 60 秒最多記錄 20 筆，0 表示不取樣（預設 0）
+    GAS_STATION_LOG_MAX_BYTES    日誌檔輪替大小（預設 10MB，0 表示不輪替，交由 logrotate 處理）
+    GAS_STATION_LOG_BACKUPS      保留的舊日誌檔數量（預設 5）
+    GAS_STATION_LOG_CONSOLE      是否輸出到標準錯誤（預設 1）
+
+多 worker 部署時各 worker 寫入同一個檔案；如需嚴格的輪替請設定 GAS_STATION_LOG_MAX_BYTES=0 並使用 logrotate。
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+
+# 日誌檔名稱
+LOG_FILE_NAME = 'gas_station.log'
+
+# 預設值
+DEFAULT_LEVEL = 'INFO'
+# 取樣需明確啟用，預設保留所有日誌
+DEFAULT_SAMPLE = '0'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+# 文字格式（與原本的 basicConfig 相同）
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord 的內建屬性，其餘屬性（extra=...）會一併寫入 JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# 目前使用中的背景寫入器
+_listener = None
+_queue_handler = None
+
+class JsonFormatter(logging.Formatter):
+    """將日誌記錄格式化為單行 JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class ModuleLevelFilter(logging.Filter):
+    """
+    依模組決定記錄的最低等級
+
+    本專案大多共用 utils.common 的 logger，所以除了日誌名稱之外也比對程式檔名（record.module）。
+    """
+
+    def __init__(self, default_level, module_levels=None):
+        super().__init__()
+        self.default_level = default_level
+        self.module_levels = dict(module_levels or {})
+
+    def level_for(self, record):
+        level = self.module_levels.get(record.module)
+        if level is not None:
+            return level
+        name = record.name
+        while name:
+            level = self.module_levels.get(name)
+            if level is not None:
+                return level
+            name = name.rpartition('.')[0]
+        return self.default_level
+
+    def filter(self, record):
+        return record.levelno >= self.level_for(record)
+
+class SamplingFilter(logging.Filter):
+    """
+    限制大量重複的日誌
+
+    同一行程式碼在每個時間區間內最多記錄 limit 筆 INFO 以下的日誌，
+    WARNING 以上與稽核日誌（extra={'audit': True}，例如交易記錄）一律記錄。
+    區間結束後的第一筆記錄會帶上 sampled_dropped（略過的筆數）。
+    """
+
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.WARNING or getattr(record, 'audit', False):
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._counters.get(key)
+            if state is None or now - state[0] >= self.window:
+                dropped = state[2] if state else 0
+                self._counters[key] = [now, 1, 0]
+                if dropped:
+                    record.sampled_dropped = dropped
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    放入佇列前只合併訊息參數，格式化交給背景執行緒
+
+    例外的追蹤資訊無法跨執行緒保留，所以在這裡先轉成文字。
+    """
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# 解析各模組等級設定
+def parse_module_levels(value):
+    """
+    參數:
+        value (str): 例如 "main_routes=DEBUG,werkzeug=WARNING"
+
+    返回:
+        dict: {模組名稱: 等級數值}，格式錯誤的項目會被略過
+    """
+    levels = {}
+    for item in (value or '').split(','):
+        name, _, level = item.partition('=')
+        level = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+# 解析取樣設定
+def parse_sample(value):
+    """
+    參數:
+        value (str): 「筆數/秒數」，例如 "20/60"
+
+    返回:
+        tuple: (筆數, 秒數)，格式錯誤或 0 表示不取樣 (0, 0)
+    """
+    try:
+        limit, _, window = (value or '').partition('/')
+        return int(limit), float(window or 60)
+    except ValueError:
+        return 0, 0
+
+# 建立實際寫入的處理器
+def _build_handlers(logs_path, console):
+    handlers = []
+    try:
+        os.makedirs(logs_path, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(logs_path, LOG_FILE_NAME),
+            maxBytes=int(os.environ.get('GAS_STATION_LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+            backupCount=int(os.environ.get('GAS_STATION_LOG_BACKUPS', DEFAULT_BACKUPS)),
+            encoding='utf-8',
+            delay=True
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    except OSError as e:
+        # 日誌目錄無法寫入時只輸出到標準錯誤
+        console = True
+        print(f"無法建立日誌檔: {str(e)}")
+
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+    return handlers
+
+# fork 後在子程序重新啟動背景寫入器
+def _restart_after_fork():
+    """
+    fork 只會複製呼叫的執行緒，子程序中沒有背景寫入器；
+    佇列的鎖也可能在 fork 時被其他執行緒持有，所以換一個新的佇列。
+    """
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener.queue = log_queue
+    _listener._thread = None
+    _listener.start()
+
+# 停止背景寫入器（寫完佇列中的記錄）
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+# 設定整個應用的日誌
+def configure_logging(logs_path):
+    """
+    以佇列與背景執行緒設定根日誌，取代 logging.basicConfig
+
+    重複呼叫時不會重新設定。
+
+    參數:
+        logs_path (str): 日誌目錄
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    env = os.environ
+    default_level = logging.getLevelName(env.get('GAS_STATION_LOG_LEVEL', DEFAULT_LEVEL).upper())
+    if not isinstance(default_level, int):
+        default_level = logging.INFO
+    module_levels = parse_module_levels(env.get('GAS_STATION_LOG_LEVELS'))
+    limit, window = parse_sample(env.get('GAS_STATION_LOG_SAMPLE', DEFAULT_SAMPLE))
+    console = env.get('GAS_STATION_LOG_CONSOLE', '1') not in ('0', 'false', 'False')
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = _QueueHandler(log_queue)
+    # 過濾在請求執行緒上進行，被略過的記錄不會進入佇列
+    _queue_handler.addFilter(ModuleLevelFilter(default_level, module_levels))
+    if limit > 0:
+        _queue_handler.addFilter(SamplingFilter(limit, window))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    # 根日誌的等級放寬到最低的設定值，實際篩選由 ModuleLevelFilter 負責
+    root.setLevel(min([default_level] + list(module_levels.values())))
+
+    _listener = logging.handlers.QueueListener(log_queue, *_build_handlers(logs_path, console),
+                                               respect_handler_level=True)
+    _listener.start()
+
+    atexit.register(shutdown_logging)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
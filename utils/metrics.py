@@ -0,0 +1,477 @@
+"""
+效能指標模組
+記錄每個路由的延遲分佈、狀態碼次數、處理中的請求數，以及每個請求的SQL執行次數與時間，
+以 Prometheus 文字格式輸出於 /metrics
+
+指標保存在各程序的記憶體中。多 worker 部署時設定環境變數 GAS_STATION_METRICS_DIR（serve.py 以 gunicorn
+啟動時會自動設定），每個程序定期把自己的數值寫入該目錄下以 pid 命名的檔案，抓取時合併所有檔案：
+計數器與分組統計相加（已結束的 worker 也計入），數值指標只加總仍在執行的 worker。
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from flask import request, g, Response
+
+# 指標名稱前綴
+METRIC_PREFIX = 'gas_station'
+
+# 請求延遲的分組上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 每個請求SQL執行次數的分組上限
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# 每個請求SQL時間的分組上限（秒）
+SQL_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# 多程序共用的指標目錄（未設定時只輸出目前程序的數值）
+METRICS_DIR_ENV = 'GAS_STATION_METRICS_DIR'
+
+# 每個程序寫入指標檔案的間隔（秒）
+METRICS_FLUSH_INTERVAL = 5.0
+
+# 跳脫標籤值
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# 組合標籤字串
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+# 格式化數值
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """指標基底類別"""
+
+    kind = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = f"{METRIC_PREFIX}_{name}"
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: self._copy_value(value) for key, value in self._values.items()}
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        items = sorted((self.snapshot() if values is None else values).items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _copy_value(self, value):
+        return value
+
+    def _merge_value(self, current, value):
+        return value if current is None else current + value
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """可增可減的數值"""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """分組統計（累計分組、總和、次數）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _copy_value(self, state):
+        return [list(state[0]), state[1], state[2]]
+
+    def _merge_value(self, current, state):
+        if len(state[0]) != len(self.buckets):
+            # 舊版程式寫入的檔案，分組不同時無法合併
+            return current
+        if current is None:
+            return self._copy_value(state)
+        return [[a + b for a, b in zip(current[0], state[0])], current[1] + state[1], current[2] + state[2]]
+
+    def _render_value(self, key, state):
+        bucket_counts, total, count = state
+        lines = []
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            labels = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+            lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+        labels = _format_labels(self.label_names, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+# 所有已註冊的指標
+_registry = []
+
+# 建立並註冊計數器
+def counter(name, description, label_names=()):
+    metric = Counter(name, description, label_names)
+    _registry.append(metric)
+    return metric
+
+# 建立並註冊數值指標
+def gauge(name, description, label_names=()):
+    metric = Gauge(name, description, label_names)
+    _registry.append(metric)
+    return metric
+
+# 建立並註冊分組統計
+def histogram(name, description, label_names=(), buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, description, label_names, buckets)
+    _registry.append(metric)
+    return metric
+
+# 輸出 Prometheus 文字格式
+def render_metrics():
+    metrics_dir = os.environ.get(METRICS_DIR_ENV)
+    merged = _merge_process_files(metrics_dir) if metrics_dir else {}
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render(merged.get(metric.name)))
+    return '\n'.join(lines) + '\n'
+
+# 已啟動寫入執行緒的程序
+_flusher_pid = None
+_flush_lock = threading.Lock()
+
+# 目前程序的指標檔案路徑
+def _own_metrics_file(metrics_dir):
+    return os.path.join(metrics_dir, f"{os.getpid()}.json")
+
+# 把目前程序的指標寫入共用目錄
+def flush_metrics():
+    """
+    以「寫入暫存檔再取代」的方式寫入，抓取時不會讀到寫到一半的檔案
+
+    返回:
+        bool: 是否已寫入（未設定共用目錄或寫入失敗時為 False）
+    """
+    metrics_dir = os.environ.get(METRICS_DIR_ENV)
+    if not metrics_dir:
+        return False
+    data = {}
+    for metric in _registry:
+        values = metric.snapshot()
+        if values:
+            data[metric.name] = {'kind': metric.kind,
+                                 'values': [[list(key), value] for key, value in values.items()]}
+    path = _own_metrics_file(metrics_dir)
+    temp_path = f"{path}.tmp"
+    with _flush_lock:
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, path)
+            return True
+        except OSError:
+            return False
+
+# 在目前程序啟動定期寫入指標檔案的背景執行緒
+def start_metrics_flusher():
+    """
+    每個 worker 程序各自啟動一次（fork 出的子程序不會繼承執行緒，以 pid 判斷是否需要重新啟動），
+    程序正常結束時再寫入一次
+    """
+    global _flusher_pid
+    if not os.environ.get(METRICS_DIR_ENV) or _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            flush_metrics()
+
+    threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+    atexit.register(flush_metrics)
+
+# 標記已結束的 worker
+def mark_process_dead(pid, metrics_dir=None):
+    """
+    由 gunicorn 的 child_exit 在主程序呼叫：移除該程序的數值指標，並把檔案改名，
+    之後使用相同 pid 的新 worker 不會覆蓋已結束 worker 的計數
+
+    參數:
+        pid (int): 已結束的 worker 程序 ID
+        metrics_dir (str): 指標目錄，預設使用環境變數
+    """
+    metrics_dir = metrics_dir or os.environ.get(METRICS_DIR_ENV)
+    if not metrics_dir:
+        return
+    path = os.path.join(metrics_dir, f"{pid}.json")
+    data = _read_metrics_file(path)
+    if data is None:
+        return
+    data = {name: entry for name, entry in data.items() if entry.get('kind') != 'gauge'}
+    dead_path = os.path.join(metrics_dir, f"dead_{pid}_{time.time_ns()}.json")
+    try:
+        with open(f"{dead_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(f"{dead_path}.tmp", dead_path)
+        os.remove(path)
+    except OSError:
+        pass
+
+# 清空指標目錄（伺服器啟動時呼叫，捨棄上一次執行留下的檔案）
+def reset_metrics_dir(metrics_dir):
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(metrics_dir, name))
+            except OSError:
+                pass
+
+# 讀取一個指標檔案（不存在或內容損壞時返回 None）
+def _read_metrics_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (OSError, ValueError):
+        return None
+
+# 合併所有程序的指標：目前程序使用記憶體中的最新數值，其他程序讀取檔案
+def _merge_process_files(metrics_dir):
+    """
+    返回:
+        dict: {指標名稱: {標籤值: 合併後的數值}}
+    """
+    by_name = {metric.name: metric for metric in _registry}
+    merged = {}
+
+    def add(metric, key, value):
+        values = merged.setdefault(metric.name, {})
+        result = metric._merge_value(values.get(key), value)
+        if result is not None:
+            values[key] = result
+
+    for metric in _registry:
+        for key, value in metric.snapshot().items():
+            add(metric, key, value)
+
+    own_file = os.path.basename(_own_metrics_file(metrics_dir))
+    try:
+        names = sorted(os.listdir(metrics_dir))
+    except OSError:
+        names = []
+    for name in names:
+        if not name.endswith('.json') or name == own_file:
+            continue
+        data = _read_metrics_file(os.path.join(metrics_dir, name))
+        for metric_name, entry in (data or {}).items():
+            metric = by_name.get(metric_name)
+            if metric is None or entry.get('kind') != metric.kind:
+                continue
+            for key, value in entry.get('values', []):
+                if len(key) == len(metric.label_names):
+                    add(metric, tuple(key), value)
+    return merged
+
+# HTTP 請求指標
+REQUEST_LATENCY = histogram('http_request_duration_seconds', '請求處理時間（秒）', ('endpoint', 'method'))
+REQUEST_COUNT = counter('http_requests_total', '請求次數（依狀態碼）', ('endpoint', 'method', 'status'))
+REQUESTS_IN_FLIGHT = gauge('http_requests_in_flight', '處理中的請求數')
+
+# SQL 指標
+REQUEST_SQL_STATEMENTS = histogram('http_request_sql_statements', '每個請求執行的SQL次數',
+                                   ('endpoint',), SQL_COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = histogram('http_request_sql_seconds', '每個請求的SQL時間（秒）',
+                                ('endpoint',), SQL_TIME_BUCKETS)
+SQL_STATEMENTS = counter('sql_statements_total', 'SQL執行次數（含背景工作）')
+SQL_SECONDS = counter('sql_seconds_total', 'SQL執行與讀取結果的總時間（秒）')
+
+# 庫存版本衝突指標（operation: quantity 為交易的數量更新，admin_save 為庫存管理頁面的保存）
+INVENTORY_CONFLICTS = counter('inventory_conflicts_total', '庫存更新遇到版本衝突的次數', ('operation',))
+INVENTORY_CONFLICT_FAILURES = counter('inventory_conflict_failures_total',
+                                      '庫存更新因版本衝突而放棄或被拒絕的次數', ('operation',))
+
+# 資料庫備份指標
+BACKUP_SECONDS = histogram('backup_duration_seconds', '資料庫線上備份時間（秒）', (),
+                           (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+BACKUP_BYTES = counter('backup_bytes_total', '資料庫備份複製的位元組數')
+BACKUP_STORED_BYTES = counter('backup_stored_bytes_total', '備份庫新增的壓縮區塊位元組數（重複內容不計）')
+BACKUP_FAILURES = counter('backup_failures_total', '資料庫備份失敗次數')
+
+# Google Drive 傳輸指標
+DRIVE_TRANSFERS = counter('drive_transfers_total', 'Google Drive 傳輸次數（依結果）', ('operation', 'status'))
+DRIVE_TRANSFER_RETRIES = counter('drive_transfer_retries_total', 'Google Drive 傳輸重試次數', ('operation',))
+
+# 目前執行緒（請求）的SQL統計
+_sql_stats = threading.local()
+
+# 記錄一次SQL時間
+def _record_sql(seconds, statement=False):
+    if statement:
+        SQL_STATEMENTS.inc()
+        _sql_stats.statements = getattr(_sql_stats, 'statements', 0) + 1
+    SQL_SECONDS.inc(seconds)
+    _sql_stats.seconds = getattr(_sql_stats, 'seconds', 0.0) + seconds
+
+class MetricsCursor(sqlite3.Cursor):
+    """記錄執行與讀取時間的游標"""
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            _record_sql(time.perf_counter() - started, statement=True)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            _record_sql(time.perf_counter() - started, statement=True)
+
+    def executescript(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executescript(*args, **kwargs)
+        finally:
+            _record_sql(time.perf_counter() - started, statement=True)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_sql(time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            _record_sql(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_sql(time.perf_counter() - started)
+
+class MetricsConnection(sqlite3.Connection):
+    """
+    所有查詢都經由 MetricsCursor 執行的連線
+
+    由 database.core.init.get_connection 以 factory 參數使用。
+    """
+
+    def cursor(self, factory=MetricsCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def executescript(self, *args, **kwargs):
+        return self.cursor().executescript(*args, **kwargs)
+
+# 在應用中啟用請求指標與 /metrics
+def init_metrics(app):
+    """
+    註冊請求計時並新增 /metrics 路由
+
+    必須在其他 before_request（例如登入檢查）之前呼叫，被重新導向的請求才會被計入。
+    設定了 GAS_STATION_METRICS_DIR 時同時啟動定期寫入指標檔案的背景執行緒。
+    """
+    start_metrics_flusher()
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_recorded = False
+        _sql_stats.statements = 0
+        _sql_stats.seconds = 0.0
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        _observe_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        if 'metrics_started' not in g:
+            return
+        # 未處理的例外不會執行 after_request
+        _observe_request(500)
+        REQUESTS_IN_FLIGHT.dec()
+
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+# 記錄請求的延遲、狀態碼與SQL統計（每個請求只記錄一次）
+def _observe_request(status):
+    if 'metrics_started' not in g or g.metrics_recorded:
+        return
+    g.metrics_recorded = True
+
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_started, endpoint=endpoint, method=request.method)
+    REQUEST_COUNT.inc(endpoint=endpoint, method=request.method, status=str(status))
+    REQUEST_SQL_STATEMENTS.observe(getattr(_sql_stats, 'statements', 0), endpoint=endpoint)
+    REQUEST_SQL_SECONDS.observe(getattr(_sql_stats, 'seconds', 0.0), endpoint=endpoint)
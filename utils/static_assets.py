@@ -0,0 +1,104 @@
+"""
+靜態檔案版本模組
+啟動時計算 static 目錄下每個檔案的內容雜湊，url_for('static', ...) 會自動加上 ?v=雜湊，
+帶有正確雜湊的請求回應長期快取標頭，瀏覽器切換頁面時不需要再重新驗證CSS
+"""
+import os
+import hashlib
+from flask import request
+from utils.common import logger
+
+# 雜湊長度
+FINGERPRINT_LENGTH = 10
+
+# 帶有版本雜湊的靜態檔案快取一年
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# 計算單一檔案的雜湊
+def _file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+# 建立靜態檔案清單
+def build_manifest(static_folder):
+    """
+    計算 static 目錄下所有檔案的雜湊
+
+    參數:
+        static_folder (str): 靜態檔案目錄
+
+    返回:
+        dict: {相對路徑（以 / 分隔）: (修改時間, 大小, 雜湊)}
+    """
+    manifest = {}
+    if not static_folder or not os.path.isdir(static_folder):
+        return manifest
+
+    for root, _, files in os.walk(static_folder):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            stat = os.stat(path)
+            relative = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            manifest[relative] = (stat.st_mtime_ns, stat.st_size, _file_fingerprint(path))
+    return manifest
+
+class StaticAssets:
+    """
+    靜態檔案版本清單
+
+    正式環境只在啟動時計算一次；除錯模式下檔案修改後會重新計算該檔案的雜湊。
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.manifest = build_manifest(static_folder)
+
+    def fingerprint(self, filename, check_changes=False):
+        """返回檔案的雜湊，不在 static 目錄中的檔案返回 None"""
+        filename = filename.lstrip('/')
+        entry = self.manifest.get(filename)
+
+        if check_changes:
+            path = os.path.join(self.static_folder, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+                entry = (stat.st_mtime_ns, stat.st_size, _file_fingerprint(path))
+                self.manifest[filename] = entry
+
+        return entry[2] if entry else None
+
+# 在應用中啟用靜態檔案版本
+def init_static_assets(app):
+    """
+    建立靜態檔案清單，並讓 url_for('static', filename=...) 自動加上版本參數
+
+    範本不需要修改，現有的 url_for('static', ...) 都會輸出帶雜湊的網址。
+    """
+    assets = StaticAssets(app.static_folder)
+    app.extensions['static_assets'] = assets
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint != 'static' or 'filename' not in values or 'v' in values:
+            return
+        fingerprint = assets.fingerprint(values['filename'], check_changes=app.debug)
+        if fingerprint:
+            values['v'] = fingerprint
+
+    @app.after_request
+    def cache_fingerprinted_static(response):
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+        version = request.args.get('v')
+        filename = (request.view_args or {}).get('filename', '')
+        if version and version == assets.fingerprint(filename, check_changes=app.debug):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    logger.info(f"已建立靜態檔案版本清單，共 {len(assets.manifest)} 個檔案")
@@ -0,0 +1,156 @@
+"""
+ZIP串流模組
+將整個目錄即時打包成ZIP串流輸出，不需先在磁碟或記憶體中建立壓縮檔
+"""
+import os
+import struct
+import time
+import zlib
+
+# 每次讀取檔案的區塊大小
+CHUNK_SIZE = 64 * 1024
+
+# ZIP格式常數
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+END_OF_CENTRAL_DIR_SIGNATURE = 0x06054b50
+ZIP_VERSION = 20
+UTF8_FLAG = 0x0800  # 檔名使用UTF-8編碼（中文檔名）
+ZIP_STORED = 0
+
+LOCAL_HEADER_SIZE = 30
+CENTRAL_HEADER_SIZE = 46
+END_OF_CENTRAL_DIR_SIZE = 22
+
+# 不使用ZIP64時的上限
+MAX_ZIP_SIZE = 0xFFFFFFFF
+MAX_ZIP_ENTRIES = 0xFFFF
+
+# 將時間戳轉換為ZIP使用的DOS日期時間格式
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+# 收集目錄下要打包的檔案
+def collect_zip_entries(base_dir):
+    """
+    收集目錄下所有檔案的打包資訊
+
+    參數:
+        base_dir (str): 要打包的目錄
+
+    返回:
+        list: 每個檔案的字典 {'arcname', 'path', 'size', 'mtime'}，依路徑排序
+    """
+    entries = []
+    for root, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            full_path = os.path.join(root, file_name)
+            stat = os.stat(full_path)
+            arcname = os.path.relpath(full_path, base_dir).replace(os.sep, '/')
+            entries.append({
+                'arcname': arcname,
+                'path': full_path,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime
+            })
+    return entries
+
+# 事先計算ZIP檔案的總大小
+def compute_zip_size(entries):
+    """
+    計算以儲存模式（不壓縮）打包時的ZIP總大小，供 Content-Length 使用
+
+    參數:
+        entries (list): collect_zip_entries 的結果
+
+    返回:
+        int: ZIP檔案總位元組數
+    """
+    total = END_OF_CENTRAL_DIR_SIZE
+    for entry in entries:
+        name_length = len(entry['arcname'].encode('utf-8'))
+        total += LOCAL_HEADER_SIZE + name_length + entry['size']
+        total += CENTRAL_HEADER_SIZE + name_length
+    return total
+
+# 檢查是否超出非ZIP64格式的限制
+def can_stream_zip(entries):
+    """檢查檔案數量與大小是否在標準ZIP格式的限制內"""
+    return len(entries) < MAX_ZIP_ENTRIES and compute_zip_size(entries) < MAX_ZIP_SIZE
+
+# 計算檔案的CRC32（只讀取列出時記錄的大小）
+def _file_crc32(path, size):
+    crc = 0
+    remaining = size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise IOError(f"檔案在打包期間被截斷: {path}")
+            crc = zlib.crc32(data, crc)
+            remaining -= len(data)
+    return crc & 0xFFFFFFFF
+
+# 逐塊產生ZIP內容
+def iter_zip_stream(entries):
+    """
+    以儲存模式逐塊產生ZIP檔案內容
+
+    報表為xlsx（本身已壓縮），使用儲存模式讓輸出大小可事先計算，
+    每個檔案在輸出前才計算CRC，記憶體用量只與區塊大小有關。
+
+    參數:
+        entries (list): collect_zip_entries 的結果
+
+    返回:
+        generator: 依序產生ZIP檔案的位元組區塊
+    """
+    central_directory = []
+    offset = 0
+
+    for entry in entries:
+        name = entry['arcname'].encode('utf-8')
+        size = entry['size']
+        dos_time, dos_date = _dos_datetime(entry['mtime'])
+        crc = _file_crc32(entry['path'], size)
+
+        # 本地檔案標頭
+        local_header = struct.pack(
+            '<IHHHHHIIIHH',
+            LOCAL_HEADER_SIGNATURE, ZIP_VERSION, UTF8_FLAG, ZIP_STORED,
+            dos_time, dos_date, crc, size, size, len(name), 0
+        )
+        yield local_header + name
+
+        # 檔案內容
+        remaining = size
+        with open(entry['path'], 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    raise IOError(f"檔案在打包期間被截斷: {entry['path']}")
+                remaining -= len(data)
+                yield data
+
+        # 中央目錄項目（最後輸出）
+        central_directory.append(struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            CENTRAL_HEADER_SIGNATURE, ZIP_VERSION, ZIP_VERSION, UTF8_FLAG, ZIP_STORED,
+            dos_time, dos_date, crc, size, size, len(name), 0, 0, 0, 0, 0, offset
+        ) + name)
+
+        offset += LOCAL_HEADER_SIZE + len(name) + size
+
+    # 中央目錄與結尾記錄
+    central_data = b''.join(central_directory)
+    yield central_data
+    yield struct.pack(
+        '<IHHHHIIH',
+        END_OF_CENTRAL_DIR_SIGNATURE, 0, 0,
+        len(entries), len(entries), len(central_data), offset, 0
+    )